@@ -1,5 +1,5 @@
-from typing import List, Dict
-from pydantic import BaseModel
+from typing import List, Dict, Literal, Optional
+from pydantic import BaseModel, Field
 
 
 class Conversation(BaseModel):
@@ -21,29 +21,140 @@ class Conversation(BaseModel):
 
 
 
-class EvaluationRequest(BaseModel):
+class Question(BaseModel):
     """
-    Represents a request for an evaluation, encapsulating the models, metrics, context,
-    and conversation data required for evaluation purposes.
+    A user question without a bot response, answered by a candidate model before it is
+    evaluated. Other fields of the uploaded row, such as an existing `bot_response`, are ignored.
 
-    This class is intended for use in applications that process and evaluate conversational
-    data. The attributes include information about models to evaluate, evaluation metrics,
-    the context in which the evaluation occurs, and a structured conversation history.
+    :ivar user_question: The question posed by the user.
+    :type user_question: str
+    """
+
+    user_question: str
 
-    :ivar model: List of model identifiers to be evaluated.
+
+
+class EvaluationSettings(BaseModel):
+    """
+    Represents the settings of an evaluation: the judge model, metrics, context and execution
+    options, without the conversations themselves. Used on its own when conversations are
+    streamed into the evaluator instead of being held in a list.
+
+    :ivar model: Identifier of the judge model.
     :type model: str
+    :ivar models: Additional judge models. When given, the conversations are evaluated by
+        `model` and every one of these models, see `judge_models`.
+    :type models: List[str]
     :ivar metrics: List of metrics to be used for the evaluation.
     :type metrics: List[str]
     :ivar context: Context information describing the evaluation environment or scenario.
     :type context: str
-    :ivar conversations: Conversation history, represented as a list of Conversation objects,
-        containing the structured data of the conversational flow.
-    :type conversations: List[Conversation]
+    :ivar batch_size: Number of conversations sent to the judge model in a single prompt.
+        A value of 1 evaluates every conversation on its own.
+    :type batch_size: int
+    :ivar cache_mode: How the evaluation cache is used: "use" reads and writes it, "refresh"
+        skips lookups but stores fresh results, and "bypass" ignores it entirely.
+    :type cache_mode: str
+    :ivar embedding_mode: How similarity-style metrics (relevancy, contextual understanding)
+        use the embedding scorer: "off" sends every metric to the judge model, "score" scores
+        them from embedding similarity, and "triage" keeps embedding scores only where they are
+        clearly low or high and sends the other rows to the judge model.
+    :type embedding_mode: str
+    :ivar dedup: How duplicate conversations are grouped so each group is judged once: "exact"
+        groups identical normalised question/response pairs, "near" also groups near-duplicates
+        (MinHash similarity of at least `dedup_threshold`), and "off" judges every row.
+    :type dedup: str
+    :ivar dedup_threshold: Minimum estimated Jaccard similarity of near-duplicates.
+    :type dedup_threshold: float
+    :ivar context_token_budget: Maximum estimated tokens of context sent per conversation. A
+        longer context is chunked and indexed, and every conversation is sent with only its
+        `context_top_k` most relevant chunks (BM25) that fit the budget. 0 always sends the
+        full context.
+    :type context_token_budget: int
+    :ivar context_top_k: Maximum number of context chunks sent per conversation.
+    :type context_top_k: int
+    :ivar timings: Whether the response includes the time spent per stage of the evaluation
+        (ingest, prompt build, LLM wait, parse, aggregate).
+    :type timings: bool
+    :ivar candidate_model: The model answering the questions in generate-then-evaluate runs.
+    :type candidate_model: str, optional
+    :ivar generation_batch_size: Number of questions sent to the candidate model in one batch.
+    :type generation_batch_size: int
+    :ivar sample_tolerance: Enables sampled evaluation: stratified random rows are judged until
+        the confidence interval of every metric's mean is at most this wide (in score points),
+        and `average_scores` are estimates for the whole dataset.
+    :type sample_tolerance: float, optional
+    :ivar sample_budget: Enables sampled evaluation: at most this many rows are judged.
+    :type sample_budget: int, optional
+    :ivar sample_confidence: Confidence level of the intervals of a sampled evaluation.
+    :type sample_confidence: float
+    :ivar sample_strata: Number of response length strata rows are sampled from.
+    :type sample_strata: int
+    :ivar sample_seed: Seed of the row sampling, for reproducible samples.
+    :type sample_seed: int, optional
+    :ivar spill_results: Whether `/evaluation` writes the per-conversation results to disk and
+        answers with a result id and summary only, keeping memory flat for uploads of any size.
+        The results are read back page by page from `/evaluation/results/{result_id}`.
+    :type spill_results: bool
+    :ivar capture_payloads: Whether the full prompts and judge responses of this evaluation are
+        written to the logs. By default only a small sample is logged, truncated.
+    :type capture_payloads: bool
     """
 
     model: str
+    models: List[str] = Field(default_factory=list)
     metrics: List[str]
     context: str
+    batch_size: int = Field(default=1, ge=1)
+    cache_mode: Literal["use", "bypass", "refresh"] = "use"
+    embedding_mode: Literal["off", "score", "triage"] = "off"
+    dedup: Literal["off", "exact", "near"] = "exact"
+    dedup_threshold: float = Field(default=0.8, gt=0, le=1)
+    context_token_budget: int = Field(default=1500, ge=0)
+    context_top_k: int = Field(default=4, ge=1)
+    candidate_model: Optional[str] = None
+    generation_batch_size: int = Field(default=8, ge=1)
+    sample_tolerance: Optional[float] = Field(default=None, gt=0)
+    sample_budget: Optional[int] = Field(default=None, ge=1)
+    sample_confidence: float = Field(default=0.95, gt=0, lt=1)
+    sample_strata: int = Field(default=4, ge=1)
+    sample_seed: Optional[int] = None
+    spill_results: bool = False
+    capture_payloads: bool = False
+    timings: bool = False
+
+    @property
+    def judge_models(self) -> List[str]:
+        """
+        All judge models of the evaluation, `model` first, without duplicates.
+        """
+
+        return list(dict.fromkeys([self.model, *self.models]))
+
+    @property
+    def sampled(self) -> bool:
+        """
+        Whether only a sample of the conversations is judged, see `sample_tolerance`.
+        """
+
+        return self.sample_tolerance is not None or self.sample_budget is not None
+
+
+
+class EvaluationRequest(EvaluationSettings):
+    """
+    Represents a request for an evaluation, encapsulating the models, metrics, context,
+    and conversation data required for evaluation purposes.
+
+    This class is intended for use in applications that process and evaluate conversational
+    data. The attributes include information about models to evaluate, evaluation metrics,
+    the context in which the evaluation occurs, and a structured conversation history.
+
+    :ivar conversations: Conversation history, represented as a list of Conversation objects,
+        containing the structured data of the conversational flow.
+    :type conversations: List[Conversation]
+    """
+
     conversations: List[Conversation]
 
 
@@ -67,3 +178,15 @@ class EvaluationResult(BaseModel):
     scores: Dict[str, float]
     feedback: str
 
+
+
+class BatchEvaluationResult(EvaluationResult):
+    """
+    Represents one entry of a batched evaluation reply, where the judge model scores several
+    conversations in a single response and keys each result by the conversation's id.
+
+    :ivar id: The id the conversation was given in the batched prompt.
+    :type id: int
+    """
+
+    id: int
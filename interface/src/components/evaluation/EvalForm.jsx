@@ -1,7 +1,7 @@
 import {useEffect, useState} from "react";
 import Select from "react-select";
 import {useDropzone} from "react-dropzone";
-import {submitEvaluation} from "../../services/api";
+import {streamEvaluation} from "../../services/api";
 import hljs from "highlight.js/lib/core";
 import json from "highlight.js/lib/languages/json";
 import 'highlight.js/styles/night-owl.min.css';
@@ -30,7 +30,7 @@ const EvaluationForm = ({setEvaluation, setMessages, setBenchmarkData}) => {
         if (uploadedFile) formData.append("conversation_file", uploadedFile);
 
         try {
-            const response = await submitEvaluation(formData);
+            const response = await streamEvaluation(formData);
 
             if (response && response.data) {
                 setMessages([]);
@@ -40,3 +40,68 @@ export const submitEvaluation = async (data) => {
         return null;
     }
 };
+
+const parseEvent = (raw) => {
+    const event = {type: "message", data: ""};
+    raw.split("\n").forEach(line => {
+        if (line.startsWith("event:")) event.type = line.slice(6).trim();
+        else if (line.startsWith("data:")) event.data += line.slice(5).trim();
+    });
+    event.data = event.data ? JSON.parse(event.data) : null;
+    return event;
+};
+
+export const streamEvaluation = async (data, onEvent) => {
+    // Streams /evaluation/stream instead of waiting for the whole run, so there is no request
+    // timeout; resolves with the same shape as submitEvaluation once the summary arrives
+    try {
+        const response = await fetch("http://localhost:9000/evaluation/stream", {method: "POST", body: data});
+
+        if (!response.ok || !response.headers.get("content-type")?.startsWith("text/event-stream")) {
+            console.error("Invalid API response structure:", await response.text());
+            return null;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const results = [];
+        let buffer = "";
+        let summary = null;
+
+        while (true) {
+            const {done, value} = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, {stream: true});
+
+            let boundary;
+            while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                const event = parseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+
+                if (onEvent) onEvent(event);
+
+                if (event.type === "result") {
+                    results[event.data.index] = event.data;
+                } else if (event.type === "summary") {
+                    summary = event.data;
+                } else if (event.type === "error") {
+                    console.error("API Error:", event.data.error);
+                    return null;
+                }
+            }
+        }
+
+        if (!summary) return null;
+
+        const conversations = results.filter(Boolean).flatMap(result => [
+            {text: result.user_question, sender: "user"},
+            {text: result.bot_response, sender: "bot", evaluation: result.evaluation},
+        ]);
+
+        return {code: 200, data: {average_scores: summary.average_scores, conversations}};
+    } catch (error) {
+        console.error("API Error:", error);
+        return null;
+    }
+};
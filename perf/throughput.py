@@ -0,0 +1,312 @@
+"""
+End-to-end throughput benchmark of the evaluation pipeline, driven by the offline fake judge
+(`utils.fake_model`) so no provider quota is spent.
+
+Every scenario runs in a fresh Python process so its peak RSS is measured in isolation, and
+with its own temporary cache / job / benchmark databases. Two targets are available:
+
+- `evaluator`: rows are pulled straight into `Evaluator.iter_results` and aggregated, like
+  the SSE endpoint does. Row latency runs from the row being pulled to its result.
+- `http`: a uvicorn server is started in-process and rows are uploaded to `/evaluation/stream`
+  as a streamed multipart body. Row latency runs from the row being sent to its `result`
+  event arriving, so it includes the upload and the response stream.
+
+Usage, from the repository root:
+
+    python -m perf.throughput --sizes 10000 100000 1000000 --latency-ms 50
+    python -m perf.throughput --target http --sizes 10000 --batch-size 8 --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from glob import glob
+from typing import Any, Dict, Iterator, List
+
+
+METRICS = ["accuracy", "relevancy", "coherence", "contextual_understanding", "question_clarity",
+           "conciseness_completeness"]
+
+CONTEXT = "A general knowledge assistant answering short factual questions."
+
+_TOPICS = ["geography", "history", "physics", "cooking", "finance", "music", "biology", "software",
+           "astronomy", "literature", "sports", "medicine"]
+
+
+def synthetic_rows(count: int, seed: int = 0) -> Iterator[Dict[str, str]]:
+    """
+    Yields `count` deterministic synthetic conversations without materialising the dataset, so
+    the generator itself stays out of the measured memory.
+    """
+
+    for index in range(count):
+        topic = _TOPICS[(index * 7 + seed) % len(_TOPICS)]
+        yield {
+            "user_question": f"Question {index} ({seed}): what is an important fact about {topic}?",
+            "bot_response": f"An important fact about {topic} is number {index % 997}. "
+                            + "It is explained in a couple of sentences to look like a real answer. " * (1 + index % 3),
+        }
+
+
+def fixture_rows(path: str) -> Iterator[Dict[str, str]]:
+    with open(path) as file:
+        yield from json.load(file)
+
+
+def dataset_rows(dataset: Dict[str, Any]) -> Iterator[Dict[str, str]]:
+    if dataset["kind"] == "fixture":
+        return fixture_rows(dataset["path"])
+    return synthetic_rows(dataset["rows"], dataset.get("seed", 0))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize_run(rows: int, elapsed: float, latencies: array, failed: int) -> Dict[str, Any]:
+    import numpy as np
+
+    values = np.frombuffer(latencies, dtype=np.float64) if len(latencies) else np.zeros(1)
+    p50, p99 = np.percentile(values, [50, 99])
+
+    return {
+        "rows": rows,
+        "failed_rows": failed,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+        "p50_ms": round(float(p50) * 1000, 1),
+        "p99_ms": round(float(p99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run_evaluator(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    from data_models.evaluation import Conversation, EvaluationSettings
+    from utils.aggregation import ScoreAggregator
+    from utils.benchmarks import get_benchmark_store
+    from utils.cache import get_cache
+    from utils.evaluation import Evaluator
+    from utils.registry import get_registry
+    from utils.scheduler import get_scheduler
+
+    settings = EvaluationSettings(model=scenario["model"], metrics=METRICS, context=CONTEXT,
+                                  batch_size=scenario["batch_size"], cache_mode=scenario["cache_mode"])
+    evaluator = Evaluator(
+        get_registry().chat(settings.model),
+        scheduler=get_scheduler(settings.model),
+        cache=get_cache(),
+        cache_mode=settings.cache_mode,
+        benchmarks=get_benchmark_store() if scenario["record"] else None
+    )
+
+    started: Dict[int, float] = {}
+    latencies = array("d")
+
+    def conversations() -> Iterator[Conversation]:
+        for index, row in enumerate(dataset_rows(scenario["dataset"])):
+            started[index] = time.perf_counter()
+            yield Conversation(**row)
+
+    aggregator = ScoreAggregator(settings.metrics)
+    failed = 0
+    begin = time.perf_counter()
+
+    async for index, _, result in evaluator.iter_results(conversations(), settings):
+        latencies.append(time.perf_counter() - started.pop(index))
+        aggregator.add(result)
+        failed += not result.scores
+
+    await asyncio.to_thread(aggregator.statistics)
+    elapsed = time.perf_counter() - begin
+
+    return summarize_run(aggregator.count, elapsed, latencies, failed)
+
+
+async def run_http(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    import httpx
+    import uvicorn
+    from server import app
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    boundary = "perf-throughput-boundary"
+    fields = {
+        "model": scenario["model"],
+        "metrics": json.dumps(METRICS),
+        "context": CONTEXT,
+        "batch_size": str(scenario["batch_size"]),
+        "cache_mode": scenario["cache_mode"],
+    }
+    sent = array("d")
+    latencies = array("d")
+
+    async def body():
+        for name, value in fields.items():
+            yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n").encode()
+        yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"conversation_file\"; "
+               f"filename=\"rows.jsonl\"\r\nContent-Type: application/x-ndjson\r\n\r\n").encode()
+
+        chunk = []
+        for row in dataset_rows(scenario["dataset"]):
+            sent.append(time.perf_counter())
+            chunk.append(json.dumps(row))
+            if len(chunk) == 256:
+                yield ("\n".join(chunk) + "\n").encode()
+                chunk = []
+        if chunk:
+            yield ("\n".join(chunk) + "\n").encode()
+
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    rows = failed = 0
+    begin = time.perf_counter()
+
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            async with client.stream("POST", f"http://127.0.0.1:{port}/evaluation/stream", content=body(),
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}) as response:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: ") and event == "result":
+                        data = json.loads(line[len("data: "):])
+                        latencies.append(time.perf_counter() - sent[data["index"]])
+                        rows += 1
+                        failed += not data["evaluation"]["scores"]
+                    elif line.startswith("data: ") and event == "error":
+                        raise RuntimeError(f"Evaluation failed: {line[len('data: '):]}")
+
+        elapsed = time.perf_counter() - begin
+    finally:
+        server.should_exit = True
+        await serving
+
+    return summarize_run(rows, elapsed, latencies, failed)
+
+
+def run_scenario(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs one scenario in the current process. Storage and fake judge settings are applied
+    through the environment before the application modules are imported.
+    """
+
+    storage = tempfile.mkdtemp(prefix="perf-throughput-")
+    os.environ["EVALUATION_CACHE_PATH"] = os.path.join(storage, "cache.sqlite3")
+    os.environ["EVALUATION_JOBS_PATH"] = os.path.join(storage, "jobs.sqlite3")
+    os.environ["EVALUATION_BENCHMARKS_PATH"] = os.path.join(storage, "benchmarks.sqlite3")
+    for name, value in scenario["judge"].items():
+        os.environ[f"FAKE_JUDGE_{name.upper()}"] = str(value)
+
+    import logging
+    from utils.logs import setup_logger
+    setup_logger("evaluation")
+    logging.getLogger("evaluation").setLevel(scenario["log_level"])
+
+    runner = run_http if scenario["target"] == "http" else run_evaluator
+    return asyncio.run(runner(scenario))
+
+
+def datasets(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    selected = []
+
+    if "fixtures" in args.datasets:
+        for path in sorted(glob(os.path.join(args.fixtures_dir, "*.json"))):
+            selected.append({"name": os.path.basename(path), "kind": "fixture", "path": path})
+
+    if "synthetic" in args.datasets:
+        for size in args.sizes:
+            selected.append({"name": f"synthetic-{size}", "kind": "synthetic", "rows": size, "seed": args.seed})
+
+    return selected
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the evaluation pipeline with a fake judge.")
+    parser.add_argument("--target", choices=["evaluator", "http"], default="evaluator")
+    parser.add_argument("--datasets", nargs="+", choices=["fixtures", "synthetic"], default=["fixtures", "synthetic"])
+    parser.add_argument("--fixtures-dir", default="conversation-data")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10_000])
+    parser.add_argument("--model", default="fake-judge")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--cache-mode", choices=["use", "bypass", "refresh"], default="bypass")
+    parser.add_argument("--record", action="store_true", help="Persist every run in the benchmark store.")
+    parser.add_argument("--latency", choices=["constant", "uniform", "lognormal", "exponential"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.5)
+    parser.add_argument("--per-row-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING",
+                        help="Level of the evaluation logger; INFO includes the per-call prompt logging.")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file.")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return
+
+    judge = {
+        "latency": args.latency,
+        "latency_ms": args.latency_ms,
+        "latency_jitter": args.latency_jitter,
+        "per_row_ms": args.per_row_ms,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "malformed_rate": args.malformed_rate,
+        "seed": args.seed,
+    }
+
+    results = []
+    print(f"{'dataset':<28} {'rows':>9} {'failed':>7} {'rows/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12}")
+
+    for dataset in datasets(args):
+        scenario = {
+            "target": args.target,
+            "dataset": dataset,
+            "model": args.model,
+            "batch_size": args.batch_size,
+            "cache_mode": args.cache_mode,
+            "record": args.record,
+            "judge": judge,
+            "log_level": args.log_level,
+        }
+
+        completed = subprocess.run([sys.executable, "-m", "perf.throughput", "--scenario", json.dumps(scenario)],
+                                   capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{dataset['name']:<28} failed:\n{completed.stderr}", file=sys.stderr)
+            continue
+
+        result = {"dataset": dataset["name"], "target": args.target, "batch_size": args.batch_size,
+                  **json.loads(completed.stdout.strip().splitlines()[-1])}
+        results.append(result)
+        print(f"{result['dataset']:<28} {result['rows']:>9} {result['failed_rows']:>7} {result['rows_per_sec']:>10} "
+              f"{result['p50_ms']:>9} {result['p99_ms']:>9} {result['peak_rss_mb']:>12}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as file:
+            json.dump({"judge": judge, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
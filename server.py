@@ -1,17 +1,61 @@
+import time
+
+#   Importing the app is most of a worker's cold start, see IMPORT_SECONDS
+_import_started = time.perf_counter()
+
+import asyncio
 import json
 import os
-import shutil
-import tempfile
 import traceback
-from fastapi import FastAPI, File, UploadFile, Form
+from contextlib import asynccontextmanager
+from typing import Dict, List
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from data_models.evaluation import EvaluationRequest
-from utils.evaluation import Evaluator, get_model
+from fastapi.responses import JSONResponse, PlainTextResponse
+from data_models.evaluation import EvaluationSettings
+from utils.evaluation import BotResponseGenerator, Evaluator
+from utils.registry import get_registry
+from utils.aggregation import summarize
+from utils.benchmarks import get_benchmark_store
+from utils.cache import get_cache
+from utils.embeddings import get_embedding_scorer
+from utils.events import END, UploadStreamingResponse, evaluation_events, iter_queue, panel_events
+from utils.generation import GenerationPipeline
+from utils.ingest import IngestionError, StreamingForm, iter_conversations, iter_questions
+from utils.jobs import get_job_manager
+from utils.judge_output import JudgeStats, get_judge_stats
+from utils.judges import JudgePanel, judge_settings
+from utils.logs import setup_logger
+from utils.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, ROWS_PER_SECOND, Counter, Gauge, get_metrics
+from utils.results import ChunkedEvaluation, get_result_store
+from utils.scheduler import get_scheduler, scheduler_stats
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
-app = FastAPI()
+#   Seconds spent importing the server and its dependencies, LangChain excluded as it is only
+#   imported when a model is first used. Workers forked by `utils.workers.serve` inherit the
+#   imported modules and do not pay this again.
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+logger = setup_logger("evaluation")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info(f"Worker {os.getpid()} starting, server modules imported in {IMPORT_SECONDS * 1000:.0f} ms")
+
+    # Build the judge clients listed in WARMUP_MODELS (comma-separated) before serving traffic,
+    # WARMUP_PING=1 also sends one request through each to open the connections
+    await get_registry().warmup(
+        os.environ.get("WARMUP_MODELS", "").split(","),
+        ping=os.environ.get("WARMUP_PING") == "1"
+    )
+    await get_job_manager(_job_evaluator).start()
+    yield
+    await get_job_manager().stop()
+    await get_registry().aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 
@@ -25,57 +69,442 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    started = time.perf_counter()
+    with HTTP_IN_FLIGHT.track():
+        response = await call_next(request)
+
+    # Labelled by route template so ids in paths do not create a series per request
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method, route=getattr(route, "path", "other"), status=str(response.status_code)
+    )
+    return response
+
+
+def _component_metrics() -> List:
+    """
+    Reports the statistics kept by the judge reply parser, the evaluation cache and the provider
+    schedulers as metrics, at scrape time.
+    """
+
+    metrics = []
+
+    judges = get_judge_stats().stats()
+    for field in JudgeStats.FIELDS:
+        counter = Counter(f"judge_{field}_total", f"Judge {field.replace('_', ' ')} per model.", ["model"])
+        for model, values in judges.items():
+            counter.inc(values[field], model=model)
+        metrics.append(counter)
+
+    cache = get_cache().stats()
+    lookups = Counter("evaluation_cache_lookups_total", "Evaluation cache lookups by result.", ["result"])
+    for result in ("memory_hits", "disk_hits", "misses"):
+        lookups.inc(cache[result], result=result)
+    entries = Gauge("evaluation_cache_entries", "Evaluation cache entries per tier.", ["tier"])
+    entries.set(cache["memory_entries"], tier="memory")
+    entries.set(cache["disk_entries"], tier="disk")
+    metrics.extend([lookups, entries])
+
+    schedulers = {
+        name: Gauge(f"scheduler_{name}", f"Provider scheduler {name.replace('_', ' ')}.", ["provider"])
+        for name in ("in_flight", "concurrency_limit", "waiting")
+    }
+    for provider, values in scheduler_stats().items():
+        for name, gauge in schedulers.items():
+            gauge.set(values[name], provider=provider)
+    metrics.extend(schedulers.values())
+
+    rate = Gauge("evaluation_rows_per_second", "Conversations evaluated per second over the last minute.")
+    rate.set(ROWS_PER_SECOND.rate())
+    metrics.append(rate)
+
+    imported = Gauge("process_import_seconds", "Seconds spent importing the server modules at startup.")
+    imported.set(IMPORT_SECONDS)
+    metrics.append(imported)
+
+    return metrics
+
+
+get_metrics().register_collector(_component_metrics)
+
+
 @app.get("/")
 async def home():
     return FileResponse(os.path.join("frontend", "index.html"))
 
 
 
+def _evaluation_settings(fields: Dict[str, str]) -> EvaluationSettings:
+    """
+    Builds and validates the evaluation settings from the plain fields of the evaluation form.
+    """
+
+    # Extra judges come as a JSON list in `models`; `model` defaults to the first of them
+    models = json.loads(fields.get("models", "[]"))
+
+    return EvaluationSettings(
+        model=fields.get("model") or next(iter(models), None),
+        models=models,
+        metrics=json.loads(fields.get("metrics", "null")),
+        context=fields.get("context"),
+        batch_size=fields.get("batch_size", 1),
+        cache_mode=fields.get("cache_mode", "use"),
+        embedding_mode=fields.get("embedding_mode", "off"),
+        dedup=fields.get("dedup", "exact"),
+        dedup_threshold=fields.get("dedup_threshold", 0.8),
+        context_token_budget=fields.get("context_token_budget", 1500),
+        context_top_k=fields.get("context_top_k", 4),
+        capture_payloads=fields.get("capture_payloads", False),
+        timings=fields.get("timings", False),
+        candidate_model=fields.get("candidate_model"),
+        generation_batch_size=fields.get("generation_batch_size", 8),
+        sample_tolerance=fields.get("sample_tolerance"),
+        sample_budget=fields.get("sample_budget"),
+        sample_confidence=fields.get("sample_confidence", 0.95),
+        sample_strata=fields.get("sample_strata", 4),
+        sample_seed=fields.get("sample_seed"),
+        spill_results=fields.get("spill_results", False)
+    )
+
+
+def _evaluator(settings: EvaluationSettings, priority: int = 0, record: bool = True) -> Evaluator:
+    return Evaluator(
+        get_registry().chat(settings.model),
+        scheduler=get_scheduler(settings.model),
+        cache=get_cache(),
+        cache_mode=settings.cache_mode,
+        priority=priority,
+        benchmarks=get_benchmark_store() if record else None,
+        scorer=get_embedding_scorer() if settings.embedding_mode != "off" else None
+    )
+
+
+def _panel(settings: EvaluationSettings) -> JudgePanel:
+    return JudgePanel({judge: _evaluator(judge_settings(settings, judge)) for judge in settings.judge_models})
+
+
+def _unsupported(message: str) -> JSONResponse:
+    # Form options an endpoint cannot honour are rejected rather than silently ignored
+    return JSONResponse(content={"code": 400, "error": message}, status_code=400)
+
+
+def _job_evaluator(settings: EvaluationSettings, priority: int) -> Evaluator:
+    # Background jobs always queue behind interactive requests (priority 0) for judge calls,
+    # and the job manager records their benchmark run itself once all rows are done
+    return _evaluator(settings, priority=1 + max(0, priority), record=False)
+
+
 @app.post("/evaluation")
-async def evaluate(
-    model: str = Form(...),
-    metrics: str = Form(...),
-    context: str = Form(...),
-    conversation_file: UploadFile = File(...)
-):
+async def evaluate(request: Request):
+    """
+    Evaluates an uploaded conversation file (JSON array or JSONL). The multipart body is parsed
+    incrementally: the form fields `model`, `metrics`, `context` and optionally `batch_size`,
+    `cache_mode`, `embedding_mode`, `dedup`, `dedup_threshold`, `context_token_budget`,
+    `context_top_k`, `capture_payloads` and `timings` are read first, then rows of
+    `conversation_file` are validated and handed to the evaluator while the rest of the file is
+    still being received. With `timings=true` the response includes the time spent per stage.
+
+    Several judges can be given as a JSON list in `models`; the file is then parsed once and
+    evaluated by all of them concurrently, and the response adds per-judge results and their
+    agreement statistics.
+
+    With `sample_tolerance` and/or `sample_budget` only a stratified sample of the file is judged
+    (optionally tuned by `sample_confidence`, `sample_strata` and `sample_seed`), and the response
+    adds a `sampling` summary with the sample size and the confidence interval of every metric.
+
+    With `spill_results=true` the per-conversation results are stored on disk instead of being
+    returned; the response holds the summary and a `result_id` for `/evaluation/results/{result_id}`.
+    """
+
     try:
-        # Reading the uploaded conversation file
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            shutil.copyfileobj(conversation_file.file, temp_file)
-            temp_file_path = temp_file.name
-
-        with open(temp_file_path, "r", encoding="utf-8") as f:
-            conversation_data = json.load(f)
-
-        if not isinstance(conversation_data, list) or any(
-            "user_question" not in item or "bot_response" not in item
-            for item in conversation_data
-        ):
-            return {"error": "Invalid JSON format"}
-
-
-        structured_request = EvaluationRequest(
-            model=model,
-            metrics=json.loads(metrics),
-            context=context,
-            conversations=conversation_data
-        )
+        form = StreamingForm(request)
+        settings = _evaluation_settings(await form.read_fields())
 
-        model = get_model(structured_request.model)
-        chat_llm = model["chat"]
+        if form.file_field is None:
+            return {"error": "Missing conversation_file"}
+        if settings.sampled and len(settings.judge_models) > 1:
+            return _unsupported("Sampled evaluations support a single judge model")
+        if settings.spill_results and (settings.sampled or len(settings.judge_models) > 1):
+            return _unsupported("spill_results supports a single judge model without sampling")
 
-        evaluator = Evaluator(chat_llm)
-        evaluation_result = await evaluator.evaluate_conversation(structured_request)
+        if settings.spill_results:
+            evaluator = ChunkedEvaluation(_evaluator(settings), get_result_store())
+        else:
+            evaluator = _panel(settings) if len(settings.judge_models) > 1 else _evaluator(settings)
+        evaluation_result = await evaluator.evaluate_stream(iter_conversations(form.iter_file()), settings)
 
         return JSONResponse(content={"code": 200, "data": evaluation_result}, status_code=200)
 
+    except IngestionError as e:
+        return {"error": f"Invalid JSON format: {str(e)}"}
+
     except Exception as e:
         print(f"Error processing evaluation request: {str(e)}\n\nStack Trace:{traceback.format_exc()}")
         return {"error": str(e)}
 
 
+@app.post("/evaluation/stream")
+async def evaluate_events(request: Request):
+    """
+    Same form as `/evaluation`, but answers with a text/event-stream of `result` events (one
+    per conversation, in completion order), periodic `average` events with the running
+    `average_scores`, and a final `summary` event. With several judges, see `utils.events.panel_events`.
+    """
+
+    try:
+        form = StreamingForm(request)
+        settings = _evaluation_settings(await form.read_fields())
+
+        if form.file_field is None:
+            return {"error": "Missing conversation_file"}
+        if settings.sampled:
+            return _unsupported("Sampled evaluations are not available as an event stream")
+        if settings.spill_results:
+            return _unsupported("spill_results is not available as an event stream")
+
+        # Both queues are bounded by the evaluator window, so a slow judge or a slow client
+        # pauses the upload instead of buffering it in memory
+        window = Evaluator.window
+        rows, events = asyncio.Queue(maxsize=window), asyncio.Queue(maxsize=window)
+        upload_done = asyncio.Event()
+
+        if len(settings.judge_models) > 1:
+            events_source = panel_events(_panel(settings), iter_queue(rows), settings)
+        else:
+            events_source = evaluation_events(_evaluator(settings), iter_queue(rows), settings)
+
+        async def upload():
+            try:
+                async for conversation in iter_conversations(form.iter_file()):
+                    await rows.put(conversation)
+                await rows.put(END)
+            except IngestionError as e:
+                await rows.put(IngestionError(f"Invalid JSON format: {str(e)}"))
+            except Exception as e:
+                await rows.put(e)
+            finally:
+                upload_done.set()
+
+        async def produce():
+            async for event in events_source:
+                await events.put(event)
+            await events.put(END)
+
+        # Events are sent while the upload is still being read, so clients have to read the
+        # response concurrently with sending the body
+        uploader = asyncio.create_task(upload())
+        producer = asyncio.create_task(produce())
+
+        async def stream():
+            try:
+                async for event in iter_queue(events):
+                    yield event
+            finally:
+                uploader.cancel()
+                producer.cancel()
+
+        return UploadStreamingResponse(
+            stream(),
+            upload_done,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    except IngestionError as e:
+        return {"error": f"Invalid JSON format: {str(e)}"}
+
+    except Exception as e:
+        print(f"Error processing evaluation request: {str(e)}\n\nStack Trace:{traceback.format_exc()}")
+        return {"error": str(e)}
+
+
+@app.post("/evaluation/generate")
+async def generate_and_evaluate(request: Request):
+    """
+    Benchmarks a candidate model end to end: the uploaded file holds only `user_question`s,
+    `candidate_model` answers them in batches of `generation_batch_size`, and the judge
+    (`model`) evaluates every answer as soon as it is generated. The other form fields are
+    those of `/evaluation`; the response has the same structure plus a `generation` summary.
+    """
+
+    try:
+        form = StreamingForm(request)
+        settings = _evaluation_settings(await form.read_fields())
+
+        if form.file_field is None:
+            return {"error": "Missing question file"}
+        if not settings.candidate_model:
+            return {"error": "Missing candidate_model"}
+        if settings.sampled:
+            return _unsupported("Generate-then-evaluate runs do not support sampling")
+        if settings.spill_results:
+            return _unsupported("Generate-then-evaluate runs do not support spill_results")
+        if len(settings.judge_models) > 1:
+            return _unsupported("Generate-then-evaluate runs support a single judge model")
+
+        pipeline = GenerationPipeline(
+            BotResponseGenerator(get_registry().chat(settings.candidate_model)),
+            _evaluator(settings),
+            scheduler=get_scheduler(settings.candidate_model)
+        )
+        evaluation_result = await pipeline.evaluate_stream(iter_questions(form.iter_file()), settings)
+
+        return JSONResponse(content={"code": 200, "data": evaluation_result}, status_code=200)
+
+    except IngestionError as e:
+        return {"error": f"Invalid JSON format: {str(e)}"}
+
+    except Exception as e:
+        print(f"Error processing generation request: {str(e)}\n\nStack Trace:{traceback.format_exc()}")
+        return {"error": str(e)}
+
+
+@app.post("/evaluation/jobs")
+async def create_evaluation_job(request: Request):
+    """
+    Same form as `/evaluation` plus an optional integer `priority` (lower runs first, default 0).
+    The conversations are stored and the id of the queued job is returned immediately.
+    """
+
+    try:
+        form = StreamingForm(request)
+        fields = await form.read_fields()
+        settings = _evaluation_settings(fields)
+
+        if form.file_field is None:
+            return {"error": "Missing conversation_file"}
+        if settings.sampled:
+            return _unsupported("Evaluation jobs do not support sampling")
+        if settings.spill_results:
+            return _unsupported("Evaluation jobs keep their results in the job store, spill_results does not apply")
+
+        if len(settings.judge_models) > 1:
+            return _unsupported("Evaluation jobs support a single judge model")
+
+        job_id = await get_job_manager().submit(
+            settings, iter_conversations(form.iter_file()), priority=int(fields.get("priority", 0))
+        )
+
+        return JSONResponse(content={"code": 200, "data": {"job_id": job_id}}, status_code=200)
+
+    except IngestionError as e:
+        return {"error": f"Invalid JSON format: {str(e)}"}
+
+    except Exception as e:
+        print(f"Error processing evaluation job request: {str(e)}\n\nStack Trace:{traceback.format_exc()}")
+        return {"error": str(e)}
+
+
+@app.get("/evaluation/jobs/{job_id}")
+async def evaluation_job_status(job_id: str):
+    job = await get_job_manager().status(job_id)
+    if not job:
+        return JSONResponse(content={"code": 404, "error": "Job not found"}, status_code=404)
+
+    return JSONResponse(content={"code": 200, "data": job}, status_code=200)
+
+
+@app.delete("/evaluation/jobs/{job_id}")
+async def cancel_evaluation_job(job_id: str):
+    if not await get_job_manager().cancel(job_id):
+        return JSONResponse(content={"code": 404, "error": "No queued or running job with this id"}, status_code=404)
+
+    return JSONResponse(content={"code": 200, "data": {"job_id": job_id, "status": "cancelled"}}, status_code=200)
+
+
+@app.get("/evaluation/results/{result_id}")
+async def evaluation_results(result_id: str, offset: int = 0, limit: int = 100):
+    """
+    Returns the stored results of a `spill_results` evaluation: its status and summary, and the
+    conversations of rows `offset` to `offset + limit - 1` (at most 1000). `next_offset` is None
+    on the last page.
+    """
+
+    store = get_result_store()
+    result_set = await asyncio.to_thread(store.get, result_id)
+    if not result_set:
+        return JSONResponse(content={"code": 404, "error": "Results not found"}, status_code=404)
+
+    limit = max(1, min(limit, 1000))
+    rows = await asyncio.to_thread(store.page, result_id, max(0, offset), limit)
+    metrics = result_set.pop("metrics")
+
+    result_set["conversations"] = [message for row in rows for message in row.messages(metrics)]
+    result_set["next_offset"] = rows[-1].index + 1 if len(rows) == limit else None
+
+    return JSONResponse(content={"code": 200, "data": result_set}, status_code=200)
+
+
+@app.delete("/evaluation/results/{result_id}")
+async def delete_evaluation_results(result_id: str):
+    if not await asyncio.to_thread(get_result_store().delete, result_id):
+        return JSONResponse(content={"code": 404, "error": "Results not found"}, status_code=404)
+
+    return JSONResponse(content={"code": 200, "data": {"result_id": result_id, "status": "deleted"}}, status_code=200)
+
+
+@app.get("/benchmarks/runs")
+async def benchmark_runs(judge_model: str = None, dataset_hash: str = None, limit: int = 50, candidate_model: str = None):
+    runs = await asyncio.to_thread(get_benchmark_store().runs, judge_model, dataset_hash, limit, candidate_model)
+    return JSONResponse(content={"code": 200, "data": runs}, status_code=200)
+
+
+@app.get("/benchmarks/runs/{run_id}/statistics")
+async def benchmark_run_statistics(run_id: str, confidence: float = 0.95):
+    matrix = await asyncio.to_thread(get_benchmark_store().score_matrix, run_id)
+    if matrix is None:
+        return JSONResponse(content={"code": 404, "error": "Run not found"}, status_code=404)
+
+    metrics, values, valid = matrix
+    statistics = await asyncio.to_thread(summarize, values, valid, metrics, confidence)
+    return JSONResponse(content={"code": 200, "data": statistics}, status_code=200)
+
+
+@app.get("/benchmarks/aggregates")
+async def benchmark_aggregates(dataset_hash: str = None, metric: str = None):
+    aggregates = await asyncio.to_thread(get_benchmark_store().aggregates, dataset_hash, metric)
+    return JSONResponse(content={"code": 200, "data": aggregates}, status_code=200)
+
+
+@app.get("/benchmarks/leaderboard")
+async def benchmark_leaderboard(metric: str = None, dataset_hash: str = None):
+    leaderboard = await asyncio.to_thread(get_benchmark_store().leaderboard, metric, dataset_hash)
+    return JSONResponse(content={"code": 200, "data": leaderboard}, status_code=200)
+
+
+@app.get("/benchmarks/diff")
+async def benchmark_diff(base: str, other: str, limit: int = 20):
+    diff = await asyncio.to_thread(get_benchmark_store().diff, base, other, limit)
+    return JSONResponse(content={"code": 200, "data": diff}, status_code=200)
+
+
+@app.get("/evaluation/cache")
+async def evaluation_cache_stats():
+    return JSONResponse(content={"code": 200, "data": get_cache().stats()}, status_code=200)
+
+
+@app.get("/metrics")
+async def metrics():
+    # Collectors query SQLite, keep them off the event loop
+    content = await asyncio.to_thread(get_metrics().render)
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/evaluation/judges")
+async def evaluation_judge_stats():
+    return JSONResponse(content={"code": 200, "data": get_judge_stats().stats()}, status_code=200)
+
+
 if __name__ == "__main__":
-    import uvicorn
+    from utils.evaluation import preload_model_stack
+    from utils.workers import serve, worker_count
 
-    # Start the FastAPI app
-    uvicorn.run(app, host="0.0.0.0", port=9000)
+    # Start the FastAPI app; EVALUATION_WORKERS > 1 forks that many worker processes, which
+    # share the LangChain modules imported here instead of each importing them on first use
+    workers = worker_count()
+    if workers > 1:
+        preload_model_stack()
+    serve(app, host="0.0.0.0", port=9000, workers=workers)
@@ -0,0 +1,394 @@
+import math
+import warnings
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from data_models.evaluation import EvaluationResult
+
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class ScoreMatrix:
+    """
+    Growable rows × metrics matrix of scores with a validity mask. A cell is valid only when the
+    judge returned a finite score for that metric, so failed or partial rows do not drag the
+    statistics down.
+    """
+
+    def __init__(self, metrics: List[str], capacity: int = 1024) -> None:
+        self.metrics = list(metrics)
+        self._columns = {metric: column for column, metric in enumerate(self.metrics)}
+        self.values = np.zeros((capacity, len(self.metrics)), dtype=np.float64)
+        self.valid = np.zeros((capacity, len(self.metrics)), dtype=bool)
+        self.count = 0
+
+    def add(self, scores: Dict[str, float], row: int = None) -> None:
+        """
+        Stores one row of scores; metrics that were not requested are ignored. Rows are appended
+        unless `row` is given, in which case the scores are written at that row index, so results
+        arriving out of order stay aligned with their conversation.
+
+        :param scores: The scores of one conversation keyed by metric.
+        :type scores: Dict[str, float]
+        :param row: Optional row index of the conversation.
+        :type row: int, optional
+        """
+
+        row = self.count if row is None else row
+
+        while row >= len(self.values):
+            self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+            self.valid = np.concatenate([self.valid, np.zeros_like(self.valid)])
+
+        for metric, score in scores.items():
+            column = self._columns.get(metric)
+            if column is not None and isinstance(score, (int, float)) and math.isfinite(score):
+                self.values[row, column] = score
+                self.valid[row, column] = True
+
+        self.count = max(self.count, row + 1)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the filled part of the score and mask arrays.
+
+        :return: A (values, valid) pair of rows × metrics arrays.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+
+        return self.values[:self.count], self.valid[:self.count]
+
+
+def masked_means(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Per-column mean over the valid cells only; columns without valid cells are NaN.
+    """
+
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(valid, values, 0.0).sum(axis=0) / counts
+
+
+def _bootstrap_intervals(values: np.ndarray, valid: np.ndarray, confidence: float, n_bootstrap: int,
+                         rng: np.random.Generator, max_cells: int = 4_000_000) -> Tuple[np.ndarray, np.ndarray]:
+    rows = len(values)
+    masked = np.where(valid, values, 0.0)
+    weights_valid = valid.astype(np.float64)
+    means = np.empty((n_bootstrap, values.shape[1]))
+
+    # Every resample is expressed as per-row draw counts, so the resampled sums of all metrics
+    # come out of one matrix product; resamples are processed in chunks of `max_cells` counts
+    chunk = max(1, max_cells // max(1, rows))
+    for start in range(0, n_bootstrap, chunk):
+        size = min(chunk, n_bootstrap - start)
+        draws = rng.integers(0, rows, size=(size, rows)) + (np.arange(size) * rows)[:, None]
+        counts = np.bincount(draws.ravel(), minlength=size * rows).reshape(size, rows).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[start:start + size] = (counts @ masked) / (counts @ weights_valid)
+
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanquantile(means, alpha, axis=0), np.nanquantile(means, 1 - alpha, axis=0)
+
+
+def summarize(values: np.ndarray, valid: np.ndarray, metrics: Sequence[str], confidence: float = 0.95,
+              n_bootstrap: int = 1000, bootstrap_max_rows: int = 20_000, seed: Optional[int] = 0) -> Dict[str, Dict[str, Any]]:
+    """
+    Computes distribution statistics for every metric of a score matrix: mean, standard
+    deviation, percentiles, number of valid scores and a confidence interval for the mean.
+    The interval is a percentile bootstrap over rows; above `bootstrap_max_rows` rows the
+    normal approximation is used instead, which is indistinguishable at that size and keeps
+    large re-aggregations fast.
+
+    :param values: Rows × metrics array of scores.
+    :type values: np.ndarray
+    :param valid: Rows × metrics boolean mask of the scores that are present.
+    :type valid: np.ndarray
+    :param metrics: The metric of every column.
+    :type metrics: Sequence[str]
+    :param confidence: Confidence level of the interval.
+    :type confidence: float
+    :param n_bootstrap: Number of bootstrap resamples.
+    :type n_bootstrap: int
+    :param bootstrap_max_rows: Largest row count for which the bootstrap is used.
+    :type bootstrap_max_rows: int
+    :param seed: Seed of the bootstrap resampling, for reproducible intervals.
+    :type seed: int, optional
+    :return: The statistics keyed by metric; metrics without any valid score are omitted.
+    :rtype: Dict[str, Dict[str, Any]]
+    """
+
+    counts = valid.sum(axis=0)
+    means = masked_means(values, valid)
+    masked = np.where(valid, values, np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        stds = np.nanstd(masked, axis=0, ddof=1)
+        percentiles = np.nanpercentile(masked, PERCENTILES, axis=0)
+
+    if 0 < len(values) <= bootstrap_max_rows:
+        ci_method = "bootstrap"
+        ci_low, ci_high = _bootstrap_intervals(values, valid, confidence, n_bootstrap, np.random.default_rng(seed))
+    else:
+        ci_method = "normal"
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            margin = z * stds / np.sqrt(counts)
+        ci_low, ci_high = means - margin, means + margin
+
+    def number(value: float) -> Optional[float]:
+        return float(value) if np.isfinite(value) else None
+
+    return {
+        metric: {
+            "mean": float(means[column]),
+            "std": number(stds[column]),
+            "count": int(counts[column]),
+            "percentiles": {f"p{p}": float(percentiles[i, column]) for i, p in enumerate(PERCENTILES)},
+            "ci_low": number(ci_low[column]),
+            "ci_high": number(ci_high[column]),
+            "ci_method": ci_method,
+            "confidence": confidence,
+        }
+        for column, metric in enumerate(metrics)
+        if counts[column]
+    }
+
+
+class ScoreAggregator:
+    """
+    Running aggregation of evaluation scores on top of a `ScoreMatrix`. Results can be added one
+    at a time as they complete; averages only count rows that actually have a score for the
+    metric, and full distribution statistics are available at any point.
+    """
+
+    def __init__(self, metrics: List[str]) -> None:
+        self.metrics = metrics
+        self.matrix = ScoreMatrix(metrics)
+
+    @property
+    def count(self) -> int:
+        return self.matrix.count
+
+    def add(self, result: EvaluationResult, row: int = None) -> None:
+        """
+        Adds the scores of one evaluated conversation.
+
+        :param result: The evaluation result of the conversation.
+        :type result: EvaluationResult
+        :param row: Optional row index of the conversation, see `ScoreMatrix.add`.
+        :type row: int, optional
+        """
+
+        self.matrix.add(result.scores, row)
+
+    def average_scores(self) -> Dict[str, float]:
+        """
+        Returns the average score of every requested metric over the valid scores added so far.
+
+        :return: The average scores keyed by metric.
+        :rtype: Dict[str, float]
+        """
+
+        values, valid = self.matrix.arrays()
+        means = masked_means(values, valid)
+
+        return {metric: float(means[column]) for column, metric in enumerate(self.metrics) if valid[:, column].any()}
+
+    def statistics(self, **kwargs: Any) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the distribution statistics of every metric, see `summarize`.
+
+        :return: The statistics keyed by metric.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+
+        values, valid = self.matrix.arrays()
+        return summarize(values, valid, self.metrics, **kwargs)
+
+
+class RunningAggregator:
+    """
+    Bounded-memory counterpart of `ScoreAggregator` for evaluations of any size. Means and
+    variances are updated online (Welford), and percentiles are estimated from a uniform
+    reservoir sample of `reservoir_size` rows, so memory does not grow with the number of rows.
+    Confidence intervals use the normal approximation, as `summarize` does for large runs.
+    """
+
+    def __init__(self, metrics: List[str], reservoir_size: int = 10_000, seed: Optional[int] = 0) -> None:
+        self.metrics = list(metrics)
+        self._columns = {metric: column for column, metric in enumerate(self.metrics)}
+        self.count = 0
+
+        self.counts = np.zeros(len(self.metrics))
+        self.means = np.zeros(len(self.metrics))
+        self.squares = np.zeros(len(self.metrics))
+
+        self.reservoir = np.full((reservoir_size, len(self.metrics)), np.nan)
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, result: EvaluationResult) -> None:
+        """
+        Adds the scores of one evaluated conversation.
+
+        :param result: The evaluation result of the conversation.
+        :type result: EvaluationResult
+        """
+
+        values = np.full(len(self.metrics), np.nan)
+        for metric, score in result.scores.items():
+            column = self._columns.get(metric)
+            if column is not None and isinstance(score, (int, float)):
+                values[column] = score
+        self.add_scores(values)
+
+    def add_scores(self, values: Sequence[float]) -> None:
+        """
+        Adds one row of scores given in the order of `metrics`, with NaN for missing scores.
+
+        :param values: The scores of one conversation.
+        :type values: Sequence[float]
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values)
+
+        self.counts += valid
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = np.where(valid, values - self.means, 0.0)
+            self.means += np.where(valid, delta / self.counts, 0.0)
+            self.squares += np.where(valid, delta * (values - self.means), 0.0)
+
+        # Reservoir sampling keeps every row with the same probability
+        slot = self.count if self.count < len(self.reservoir) else int(self._rng.integers(0, self.count + 1))
+        if slot < len(self.reservoir):
+            self.reservoir[slot] = np.where(valid, values, np.nan)
+        self.count += 1
+
+    def average_scores(self) -> Dict[str, float]:
+        """
+        Returns the average score of every requested metric over the valid scores added so far.
+
+        :return: The average scores keyed by metric.
+        :rtype: Dict[str, float]
+        """
+
+        return {metric: float(self.means[column]) for column, metric in enumerate(self.metrics) if self.counts[column]}
+
+    def statistics(self, confidence: float = 0.95) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the same statistics as `summarize`; percentiles are estimated from the reservoir.
+
+        :param confidence: Confidence level of the interval.
+        :type confidence: float
+        :return: The statistics keyed by metric; metrics without any valid score are omitted.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            percentiles = np.nanpercentile(self.reservoir[:min(self.count, len(self.reservoir))], PERCENTILES, axis=0)
+
+        statistics = {}
+        for column, metric in enumerate(self.metrics):
+            count = int(self.counts[column])
+            if not count:
+                continue
+
+            mean = float(self.means[column])
+            std = math.sqrt(self.squares[column] / (count - 1)) if count > 1 else None
+            margin = z * std / math.sqrt(count) if std is not None else None
+            statistics[metric] = {
+                "mean": mean,
+                "std": std,
+                "count": count,
+                "percentiles": {f"p{p}": float(percentiles[i, column]) for i, p in enumerate(PERCENTILES)},
+                "ci_low": mean - margin if margin is not None else None,
+                "ci_high": mean + margin if margin is not None else None,
+                "ci_method": "normal",
+                "confidence": confidence,
+            }
+
+        return statistics
+
+
+def _krippendorff_alpha(scores: np.ndarray, valid: np.ndarray) -> Optional[float]:
+    # Interval-metric alpha over a judges × rows matrix; only rows scored by 2+ judges are pairable
+    pairable = valid.sum(axis=0) >= 2
+    values = np.where(valid, scores, 0.0)[:, pairable]
+    counts = valid[:, pairable].sum(axis=0)
+    n = counts.sum()
+    if n < 2:
+        return None
+
+    sums, squares = values.sum(axis=0), (values ** 2).sum(axis=0)
+    observed = (2 * (counts * squares - sums ** 2) / (counts - 1)).sum() / n
+    expected = 2 * (n * squares.sum() - sums.sum() ** 2) / (n * (n - 1))
+
+    return float(1 - observed / expected) if expected > 0 else None
+
+
+def judge_agreement(aggregators: Dict[str, ScoreAggregator]) -> Dict[str, Dict[str, Any]]:
+    """
+    Computes inter-judge agreement for every metric from index-aligned aggregators (see
+    `ScoreAggregator.add`): Krippendorff's alpha (interval), the mean standard deviation of the
+    judges' scores per conversation, and for every pair of judges the number of conversations
+    both scored, the mean absolute difference, the share of scores within one point and the
+    Pearson correlation.
+
+    :param aggregators: The aggregator of every judge, keyed by judge model.
+    :type aggregators: Dict[str, ScoreAggregator]
+    :return: The agreement statistics keyed by metric.
+    :rtype: Dict[str, Dict[str, Any]]
+    """
+
+    judges = list(aggregators)
+    metrics = list(dict.fromkeys(metric for aggregator in aggregators.values() for metric in aggregator.metrics))
+    rows = max((aggregator.count for aggregator in aggregators.values()), default=0)
+
+    # judges × rows × metrics, padded with invalid cells
+    values = np.zeros((len(judges), rows, len(metrics)))
+    valid = np.zeros((len(judges), rows, len(metrics)), dtype=bool)
+    for j, judge in enumerate(judges):
+        judge_values, judge_valid = aggregators[judge].matrix.arrays()
+        for column, metric in enumerate(aggregators[judge].metrics):
+            values[j, :len(judge_values), metrics.index(metric)] = judge_values[:, column]
+            valid[j, :len(judge_valid), metrics.index(metric)] = judge_valid[:, column]
+
+    def number(value: float) -> Optional[float]:
+        return float(value) if np.isfinite(value) else None
+
+    agreement = {}
+    for column, metric in enumerate(metrics):
+        scores, mask = values[:, :, column], valid[:, :, column]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            spread = np.nanstd(np.where(mask, scores, np.nan), axis=0, ddof=1)
+        spread = spread[mask.sum(axis=0) >= 2]
+
+        pairs = {}
+        for a in range(len(judges)):
+            for b in range(a + 1, len(judges)):
+                both = mask[a] & mask[b]
+                x, y = scores[a, both], scores[b, both]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    pearson = np.corrcoef(x, y)[0, 1] if len(x) >= 2 else np.nan
+                pairs[f"{judges[a]}|{judges[b]}"] = {
+                    "count": int(both.sum()),
+                    "mean_abs_diff": number(np.abs(x - y).mean()) if len(x) else None,
+                    "within_1": number((np.abs(x - y) <= 1).mean()) if len(x) else None,
+                    "pearson": number(pearson),
+                }
+
+        agreement[metric] = {
+            "krippendorff_alpha": _krippendorff_alpha(scores, mask),
+            "mean_std": number(spread.mean()) if len(spread) else None,
+            "pairs": pairs,
+        }
+
+    return agreement
@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+import numpy as np
+from data_models.evaluation import Conversation, EvaluationResult, EvaluationSettings
+from utils.logs import setup_logger
+
+
+logger = setup_logger("evaluation")
+
+_benchmark_store: Optional["BenchmarkStore"] = None
+
+
+def row_hash(conversation: Conversation) -> str:
+    """
+    Content hash of a conversation, used to match the same row across runs.
+
+    :param conversation: The evaluated conversation.
+    :type conversation: Conversation
+    :return: The hex digest of the question and response.
+    :rtype: str
+    """
+
+    return hashlib.sha256(f"{conversation.user_question}\x00{conversation.bot_response}".encode("utf-8")).hexdigest()
+
+
+class BenchmarkStore:
+    """
+    Indexed SQLite store of evaluation runs. Every run keeps its metadata (judge model, candidate
+    model of generate-then-evaluate runs, dataset hash, context hash, metrics, timestamp) and its
+    per-row scores, and a per-metric summary is written when the run completes. Aggregates,
+    leaderboards and run diffs are computed in SQL.
+    """
+
+    _FLUSH_ROWS = 500
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id TEXT PRIMARY KEY,
+                judge_model TEXT NOT NULL,
+                candidate_model TEXT,
+                metrics TEXT NOT NULL,
+                context_hash TEXT NOT NULL,
+                dataset_hash TEXT,
+                row_count INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS runs_judge_model ON runs (judge_model, created_at);
+            CREATE INDEX IF NOT EXISTS runs_dataset_hash ON runs (dataset_hash, created_at);
+
+            CREATE TABLE IF NOT EXISTS run_rows (
+                run_id TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                row_hash TEXT NOT NULL,
+                PRIMARY KEY (run_id, row_index)
+            );
+            CREATE INDEX IF NOT EXISTS run_rows_hash ON run_rows (run_id, row_hash);
+
+            CREATE TABLE IF NOT EXISTS run_scores (
+                run_id TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                metric TEXT NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (run_id, metric, row_index)
+            );
+
+            CREATE TABLE IF NOT EXISTS run_metrics (
+                run_id TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                mean REAL NOT NULL,
+                count INTEGER NOT NULL,
+                min REAL NOT NULL,
+                max REAL NOT NULL,
+                PRIMARY KEY (run_id, metric)
+            );
+        """)
+
+        # Stores created before generate-then-evaluate runs lack the candidate model
+        columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(runs)")}
+        if "candidate_model" not in columns:
+            self._connection.execute("ALTER TABLE runs ADD COLUMN candidate_model TEXT")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS runs_candidate_model ON runs (candidate_model, created_at)"
+        )
+        self._connection.commit()
+
+    def _query(self, query: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(query, params).fetchall()]
+
+    def create_run(self, settings: EvaluationSettings) -> str:
+        run_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO runs (id, judge_model, candidate_model, metrics, context_hash, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id, settings.model, settings.candidate_model, json.dumps(settings.metrics),
+                    hashlib.sha256(settings.context.encode("utf-8")).hexdigest(), "running", time.time()
+                )
+            )
+            self._connection.commit()
+        return run_id
+
+    def add_rows(self, run_id: str, rows: List[Tuple[int, Conversation, EvaluationResult]], metrics: List[str]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO run_rows (run_id, row_index, row_hash) VALUES (?, ?, ?)",
+                [(run_id, index, row_hash(conversation)) for index, conversation, _ in rows]
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO run_scores (run_id, row_index, metric, score) VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, index, metric, score)
+                    for index, _, result in rows
+                    for metric, score in result.scores.items()
+                    if metric in metrics
+                ]
+            )
+            self._connection.commit()
+
+    def finish_run(self, run_id: str, status: str = "completed") -> None:
+        with self._lock:
+            # The dataset hash ignores row order so re-uploads of the same rows match
+            digest = hashlib.sha256()
+            for (value,) in self._connection.execute(
+                "SELECT row_hash FROM run_rows WHERE run_id = ? ORDER BY row_hash", (run_id,)
+            ):
+                digest.update(value.encode("ascii"))
+
+            self._connection.execute(
+                "INSERT OR REPLACE INTO run_metrics (run_id, metric, mean, count, min, max) "
+                "SELECT run_id, metric, AVG(score), COUNT(*), MIN(score), MAX(score) FROM run_scores "
+                "WHERE run_id = ? GROUP BY metric",
+                (run_id,)
+            )
+            self._connection.execute(
+                "UPDATE runs SET status = ?, dataset_hash = ?, "
+                "row_count = (SELECT COUNT(*) FROM run_rows WHERE run_id = ?) WHERE id = ?",
+                (status, digest.hexdigest(), run_id, run_id)
+            )
+            self._connection.commit()
+
+    async def record(self, results: AsyncIterable[Tuple[int, Conversation, EvaluationResult]],
+                     settings: EvaluationSettings) -> AsyncIterator[Tuple[int, Conversation, EvaluationResult]]:
+        """
+        Passes evaluation results through unchanged while persisting them as a new run. Rows
+        are written in batches; the run is marked completed when `results` is exhausted, or
+        failed if it raises.
+
+        :param results: The (row index, conversation, result) stream of an evaluation.
+        :type results: AsyncIterable[Tuple[int, Conversation, EvaluationResult]]
+        :param settings: The settings of the evaluation.
+        :type settings: EvaluationSettings
+        :return: The same stream of results.
+        :rtype: AsyncIterator[Tuple[int, Conversation, EvaluationResult]]
+        """
+
+        run_id = await asyncio.to_thread(self.create_run, settings)
+        pending = []
+        status = "failed"
+
+        try:
+            async for item in results:
+                pending.append(item)
+                if len(pending) >= self._FLUSH_ROWS:
+                    await asyncio.to_thread(self.add_rows, run_id, pending, settings.metrics)
+                    pending = []
+                yield item
+
+            status = "completed"
+
+        finally:
+            await asyncio.shield(asyncio.to_thread(self._close_run, run_id, pending, settings.metrics, status))
+
+    def _close_run(self, run_id: str, pending: List[Tuple[int, Conversation, EvaluationResult]], metrics: List[str],
+                   status: str) -> None:
+        if pending:
+            self.add_rows(run_id, pending, metrics)
+        self.finish_run(run_id, status)
+        logger.info(f"Benchmark run {run_id} recorded with status {status}")
+
+    def runs(self, judge_model: str = None, dataset_hash: str = None, limit: int = 50,
+             candidate_model: str = None) -> List[Dict[str, Any]]:
+        """
+        Lists completed runs, newest first, with their per-metric summaries.
+        """
+
+        runs = self._query(
+            "SELECT * FROM runs WHERE status = 'completed' "
+            "AND (:judge_model IS NULL OR judge_model = :judge_model) "
+            "AND (:candidate_model IS NULL OR candidate_model = :candidate_model) "
+            "AND (:dataset_hash IS NULL OR dataset_hash = :dataset_hash) "
+            "ORDER BY created_at DESC LIMIT :limit",
+            {"judge_model": judge_model, "candidate_model": candidate_model, "dataset_hash": dataset_hash, "limit": limit}
+        )
+        if not runs:
+            return []
+
+        summaries: Dict[str, Dict[str, Any]] = {}
+        placeholders = ",".join("?" * len(runs))
+        for row in self._query(
+            f"SELECT * FROM run_metrics WHERE run_id IN ({placeholders})", tuple(run["id"] for run in runs)
+        ):
+            summaries.setdefault(row.pop("run_id"), {})[row.pop("metric")] = row
+
+        for run in runs:
+            run["metrics"] = json.loads(run["metrics"])
+            run["summary"] = summaries.get(run["id"], {})
+
+        return runs
+
+    def score_matrix(self, run_id: str) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+        """
+        Loads the scores of a run as a rows × metrics matrix with a validity mask, ready for
+        `utils.aggregation.summarize`.
+        """
+
+        runs = self._query("SELECT metrics, row_count FROM runs WHERE id = ?", (run_id,))
+        if not runs:
+            return None
+
+        metrics = json.loads(runs[0]["metrics"])
+        columns = {metric: column for column, metric in enumerate(metrics)}
+
+        with self._lock:
+            indexes = np.fromiter(
+                (index for (index,) in self._connection.execute(
+                    "SELECT row_index FROM run_rows WHERE run_id = ? ORDER BY row_index", (run_id,)
+                )),
+                dtype=np.int64
+            )
+            scores = self._connection.execute(
+                "SELECT row_index, metric, score FROM run_scores WHERE run_id = ?", (run_id,)
+            ).fetchall()
+
+        values = np.zeros((len(indexes), len(metrics)))
+        valid = np.zeros((len(indexes), len(metrics)), dtype=bool)
+
+        if scores:
+            rows = np.searchsorted(indexes, np.fromiter((row[0] for row in scores), dtype=np.int64, count=len(scores)))
+            cols = np.fromiter((columns[row[1]] for row in scores), dtype=np.int64, count=len(scores))
+            values[rows, cols] = np.fromiter((row[2] for row in scores), dtype=np.float64, count=len(scores))
+            valid[rows, cols] = True
+
+        return metrics, values, valid
+
+    def aggregates(self, dataset_hash: str = None, metric: str = None) -> List[Dict[str, Any]]:
+        """
+        Per judge model, candidate model (None for uploaded conversations) and metric: the
+        row-weighted mean over all completed runs, the number of scored rows and the number of runs.
+        """
+
+        return self._query(
+            "SELECT runs.judge_model, runs.candidate_model, run_metrics.metric, "
+            "SUM(run_metrics.mean * run_metrics.count) / SUM(run_metrics.count) AS mean, "
+            "SUM(run_metrics.count) AS count, COUNT(DISTINCT runs.id) AS runs, "
+            "MIN(run_metrics.min) AS min, MAX(run_metrics.max) AS max "
+            "FROM run_metrics JOIN runs ON runs.id = run_metrics.run_id "
+            "WHERE runs.status = 'completed' "
+            "AND (:dataset_hash IS NULL OR runs.dataset_hash = :dataset_hash) "
+            "AND (:metric IS NULL OR run_metrics.metric = :metric) "
+            "GROUP BY runs.judge_model, runs.candidate_model, run_metrics.metric "
+            "ORDER BY runs.judge_model, runs.candidate_model, run_metrics.metric",
+            {"dataset_hash": dataset_hash, "metric": metric}
+        )
+
+    def leaderboard(self, metric: str = None, dataset_hash: str = None) -> List[Dict[str, Any]]:
+        """
+        Ranks judge models, and for generate-then-evaluate runs the candidate models each judge
+        scored, by their mean score on `metric`, or on all metrics when omitted, using the latest
+        completed run of every judge and candidate pair.
+        """
+
+        return self._query(
+            "WITH latest AS ("
+            "  SELECT id, judge_model, candidate_model, created_at, ROW_NUMBER() OVER ("
+            "    PARTITION BY judge_model, candidate_model ORDER BY created_at DESC) AS position "
+            "  FROM runs WHERE status = 'completed' "
+            "  AND (:dataset_hash IS NULL OR dataset_hash = :dataset_hash)"
+            ") "
+            "SELECT latest.judge_model, latest.candidate_model, latest.id AS run_id, latest.created_at, "
+            "SUM(run_metrics.mean * run_metrics.count) / SUM(run_metrics.count) AS mean, "
+            "SUM(run_metrics.count) AS count "
+            "FROM latest JOIN run_metrics ON run_metrics.run_id = latest.id "
+            "WHERE latest.position = 1 AND (:metric IS NULL OR run_metrics.metric = :metric) "
+            "GROUP BY latest.id ORDER BY mean DESC",
+            {"metric": metric, "dataset_hash": dataset_hash}
+        )
+
+    def diff(self, base_run: str, other_run: str, limit: int = 20) -> Dict[str, Any]:
+        """
+        Compares two runs: per-metric means and their delta, and, for rows present in both runs
+        (matched by content hash), the mean absolute score difference and the rows with the
+        largest disagreement.
+        """
+
+        metrics = self._query(
+            "SELECT metrics.metric, base.mean AS base_mean, other.mean AS other_mean, "
+            "other.mean - base.mean AS delta "
+            "FROM (SELECT DISTINCT metric FROM run_metrics WHERE run_id IN (:base, :other)) AS metrics "
+            "LEFT JOIN run_metrics AS base ON base.run_id = :base AND base.metric = metrics.metric "
+            "LEFT JOIN run_metrics AS other ON other.run_id = :other AND other.metric = metrics.metric "
+            "ORDER BY metrics.metric",
+            {"base": base_run, "other": other_run}
+        )
+
+        matched = (
+            "FROM run_rows AS base_rows "
+            "JOIN run_rows AS other_rows ON other_rows.run_id = :other AND other_rows.row_hash = base_rows.row_hash "
+            "JOIN run_scores AS base_scores ON base_scores.run_id = :base AND base_scores.row_index = base_rows.row_index "
+            "JOIN run_scores AS other_scores ON other_scores.run_id = :other "
+            "AND other_scores.row_index = other_rows.row_index AND other_scores.metric = base_scores.metric "
+            "WHERE base_rows.run_id = :base "
+        )
+        params = {"base": base_run, "other": other_run, "limit": limit}
+
+        agreement = self._query(
+            "SELECT base_scores.metric AS metric, COUNT(*) AS matched_rows, "
+            "AVG(ABS(other_scores.score - base_scores.score)) AS mean_absolute_difference "
+            + matched + "GROUP BY base_scores.metric ORDER BY base_scores.metric",
+            params
+        )
+        disagreements = self._query(
+            "SELECT base_scores.metric AS metric, base_rows.row_index AS base_row, "
+            "other_rows.row_index AS other_row, base_scores.score AS base_score, "
+            "other_scores.score AS other_score "
+            + matched + "ORDER BY ABS(other_scores.score - base_scores.score) DESC LIMIT :limit",
+            params
+        )
+
+        return {"metrics": metrics, "agreement": agreement, "largest_disagreements": disagreements}
+
+
+def get_benchmark_store() -> BenchmarkStore:
+    """
+    Returns the process-wide benchmark store, opening it at EVALUATION_BENCHMARKS_PATH on first use.
+
+    :return: The shared benchmark store.
+    :rtype: BenchmarkStore
+    """
+
+    global _benchmark_store
+
+    if _benchmark_store is None:
+        _benchmark_store = BenchmarkStore(os.environ.get("EVALUATION_BENCHMARKS_PATH", "storage/benchmarks.sqlite3"))
+
+    return _benchmark_store
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from data_models.evaluation import EvaluationResult
+from utils.logs import setup_logger
+
+
+logger = setup_logger("evaluation")
+
+CACHE_MODES = ("use", "bypass", "refresh")
+
+_cache: Optional["EvaluationCache"] = None
+
+
+class EvaluationCache:
+    """
+    Content-addressed cache of parsed evaluation results. Lookups hit an in-memory LRU first
+    and fall back to an SQLite file shared across restarts; disk entries expire after
+    `ttl_seconds` and the least recently used ones are evicted beyond `max_disk_entries`.
+    """
+
+    _PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, max_memory_entries: int = 10_000, max_disk_entries: int = 1_000_000,
+                 ttl_seconds: float = 7 * 24 * 3600) -> None:
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.memory: "OrderedDict[str, EvaluationResult]" = OrderedDict()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS evaluation_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS evaluation_cache_accessed_at ON evaluation_cache (accessed_at)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(model_fingerprint: str, prompt: str) -> str:
+        """
+        Builds the cache key for a judge call from the model identity (name and parameters) and
+        the fully rendered prompt.
+
+        :param model_fingerprint: Stable serialization of the judge model name and parameters.
+        :type model_fingerprint: str
+        :param prompt: The rendered prompt sent to the judge model.
+        :type prompt: str
+        :return: The hex digest identifying the cache entry.
+        :rtype: str
+        """
+
+        return hashlib.sha256(f"{model_fingerprint}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, result: EvaluationResult) -> None:
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _read(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM evaluation_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            if row[1] < now - self.ttl_seconds:
+                self._connection.execute("DELETE FROM evaluation_cache WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+
+            self._connection.execute("UPDATE evaluation_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            return row[0]
+
+    def _write(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO evaluation_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._connection.commit()
+
+            if self.counters["writes"] % self._PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        self._connection.execute("DELETE FROM evaluation_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._connection.execute(
+            "DELETE FROM evaluation_cache WHERE key IN ("
+            "SELECT key FROM evaluation_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+        self._connection.commit()
+
+    async def get(self, key: str) -> Optional[EvaluationResult]:
+        """
+        Looks up a cached evaluation result, promoting disk hits into the in-memory tier.
+
+        :param key: The cache key built by `make_key`.
+        :type key: str
+        :return: The cached result, or None on a miss.
+        :rtype: Optional[EvaluationResult]
+        """
+
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return self.memory[key]
+
+        value = await asyncio.to_thread(self._read, key)
+        if value is None:
+            self.counters["misses"] += 1
+            return None
+
+        result = EvaluationResult.model_validate_json(value)
+        self._remember(key, result)
+        self.counters["disk_hits"] += 1
+        return result
+
+    async def set(self, key: str, result: EvaluationResult) -> None:
+        """
+        Stores an evaluation result in both tiers.
+
+        :param key: The cache key built by `make_key`.
+        :type key: str
+        :param result: The parsed evaluation result to store.
+        :type result: EvaluationResult
+        """
+
+        self._remember(key, result)
+        self.counters["writes"] += 1
+        await asyncio.to_thread(self._write, key, result.model_dump_json())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit/miss counters along with the current size of each tier.
+
+        :return: Cache statistics.
+        :rtype: Dict[str, Any]
+        """
+
+        with self._lock:
+            disk_entries = self._connection.execute("SELECT COUNT(*) FROM evaluation_cache").fetchone()[0]
+
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+
+        return {
+            **self.counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": disk_entries,
+        }
+
+
+def model_fingerprint(chat_model: Any) -> str:
+    """
+    Serializes the identity of a chat model (class, model name and generation parameters) so
+    results from differently configured judges never share cache entries.
+
+    :param chat_model: The LangChain chat model used as judge.
+    :type chat_model: BaseChatModel
+    :return: A stable JSON string describing the model.
+    :rtype: str
+    """
+
+    params = getattr(chat_model, "_identifying_params", None) or {}
+    return json.dumps({"class": type(chat_model).__name__, "params": params}, sort_keys=True, default=str)
+
+
+def get_cache() -> EvaluationCache:
+    """
+    Returns the process-wide evaluation cache, opening it on first use. The SQLite file location
+    and limits come from EVALUATION_CACHE_PATH, EVALUATION_CACHE_MEMORY_ENTRIES,
+    EVALUATION_CACHE_DISK_ENTRIES and EVALUATION_CACHE_TTL.
+
+    :return: The shared evaluation cache.
+    :rtype: EvaluationCache
+    """
+
+    global _cache
+
+    if _cache is None:
+        _cache = EvaluationCache(
+            path=os.environ.get("EVALUATION_CACHE_PATH", "cache/evaluation.sqlite3"),
+            max_memory_entries=int(os.environ.get("EVALUATION_CACHE_MEMORY_ENTRIES", 10_000)),
+            max_disk_entries=int(os.environ.get("EVALUATION_CACHE_DISK_ENTRIES", 1_000_000)),
+            ttl_seconds=float(os.environ.get("EVALUATION_CACHE_TTL", 7 * 24 * 3600)),
+        )
+        logger.info(f"Evaluation cache opened at {_cache.path}")
+
+    return _cache
@@ -0,0 +1,177 @@
+import functools
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List
+import numpy as np
+from utils.logs import setup_logger
+from utils.scheduler import estimate_tokens
+
+
+logger = setup_logger("evaluation")
+
+#   Stands in for the context in system prompts when excerpts are sent with every row instead
+EXCERPTS_NOTE = "Only the excerpts of the context relevant to each question are given with it."
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _terms(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class ContextIndex:
+    """
+    Selects the parts of a long context that are relevant to a question, so a large knowledge
+    base is not pasted into every prompt. Contexts within `token_budget` are used in full;
+    longer ones are split into chunks with `langchain-text-splitters` and indexed with Okapi
+    BM25, and every question gets its `top_k` best-matching chunks that fit the budget, in
+    their original order. A `token_budget` of 0 always uses the full context.
+
+    The index is built once per context (see `build_context_index`) and the excerpts of recent
+    questions are kept, so repeated questions are not scored again.
+    """
+
+    def __init__(self, context: str, token_budget: int = 1500, top_k: int = 4, chunk_size: int = 1000,
+                 chunk_overlap: int = 100, k1: float = 1.5, b: float = 0.75, max_cache_entries: int = 10_000) -> None:
+        self.context = context
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+        self.max_cache_entries = max_cache_entries
+        self.full = not token_budget or estimate_tokens(context) <= token_budget
+
+        self.chunks: List[str] = []
+        self.postings: Dict[str, tuple] = {}
+        self._selected: "OrderedDict[str, str]" = OrderedDict()
+
+        if not self.full:
+            self._build(chunk_size, chunk_overlap)
+
+    def _build(self, chunk_size: int, chunk_overlap: int) -> None:
+        # Only long contexts are chunked, so most processes never need the splitters
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        # Chunks are kept well below the budget so several of them fit into one prompt
+        chunk_size = max(100, min(chunk_size, self.token_budget * 4 // 2))
+        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=min(chunk_overlap, chunk_size // 4))
+        self.chunks = splitter.split_text(self.context)
+        self.tokens = np.array([estimate_tokens(chunk) for chunk in self.chunks])
+
+        counts = [Counter(_terms(chunk)) for chunk in self.chunks]
+        lengths = np.array([sum(count.values()) for count in counts], dtype=np.float64)
+        norms = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+
+        postings: Dict[str, List[List[float]]] = {}
+        for chunk, count in enumerate(counts):
+            for term, frequency in count.items():
+                postings.setdefault(term, [[], []])
+                postings[term][0].append(chunk)
+                postings[term][1].append(frequency)
+
+        # Per term: the chunks containing it and their precomputed BM25 term weights
+        size = len(self.chunks)
+        for term, (chunks, frequencies) in postings.items():
+            chunks = np.array(chunks)
+            frequencies = np.array(frequencies, dtype=np.float64)
+            idf = math.log(1 + (size - len(chunks) + 0.5) / (len(chunks) + 0.5))
+            self.postings[term] = (chunks, idf * frequencies * (self.k1 + 1) / (frequencies + norms[chunks]))
+
+        logger.info(f"Indexed context of {len(self.context)} chars into {size} chunks")
+
+    @property
+    def system_context(self) -> str:
+        """
+        The context to render into the shared system prompt: the full context when it fits the
+        budget, otherwise a note that excerpts come with every question.
+        """
+
+        return self.context if self.full else EXCERPTS_NOTE
+
+    def scores(self, question: str) -> np.ndarray:
+        """
+        BM25 score of every chunk for `question`.
+
+        :param question: The question to match.
+        :type question: str
+        :return: One score per chunk.
+        :rtype: np.ndarray
+        """
+
+        scores = np.zeros(len(self.chunks))
+        for term in set(_terms(question)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def select(self, question: str) -> str:
+        """
+        Returns the excerpts of the context to send with `question`, or an empty string when
+        the full context is already part of the system prompt. Chunks are taken by decreasing
+        score while they fit the token budget; when no chunk shares a term with the question,
+        the beginning of the context is used.
+
+        :param question: The question the excerpts have to answer.
+        :type question: str
+        :return: The selected chunks, in context order.
+        :rtype: str
+        """
+
+        if self.full:
+            return ""
+
+        selected = self._selected.get(question)
+        if selected is not None:
+            self._selected.move_to_end(question)
+            return selected
+
+        scores = self.scores(question)
+        ranked = [int(chunk) for chunk in np.argsort(-scores, kind="stable")[:self.top_k] if scores[chunk] > 0]
+        if not ranked:
+            ranked = list(range(min(self.top_k, len(self.chunks))))
+
+        chosen, used = [], 0
+        for chunk in ranked:
+            if used + self.tokens[chunk] > self.token_budget and chosen:
+                continue
+            chosen.append(chunk)
+            used += self.tokens[chunk]
+
+        selected = "\n...\n".join(self.chunks[chunk] for chunk in sorted(chosen))
+
+        self._selected[question] = selected
+        if len(self._selected) > self.max_cache_entries:
+            self._selected.popitem(last=False)
+
+        return selected
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "full": self.full,
+            "context_tokens": estimate_tokens(self.context),
+            "chunks": len(self.chunks),
+            "token_budget": self.token_budget,
+            "top_k": self.top_k,
+        }
+
+
+@functools.lru_cache(maxsize=8)
+def build_context_index(context: str, token_budget: int = 1500, top_k: int = 4) -> ContextIndex:
+    """
+    Returns the index of a context, building it on first use. The last few indexes are kept,
+    so the judges of a multi-judge evaluation and repeated evaluations of the same knowledge
+    base share one index.
+
+    :param context: The context of the evaluation.
+    :type context: str
+    :param token_budget: Maximum estimated tokens of context sent with a question.
+    :type token_budget: int
+    :param top_k: Maximum number of chunks sent with a question.
+    :type top_k: int
+    :return: The context index.
+    :rtype: ContextIndex
+    """
+
+    return ContextIndex(context, token_budget=token_budget, top_k=top_k)
@@ -0,0 +1,253 @@
+import hashlib
+import heapq
+import re
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from data_models.evaluation import Conversation, EvaluationResult
+
+
+DEDUP_MODES = ("off", "exact", "near")
+
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+
+#   Modulus of the MinHash permutations; with 32-bit shingle hashes a * h + b fits in 64 bits
+_PRIME = (1 << 31) - 1
+
+
+def normalize(text: str) -> str:
+    """
+    Normalises a text for duplicate detection: Unicode compatibility form, lower case and
+    collapsed whitespace.
+    """
+
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text).lower()).strip()
+
+
+def conversation_key(conversation: Conversation) -> bytes:
+    """
+    Hash of the normalised (question, response) pair; conversations with the same key are exact
+    duplicates for evaluation purposes.
+    """
+
+    text = f"{normalize(conversation.user_question)}\x1f{normalize(conversation.bot_response)}"
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles, banded for locality-sensitive hashing. With
+    `num_perm` permutations split into `bands`, pairs with a Jaccard similarity around
+    (1 / bands) ** (bands / num_perm) or more are likely to share a band.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 2, seed: int = 0) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text)
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) & _PRIME for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+
+        return ((np.outer(hashes, self.a) + self.b) % _PRIME).min(axis=0)
+
+    def band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(left: np.ndarray, right: np.ndarray) -> float:
+        return float((left == right).mean())
+
+
+class _Group:
+    __slots__ = ("first", "leader", "judging", "result", "waiting", "count", "signature")
+
+    def __init__(self, leader: int, signature: Optional[np.ndarray]) -> None:
+        self.first = leader
+        self.leader = leader
+        self.judging = True
+        self.result: Optional[EvaluationResult] = None
+        self.waiting: List[Tuple[int, Conversation]] = []
+        self.count = 1
+        self.signature = signature
+
+
+class Deduplicator:
+    """
+    Groups the rows of one evaluation so every group is judged once. "exact" groups rows with
+    the same normalised question and response; "near" additionally joins rows whose MinHash
+    similarity to a group's first row reaches `threshold`, using LSH to find candidates.
+
+    Rows are assigned as they stream in: the first row of a group is judged, later members
+    either wait for its result or get it immediately once it is known. At most `max_groups`
+    groups are remembered (least recently used first out); a duplicate of a forgotten group
+    simply starts a new one, so memory stays bounded on very large uploads. Of the forgotten
+    groups only the `top_groups` largest are kept for `stats`.
+    """
+
+    def __init__(self, mode: str = "exact", threshold: float = 0.8, max_groups: int = 100_000,
+                 top_groups: int = 100) -> None:
+        if mode not in DEDUP_MODES or mode == "off":
+            raise ValueError(f"Unsupported deduplication mode {mode!r}")
+
+        self.mode = mode
+        self.threshold = threshold
+        self.max_groups = max_groups
+        self.top_groups = top_groups
+        self.hasher = MinHasher() if mode == "near" else None
+
+        self.groups: "OrderedDict[bytes, _Group]" = OrderedDict()
+        self.buckets: Dict[bytes, List[bytes]] = {}
+        # Callers writing results out as they go may pop the entries of rows they are done with
+        self.duplicate_of: Dict[int, int] = {}
+        self.rows = 0
+        self.duplicates = 0
+        self.duplicate_groups = 0
+        # Min-heap of (count, -first row) of the largest forgotten groups with duplicates
+        self.retired: List[Tuple[int, int]] = []
+        self._judging: Dict[int, bytes] = {}
+
+    def _find_near(self, signature: np.ndarray) -> Optional[bytes]:
+        for band_key in self.hasher.band_keys(signature):
+            for key in self.buckets.get(band_key, ()):
+                group = self.groups.get(key)
+                if group is not None and self.hasher.similarity(signature, group.signature) >= self.threshold:
+                    return key
+        return None
+
+    def _forget_oldest(self) -> None:
+        # Groups with duplicates waiting for their result have to stay until it is known
+        key = next((key for key, group in self.groups.items() if not group.waiting), None)
+        if key is None:
+            return
+
+        group = self.groups.pop(key)
+        if group.count > 1:
+            if len(self.retired) < self.top_groups:
+                heapq.heappush(self.retired, (group.count, -group.first))
+            else:
+                heapq.heappushpop(self.retired, (group.count, -group.first))
+        if group.signature is not None:
+            for band_key in self.hasher.band_keys(group.signature):
+                members = self.buckets.get(band_key)
+                if members and key in members:
+                    members.remove(key)
+                    if not members:
+                        del self.buckets[band_key]
+
+    def assign(self, index: int, conversation: Conversation) -> Tuple[bool, Optional[EvaluationResult]]:
+        """
+        Assigns a row to a group.
+
+        :param index: The row index of the conversation.
+        :type index: int
+        :param conversation: The conversation.
+        :type conversation: Conversation
+        :return: (True, None) if the row starts a new group and has to be judged, (False, result)
+            if it duplicates a group whose result is known, and (False, None) if it duplicates a
+            group still being judged; it is then returned by `resolve` with the group's result.
+        :rtype: Tuple[bool, Optional[EvaluationResult]]
+        """
+
+        self.rows += 1
+        key = conversation_key(conversation)
+        group = self.groups.get(key)
+        signature = None
+
+        if group is None and self.hasher:
+            signature = self.hasher.signature(
+                f"{normalize(conversation.user_question)} {normalize(conversation.bot_response)}"
+            )
+            near = self._find_near(signature)
+            if near is not None:
+                key, group = near, self.groups[near]
+
+        if group is None:
+            self.groups[key] = _Group(index, signature)
+            self._judging[index] = key
+            if signature is not None:
+                for band_key in self.hasher.band_keys(signature):
+                    self.buckets.setdefault(band_key, []).append(key)
+            if len(self.groups) > self.max_groups:
+                self._forget_oldest()
+            return True, None
+
+        self.groups.move_to_end(key)
+        group.count += 1
+        if group.count == 2:
+            self.duplicate_groups += 1
+
+        # The last judge call of the group failed and failures are not shared: judge this row
+        if group.result is None and not group.judging:
+            group.leader, group.judging = index, True
+            self._judging[index] = key
+            return True, None
+
+        self.duplicate_of[index] = group.leader
+        self.duplicates += 1
+
+        if group.result is None:
+            group.waiting.append((index, conversation))
+        return False, group.result
+
+    def resolve(self, index: int, result: EvaluationResult) -> List[Tuple[int, Conversation]]:
+        """
+        Records the result of a judged row and returns the duplicates that were waiting for it.
+        Failed results are handed to the waiting duplicates but not kept for later ones.
+
+        :param index: The row index of the judged conversation.
+        :type index: int
+        :param result: Its evaluation result.
+        :type result: EvaluationResult
+        :return: The (row index, conversation) pairs sharing the result.
+        :rtype: List[Tuple[int, Conversation]]
+        """
+
+        key = self._judging.pop(index, None)
+        group = self.groups.get(key) if key is not None else None
+
+        if group is None or group.leader != index:
+            return []
+
+        group.judging = False
+        if result.scores:
+            group.result = result
+        waiting, group.waiting = group.waiting, []
+        return waiting
+
+    def stats(self, top: int = 100) -> Dict[str, Any]:
+        """
+        Summarises the grouping: rows seen, rows judged, rows answered from a duplicate, and the
+        largest groups with their row counts, so group-weighted figures can be reproduced.
+
+        :param top: Number of largest groups to list; forgotten groups are only listed up to
+            `top_groups`.
+        :type top: int
+        :return: The deduplication summary.
+        :rtype: Dict[str, Any]
+        """
+
+        counts = [(group.first, group.count) for group in self.groups.values() if group.count > 1]
+        counts.extend((-first, count) for count, first in self.retired)
+        largest = sorted(counts, key=lambda item: (-item[1], item[0]))[:top]
+        return {
+            "mode": self.mode,
+            "rows": self.rows,
+            "judged_rows": self.rows - self.duplicates,
+            "duplicate_rows": self.duplicates,
+            "duplicate_groups": self.duplicate_groups,
+            "largest_groups": [{"index": leader, "count": count} for leader, count in largest],
+        }
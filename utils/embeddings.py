@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from data_models.evaluation import Conversation
+from utils.logs import setup_logger
+from utils.scheduler import ProviderScheduler, estimate_tokens
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+
+logger = setup_logger("evaluation")
+
+#   Metrics the embedding engine can score, with the two texts whose similarity makes the score
+SIMILARITY_METRICS: Dict[str, Tuple[str, str]] = {
+    "relevancy": ("question", "response"),
+    "contextual_understanding": ("context", "response"),
+}
+
+EMBEDDING_MODES = ("off", "score", "triage")
+
+_scorer: Optional["EmbeddingScorer"] = None
+
+
+class EmbeddingScorer:
+    """
+    Scores similarity-style metrics from embeddings instead of a judge call. Relevancy is the
+    cosine similarity between question and response, contextual understanding between context
+    and response, mapped linearly from [`low`, `high`] onto 0-10.
+
+    Embeddings are cached in an LRU keyed by text, and texts requested by concurrent callers
+    within `linger` seconds are coalesced into `embed_documents` calls of up to `batch_size`
+    texts, so evaluating rows one by one still embeds in batches.
+    """
+
+    def __init__(self, embeddings: Embeddings, scheduler: ProviderScheduler = None, batch_size: int = 100,
+                 linger: float = 0.005, max_cache_entries: int = 100_000, low: float = 0.3, high: float = 0.85,
+                 triage_low: float = 3.0, triage_high: float = 7.0) -> None:
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_cache_entries = max_cache_entries
+        self.low = low
+        self.high = high
+        self.triage_low = triage_low
+        self.triage_high = triage_high
+
+        self.identity = f"{type(embeddings).__name__}:{getattr(embeddings, 'model', '')}"
+        self.cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "calls": 0}
+
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._queue: List[Tuple[str, str]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.identity}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self.cache[key] = vector
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.max_cache_entries:
+            self.cache.popitem(last=False)
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Returns the L2-normalised embeddings of `texts`, one row per text, from the cache where
+        possible and from the embedding model otherwise.
+
+        :param texts: The texts to embed.
+        :type texts: Sequence[str]
+        :return: A len(texts) × dimensions matrix.
+        :rtype: np.ndarray
+        """
+
+        keys = [self._key(text) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        futures: Dict[str, asyncio.Future] = {}
+        loop = asyncio.get_running_loop()
+
+        for key, text in zip(keys, texts):
+            if key in vectors or key in futures:
+                continue
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                vectors[key] = self.cache[key]
+                self.counters["hits"] += 1
+            elif key in self._inflight:
+                futures[key] = self._inflight[key]
+            else:
+                self.counters["misses"] += 1
+                futures[key] = self._inflight[key] = loop.create_future()
+                self._queue.append((key, text))
+
+        if len(self._queue) >= self.batch_size:
+            self._flush()
+        elif self._queue and self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+
+        for key, future in futures.items():
+            vectors[key] = await asyncio.shield(future)
+
+        return np.stack([vectors[key] for key in keys])
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queue:
+            chunk, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            task = asyncio.ensure_future(self._embed_chunk(chunk))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed_chunk(self, chunk: List[Tuple[str, str]]) -> None:
+        texts = [text for _, text in chunk]
+        self.counters["calls"] += 1
+
+        try:
+            if self.scheduler:
+                tokens = sum(estimate_tokens(text) for text in texts)
+                vectors = await self.scheduler.run(lambda: self.embeddings.aembed_documents(texts), tokens=tokens)
+            else:
+                vectors = await self.embeddings.aembed_documents(texts)
+
+            # A short reply would leave the futures of the unmatched texts waiting forever
+            if len(vectors) != len(texts):
+                raise ValueError(f"Embedding model returned {len(vectors)} vectors for {len(texts)} texts")
+
+            matrix = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+
+            for (key, _), vector in zip(chunk, matrix):
+                self._remember(key, vector)
+                self._inflight.pop(key).set_result(vector)
+
+        except Exception as e:
+            logger.error(f"Error embedding {len(texts)} texts: {str(e)}")
+            for key, _ in chunk:
+                future = self._inflight.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+
+    def scorable(self, metrics: Sequence[str], context: str) -> List[str]:
+        """
+        Returns the metrics of `metrics` that can be scored from embeddings; contextual
+        understanding needs a non-empty context.
+        """
+
+        return [
+            metric for metric in metrics
+            if metric in SIMILARITY_METRICS and (context.strip() or "context" not in SIMILARITY_METRICS[metric])
+        ]
+
+    async def score(self, conversations: Sequence[Conversation], context: str,
+                    metrics: Sequence[str]) -> List[Dict[str, float]]:
+        """
+        Scores `metrics` (see `scorable`) for every conversation from embedding similarities.
+        All questions, responses and the context are embedded together, and the similarities
+        of every row come out of one vectorised dot product per metric.
+
+        :param conversations: The conversations to score.
+        :type conversations: Sequence[Conversation]
+        :param context: The context of the evaluation.
+        :type context: str
+        :param metrics: The similarity metrics to score.
+        :type metrics: Sequence[str]
+        :return: The scores of every conversation keyed by metric, in the same order.
+        :rtype: List[Dict[str, float]]
+        """
+
+        count = len(conversations)
+        matrix = await self.embed(
+            [conversation.user_question for conversation in conversations]
+            + [conversation.bot_response for conversation in conversations]
+            + [context]
+        )
+        sources = {"question": matrix[:count], "response": matrix[count:2 * count], "context": matrix[2 * count:]}
+
+        scores = {}
+        for metric in metrics:
+            left, right = SIMILARITY_METRICS[metric]
+            similarity = np.einsum("ij,ij->i", *np.broadcast_arrays(sources[left], sources[right])).astype(np.float64)
+            scaled = np.clip((similarity - self.low) / (self.high - self.low), 0.0, 1.0) * 10
+            scores[metric] = np.round(scaled, 1)
+
+        return [{metric: float(scores[metric][row]) for metric in metrics} for row in range(count)]
+
+    def is_confident(self, scores: Dict[str, float]) -> bool:
+        """
+        Triage rule: embedding scores are trusted when every one of them is clearly low or
+        clearly high; rows in between are sent to the judge model.
+        """
+
+        return all(score <= self.triage_low or score >= self.triage_high for score in scores.values())
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            "cache_entries": len(self.cache),
+        }
+
+
+def get_embedding_scorer() -> EmbeddingScorer:
+    """
+    Returns the process-wide embedding scorer, built on the registry's embedding model. The
+    similarity range and triage thresholds can be tuned through EMBEDDING_SIMILARITY_LOW,
+    EMBEDDING_SIMILARITY_HIGH, EMBEDDING_TRIAGE_LOW and EMBEDDING_TRIAGE_HIGH.
+
+    :return: The shared embedding scorer.
+    :rtype: EmbeddingScorer
+    """
+
+    global _scorer
+
+    if _scorer is None:
+        from utils.hashing_embeddings import HashingEmbeddings
+        from utils.registry import get_registry
+        from utils.scheduler import get_scheduler
+
+        embeddings = get_registry().embeddings()
+        _scorer = EmbeddingScorer(
+            embeddings,
+            # Hosted embeddings share the Gemini quota with the judge calls
+            scheduler=None if isinstance(embeddings, HashingEmbeddings) else get_scheduler("gemini"),
+            batch_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", 100)),
+            low=float(os.environ.get("EMBEDDING_SIMILARITY_LOW", 0.3)),
+            high=float(os.environ.get("EMBEDDING_SIMILARITY_HIGH", 0.85)),
+            triage_low=float(os.environ.get("EMBEDDING_TRIAGE_LOW", 3.0)),
+            triage_high=float(os.environ.get("EMBEDDING_TRIAGE_HIGH", 7.0)),
+        )
+
+    return _scorer
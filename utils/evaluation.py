@@ -1,17 +1,38 @@
+from __future__ import annotations
+
 import asyncio
+import functools
+import hashlib
 import json
+import logging
 import os
-from collections import defaultdict
-from typing import Self, Dict, Any, List
-from langchain.schema import HumanMessage
+import time
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Self, Dict, Any, List, Tuple, Optional, Union, Iterable, AsyncIterable, AsyncIterator, Callable
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
-from langchain_core.messages.ai import AIMessage
-from langchain_core.output_parsers.json import JsonOutputParser
-from langchain_core.language_models.chat_models import BaseChatModel
-from data_models.evaluation import EvaluationRequest, EvaluationResult, Conversation
-from utils.logs import setup_logger
-
+from data_models.evaluation import (
+    EvaluationRequest, EvaluationSettings, EvaluationResult, BatchEvaluationResult, Conversation
+)
+from utils.aggregation import ScoreAggregator
+from utils.benchmarks import BenchmarkStore
+from utils.cache import EvaluationCache, model_fingerprint
+from utils.context_index import ContextIndex, build_context_index
+from utils.dedup import Deduplicator
+from utils.embeddings import EmbeddingScorer
+from utils.judge_output import JudgeOutputError, parse_evaluation, parse_batch_evaluation, get_judge_stats
+from utils.logs import setup_logger, payload_mode, format_payload, set_payload_capture
+from utils.sampling import SampledEvaluation
+from utils.metrics import (
+    LLM_IN_FLIGHT, LLM_REQUEST_SECONDS, LLM_REQUESTS, LLM_TOKENS, ROWS_EVALUATED, ROWS_PER_SECOND,
+    report_timings, start_timings, timed
+)
+from utils.scheduler import ProviderScheduler, get_provider, estimate_tokens
+
+#   LangChain is imported where it is used: it is about half of the server's import time
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
 
 load_dotenv()
 
@@ -19,60 +40,57 @@ logger = setup_logger("evaluation")
 
 
 
-def get_model(model_name: str, model_params: Dict[str, Any] = None) -> Dict[str, Any]:
-    """
-    Creates and returns a dictionary containing a chat model and an embedding model. The chat model
-    is selected based on the provided `model_name` and can be derived from supported APIs such as
-    OpenAI's GPT, Gemini, or Groq. The embedding model uses Google Generative AI embeddings.
+DEFAULT_MODEL_PARAMS: Dict[str, Any] = {
+    "temperature": 0.0,
+    "max_tokens": 512,
+    "top_p": 1.0,
+    "timeout": 60,
+    "stream": False,
+    "max_retries": 3,
+}
 
-    If specific parameters for the model are not provided, default parameter values are used
-    to configure the model. The method also dynamically sets environment variables if they
-    are missing, ensuring proper API authentication.
+
+def build_chat_model(model_name: str, model_params: Dict[str, Any] = None) -> BaseChatModel:
+    """
+    Creates a chat model selected based on the provided `model_name`. Supported APIs are
+    OpenAI's GPT, Gemini, and Groq; names starting with "fake" select the offline judge from
+    `utils.fake_model`, configured through `FAKE_JUDGE_*` environment variables. If specific parameters for the model are not provided,
+    `DEFAULT_MODEL_PARAMS` are used. The method also dynamically sets environment variables
+    if they are missing, ensuring proper API authentication.
 
     :param model_name: The name of the model to be configured. Must start with identifiers like
-        "gpt", "gemini", or "groq" to specify the type of model.
+        "gpt", "gemini", "groq" or "fake" to specify the type of model (see `utils.scheduler.get_provider`).
     :type model_name: str
     :param model_params: Optional dictionary containing specific configuration settings for the model.
         Settings such as `temperature`, `max_tokens`, and `timeout` can be defined here.
     :type model_params: Dict[str, Any], optional
-    :return: A dictionary containing the configured chat model and embedding instance. Dictionary keys
-        include "chat" for the chat model and "embeddings" for the embedding model instance.
-    :rtype: Dict[str, Any
+    :return: The configured chat model.
+    :rtype: BaseChatModel
     """
 
-    from langchain_google_genai import GoogleGenerativeAIEmbeddings
-
-    if "GOOGLE_API_KEY" not in os.environ:
-        os.environ["GOOGLE_API_KEY"] = os.environ.get("GEMINI_API_KEY")
-
-    embedding = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-    if not model_params:
-        model_params = {
-            "temperature": 0.0,
-            "max_tokens": 512,
-            "top_p": 1.0,
-            "timeout": 60,
-            "stream": False,
-            "max_retries": 3,
-        }
+    model_params = dict(model_params or DEFAULT_MODEL_PARAMS)
+    provider = get_provider(model_name)
 
     #   GPT models
-    if model_name.startswith("gpt"):
+    if provider == "gpt":
         from langchain_community.chat_models import ChatOpenAI
 
         if "OPENAI_API_KEY" not in os.environ:
             os.environ["OPENAI_API_KEY"] = os.environ.get("OPENAI_API_KEY")
 
-        chat = ChatOpenAI(model=model_name, **model_params)
+        return ChatOpenAI(model=model_name, **model_params)
 
     #   Gemini models
-    elif model_name.startswith("gemini"):
+    elif provider == "gemini":
         from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
 
-        chat = ChatGoogleGenerativeAI(model=model_name, **model_params)
+        if "GOOGLE_API_KEY" not in os.environ:
+            os.environ["GOOGLE_API_KEY"] = os.environ.get("GEMINI_API_KEY")
+
+        return ChatGoogleGenerativeAI(model=model_name, **model_params)
 
     #   Groq models
-    elif model_name.startswith("groq"):
+    elif provider == "groq":
         from langchain_groq import ChatGroq
 
         model_name = model_name.replace("groq-", "")
@@ -83,48 +101,209 @@ def get_model(model_name: str, model_params: Dict[str, Any] = None) -> Dict[str,
         model_params.pop("stream", None)
         model_params.pop("top_p", None)
 
-        chat = ChatGroq(model=model_name, **model_params)
+        return ChatGroq(model=model_name, **model_params)
+
+    #   Offline fake judge for load tests, no API key needed
+    elif provider == "fake":
+        from utils.fake_model import FakeJudgeChatModel
+
+        return FakeJudgeChatModel.from_env(model_name, model_params)
+
+    raise ValueError("Unsupported model")
+
+
+def build_embeddings(model_name: str = None) -> Embeddings:
+    """
+    Creates the embedding model: Google Generative AI embeddings by default, or the offline
+    `utils.hashing_embeddings.HashingEmbeddings` when the model name is "hashing". The name defaults to
+    the EMBEDDING_MODEL environment variable.
+
+    :param model_name: The name of the embedding model.
+    :type model_name: str, optional
+    :return: The configured embedding model.
+    :rtype: Embeddings
+    """
+
+    model_name = model_name or os.environ.get("EMBEDDING_MODEL", "models/text-embedding-004")
+
+    if model_name == "hashing":
+        from utils.hashing_embeddings import HashingEmbeddings
+
+        return HashingEmbeddings()
+
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    if "GOOGLE_API_KEY" not in os.environ:
+        os.environ["GOOGLE_API_KEY"] = os.environ.get("GEMINI_API_KEY")
 
-    else:
-        raise ValueError("Unsupported model")
+    return GoogleGenerativeAIEmbeddings(model=model_name)
+
+
+def get_model(model_name: str, model_params: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Creates and returns a dictionary containing a chat model and an embedding model. Every call
+    builds new clients; long-running code should use `utils.registry.get_registry()` instead,
+    which keeps warm clients per model and creates embeddings only when they are needed.
+
+    :param model_name: The name of the model to be configured, see `build_chat_model`.
+    :type model_name: str
+    :param model_params: Optional dictionary containing specific configuration settings for the model.
+    :type model_params: Dict[str, Any], optional
+    :return: A dictionary containing the configured chat model and embedding instance. Dictionary keys
+        include "chat" for the chat model and "embeddings" for the embedding model instance.
+    :rtype: Dict[str, Any]
+    """
 
     return {
-        "chat": chat,
-        "embeddings": embedding
+        "chat": build_chat_model(model_name, model_params),
+        # The offline fake judge must not require provider credentials
+        "embeddings": build_embeddings("hashing" if get_provider(model_name) == "fake" else None)
     }
 
 
-async def llm_response(llm: BaseChatModel, prompt: PromptTemplate) -> AIMessage:
+def preload_model_stack() -> None:
+    """
+    Imports the LangChain modules used to call the models, which are otherwise imported by the
+    first request that needs them. `python server.py` calls it before forking its workers so
+    that they share these modules instead of each importing them.
+    """
+
+    import langchain_core.embeddings
+    import langchain_core.language_models.chat_models
+    import langchain_core.messages
+
+    _format_instructions()
+
+
+def chat_model_name(llm: BaseChatModel) -> str:
+    """
+    Name of a chat model as used in logs and metrics, e.g. "gpt-4o-mini".
+    """
+
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def _record_usage(model: str, response: AIMessage) -> None:
+    LLM_REQUESTS.inc(model=model, outcome="ok")
+    usage = getattr(response, "usage_metadata", None) or {}
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), model=model, direction="input")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), model=model, direction="output")
+
+
+async def llm_response(llm: BaseChatModel, prompt: str, system: str = None) -> AIMessage:
     """
-    Generate a response using a language model (LLM) based on the provided prompt. Also, if a user ID is provided,
-    update the token consumption count for that user in Redis.
+    Sends one request to a language model (LLM): the prompt as the user message, preceded by
+    `system` as the system message when given. Rate limiting is not applied here; callers run
+    this through the provider's `utils.scheduler.ProviderScheduler` (see `Evaluator._call_llm`).
 
-    The function communicates with the specified language model to produce an AI-generated message.
-    The prompt provided guides the message generation process. Additionally, if a user ID is supplied,
-    the function logs the token usage of the response in a Redis store for tracking daily quota consumption.
+    The call is recorded in the LLM metrics: in-flight requests, request latency, the outcome,
+    and the input and output tokens reported by the provider. The prompt and response are
+    logged as described in `utils.logs.payload_mode`.
 
     :param llm: Language model to be used for generating responses.
     :type llm: BaseChatModel
     :param prompt: Template containing the content to guide the AI model's response.
-    :type prompt: PromptTemplate
+    :type prompt: str
+    :param system: Optional static instructions sent as the system message, ahead of the prompt.
+        Keeping them identical across calls lets providers reuse their prompt cache for them.
+    :type system: str, optional
     :return: AI-generated message from the LLM.
     :rtype: AIMessage
     """
 
-    response = await llm.ainvoke(input=[HumanMessage(content=prompt)])
-    logger.info(f"LLM Prompt ==> {prompt}\n\nLLM Response: {response.content}")
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    messages = [SystemMessage(content=system), HumanMessage(content=prompt)] if system else [HumanMessage(content=prompt)]
+    model = chat_model_name(llm)
+    started = time.perf_counter()
+
+    try:
+        with LLM_IN_FLIGHT.track(model=model):
+            response = await llm.ainvoke(input=messages)
+    except Exception:
+        LLM_REQUESTS.inc(model=model, outcome="error")
+        raise
+    finally:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, model=model)
+
+    _record_usage(model, response)
+
+    # Bodies are only logged in full for requests that opted in, see `utils.logs.payload_mode`
+    if logger.isEnabledFor(logging.INFO):
+        mode = payload_mode()
+        logger.info(
+            f"LLM System ==> {format_payload(system or '', mode)}\n\nLLM Prompt ==> {format_payload(prompt, mode)}"
+            f"\n\nLLM Response: {format_payload(response.content, mode)}"
+        )
 
     return response
 
 
 
 
+#   Yielded by a conversation stream to send the rows batched so far without waiting for a full
+#   batch, e.g. before the stream pauses until results come back. It takes up no row index
+FLUSH_BATCH = object()
+
+
+async def _batched(conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]], size: int,
+                   keep: Callable[[int, Conversation], bool] = None) -> AsyncIterator[List[Tuple[int, Conversation]]]:
+    """
+    Groups a sync or async stream of conversations into lists of (row index, conversation)
+    pairs of at most `size` items. When `keep` is given, rows it rejects are left out of the
+    batches but still take up their row index. A `FLUSH_BATCH` in the stream ends the current
+    batch early.
+    """
+
+    batch = []
+    index = 0
+
+    if not hasattr(conversations, "__aiter__"):
+        conversations = _aiter(conversations)
+
+    rows = conversations.__aiter__()
+    while True:
+        # Waiting for the next row is the ingest time of a streamed upload
+        with timed("ingest"):
+            try:
+                conversation = await rows.__anext__()
+            except StopAsyncIteration:
+                break
+
+        if conversation is FLUSH_BATCH:
+            if batch:
+                yield batch
+                batch = []
+            continue
+
+        if keep is None or keep(index, conversation):
+            batch.append((index, conversation))
+        index += 1
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+async def _aiter(items: Iterable[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+
+
 class BotResponseGenerator:
 
+    system_template = """
+        Given the following context, answer the user’s question:
+        Context: {context}
+        """
+
     def __init__(self, chat_model: BaseChatModel) -> None:
         self.llm = chat_model
 
-    async def get_response(self, user_question: str, context: str) -> AIMessage:
+    async def get_response(self, user_question: str, context: str, context_index: ContextIndex = None) -> AIMessage:
         """
         Retrieves an AI-generated response based on a user's question and context.
 
@@ -136,32 +315,144 @@ class BotResponseGenerator:
 
         :param user_question: The question posed by the user for the AI to answer.
         :param context: The contextual information relevant to answering the user's question.
+        :param context_index: Optional index of `context`; when the context exceeds its budget,
+            only the excerpts relevant to the question are sent, along with the question.
         :return: An AIMessage containing the response generated by the LLM based on the user's question and context.
         :rtype: AIMessage
         """
 
-        prompt_template = PromptTemplate(
-            template="""
-            Given the following context, answer the user’s question:
-            Context: {context}
-            User Question: {user_question}
-            """,
-            input_variables=["context", "user_question"]
-        )
-        prompt = prompt_template.format(context=context, user_question=user_question)
+        prompt, system = self._prompt(user_question, context, context_index)
+        return await llm_response(self.llm, prompt, system=system)
+
+    async def get_responses(self, user_questions: List[str], context: str,
+                            context_index: ContextIndex = None) -> List[Union[AIMessage, Exception]]:
+        """
+        Answers several questions with one `abatch` call of the chat model, which providers
+        with a native batch API serve in one go and other models run concurrently. A failing
+        question does not fail the others: its exception is returned in its place.
+
+        :param user_questions: The questions to answer.
+        :param context: The contextual information relevant to answering the questions.
+        :param context_index: Optional index of `context`, see `get_response`.
+        :return: The response, or the exception raised, for every question in order.
+        :rtype: List[Union[AIMessage, Exception]]
+        """
+
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        inputs = []
+        for user_question in user_questions:
+            prompt, system = self._prompt(user_question, context, context_index)
+            inputs.append([SystemMessage(content=system), HumanMessage(content=prompt)])
+
+        model = chat_model_name(self.llm)
+        with LLM_IN_FLIGHT.track(model=model):
+            responses = await self.llm.abatch(inputs, return_exceptions=True)
+
+        for response in responses:
+            if isinstance(response, Exception):
+                LLM_REQUESTS.inc(model=model, outcome="error")
+            else:
+                _record_usage(model, response)
+
+        return responses
+
+    def token_estimate(self, user_question: str, context: str, context_index: ContextIndex = None) -> int:
+        """
+        Estimated tokens of answering one question, for tokens-per-minute scheduling: the
+        prompt, the system prompt with the context, and the longest answer the model may give.
+
+        :param user_question: The question to answer.
+        :param context: The contextual information relevant to answering the question.
+        :param context_index: Optional index of `context`, see `get_response`.
+        :return: The estimated number of tokens.
+        :rtype: int
+        """
+
+        prompt, system = self._prompt(user_question, context, context_index)
+        return estimate_tokens(prompt) + estimate_tokens(system) + (getattr(self.llm, "max_tokens", None) or 0)
+
+    def _prompt(self, user_question: str, context: str, context_index: ContextIndex = None) -> Tuple[str, str]:
+        prompt = f"User Question: {user_question}"
+
+        if context_index is not None and not context_index.full:
+            context = context_index.system_context
+            prompt = ROW_CONTEXT_TEMPLATE.format(context=context_index.select(user_question)) + prompt
+
+        return prompt, self._system_prompt(context)
+
+    @classmethod
+    @functools.lru_cache(maxsize=64)
+    def _system_prompt(cls, context: str) -> str:
+        return cls.system_template.format(context=context)
+
+
+
+#   Static part of the evaluation prompts. The context and metrics are the same for every row
+#   of an evaluation and are rendered once per evaluation by `Evaluator._system_prompt`
+SYSTEM_TEMPLATE = """
+    Evaluate the bot response given by the user.
+    {format_instructions}
+    Context: {context}
+    Metrics: {metrics}
+
+    ** You need to score the bot response out of 10. **
+    """
+
+BATCH_SYSTEM_TEMPLATE = """
+    Evaluate each of the bot responses given by the user independently.
+    Return a JSON array with exactly one object per conversation. Each object must follow
+    this schema and echo the conversation's id:
+    {schema}
+    Context: {context}
+    Metrics: {metrics}
+
+    ** You need to score every bot response out of 10. **
+    """
+
+ROW_TEMPLATE = "User Question: {user_question}\nBot Answer: {bot_answer}"
+
+#   Prepended to a row when only the excerpts of a long context relevant to it are sent
+ROW_CONTEXT_TEMPLATE = "Context: {context}\n"
+
+#   Sent instead of a row's prompt when the judge's reply to it could not be used
+REPAIR_TEMPLATE = """{prompt}
 
-        return await llm_response(self.llm, prompt)
+Your previous reply could not be used: {error}.
+Previous reply: {reply}
+Reply again with only the JSON object, scoring every metric from 0 to 10."""
 
 
+@functools.cache
+def _format_instructions() -> str:
+    from langchain_core.output_parsers.json import JsonOutputParser
+
+    return JsonOutputParser(pydantic_object=EvaluationResult).get_format_instructions()
+
 
 class Evaluator:
 
-    parser = JsonOutputParser(pydantic_object=EvaluationResult)
+    #   Maximum number of rows being evaluated at once by `iter_results`
+    window = int(os.environ.get("EVALUATION_WINDOW", 256))
 
-    def __init__(self, chat_model: BaseChatModel) -> Self:
-        self.llm = chat_model
+    #   Extra judge calls made for a row whose reply could not be parsed or validated
+    max_repairs = int(os.environ.get("EVALUATION_MAX_REPAIRS", 1))
 
-    async def _evaluate(self, conversation: Conversation, context: str, metrics: List[str]) -> EvaluationResult:
+    def __init__(self, chat_model: BaseChatModel, scheduler: ProviderScheduler = None,
+                 cache: EvaluationCache = None, cache_mode: str = "use", priority: int = 0,
+                 benchmarks: BenchmarkStore = None, scorer: EmbeddingScorer = None) -> Self:
+        self.llm = chat_model
+        self.scorer = scorer
+        self.scheduler = scheduler
+        self.priority = priority
+        self.benchmarks = benchmarks
+        self.cache = cache
+        self.cache_mode = cache_mode
+        self.model_fingerprint = model_fingerprint(chat_model)
+        self.model_name = chat_model_name(chat_model)
+        self.stats = get_judge_stats()
+
+    async def _evaluate(self, conversation: Conversation, context: ContextIndex, metrics: List[str]) -> EvaluationResult:
         """
         Asynchronously evaluates the conversation using a provided context and metrics,
         and returns the evaluation result. The function generates a prompt based on the
@@ -171,9 +462,9 @@ class Evaluator:
         :param conversation: The conversation containing the user's input
             and the bot's response.
         :type conversation: Conversation
-        :param context: The specific context in which the evaluation is
+        :param context: The index of the context in which the evaluation is
             being conducted.
-        :type context: str
+        :type context: ContextIndex
         :param metrics: A list of metrics to guide the evaluation,
             specifying evaluation criteria.
         :type metrics: List[str]
@@ -182,18 +473,411 @@ class Evaluator:
         :rtype: EvaluationResult
         """
 
-        prompt = self._generate_prompt(conversation, context, metrics)
-        response = await llm_response(self.llm, prompt)
-        logger.info(f"Raw Evaluation Result for {conversation.bot_response} ==> {response}")
+        with timed("prompt_build"):
+            system, digest = self._system_prompt(context.system_context, tuple(metrics))
+            prompt = self._generate_prompt(conversation, context.select(conversation.user_question))
+            key = self._cache_key(digest, prompt)
+
+        cached = await self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        return await self._judge(conversation, system, prompt, key, metrics)
+
+    async def _judge(self, conversation: Conversation, system: str, prompt: str, key: str,
+                     metrics: List[str]) -> EvaluationResult:
+        """
+        Sends a single-conversation prompt to the judge model, parses the reply and stores the
+        result in the evaluation cache. A reply that cannot be parsed, or lacks a valid score
+        for a metric, is sent back to the judge with what was wrong with it, up to
+        `max_repairs` times. Errors of the judge call are not raised: the row gets a result
+        without scores, so the other rows of the evaluation are kept.
+
+        :param conversation: The conversation being evaluated.
+        :type conversation: Conversation
+        :param system: The static system prompt of the evaluation.
+        :type system: str
+        :param prompt: The rendered single-conversation prompt.
+        :type prompt: str
+        :param key: The cache key of the prompt.
+        :type key: str
+        :param metrics: The metrics the reply has to score.
+        :type metrics: List[str]
+        :return: The parsed evaluation result.
+        :rtype: EvaluationResult
+        """
+
+        request = prompt
+
+        for attempt in range(self.max_repairs + 1):
+            try:
+                response = await self._call_llm(request, system)
+            except Exception as e:
+                logger.error(f"Error evaluating conversation with {self.model_name}: {str(e)}")
+                self.stats.add(self.model_name, calls=1, rows=1, errors=1, failed_rows=1)
+                return EvaluationResult(scores={}, feedback=f"Evaluation failed: {str(e)}")
+
+            with timed("parse"):
+                result = self._parse_response(response, metrics)
+            if result.scores:
+                self.stats.add(self.model_name, calls=1, rows=1, repaired=int(attempt > 0))
+                await self._cache_set(key, result)
+                return result
+
+            self.stats.add(self.model_name, calls=1, parse_failures=1, repairs=int(attempt < self.max_repairs))
+            request = REPAIR_TEMPLATE.format(prompt=prompt, error=result.feedback, reply=str(response.content)[:1000])
+
+        self.stats.add(self.model_name, rows=1, failed_rows=1)
+        return result
+
+    async def _evaluate_batch(self, batch: List[Conversation], context: ContextIndex, metrics: List[str]) -> List[EvaluationResult]:
+        """
+        Evaluates several conversations with a single judge call. Conversations already in the
+        evaluation cache are answered from it, the rest are sent together and the judge returns
+        a JSON array keyed by conversation id; conversations missing from the reply, or whose
+        entry could not be parsed, are re-queued and evaluated on their own.
+
+        :param batch: The conversations to evaluate together.
+        :type batch: List[Conversation]
+        :param context: The index of the context in which the evaluation is being conducted.
+        :type context: ContextIndex
+        :param metrics: A list of metrics to guide the evaluation.
+        :type metrics: List[str]
+        :return: The evaluation results, in the same order as `batch`.
+        :rtype: List[EvaluationResult]
+        """
+
+        if len(batch) == 1:
+            return [await self._evaluate(batch[0], context, metrics)]
+
+        # Every row is cached under its single-conversation prompt, so batched and unbatched
+        # runs of the same data share cache entries
+        with timed("prompt_build"):
+            system, digest = self._system_prompt(context.system_context, tuple(metrics))
+            excerpts = [context.select(conversation.user_question) for conversation in batch]
+            prompts = [self._generate_prompt(conversation, excerpt) for conversation, excerpt in zip(batch, excerpts)]
+            keys = [self._cache_key(digest, prompt) for prompt in prompts]
+
+        results = {}
+        for index, key in enumerate(keys):
+            cached = await self._cache_get(key)
+            if cached is not None:
+                results[index] = cached
+
+        pending = [index for index in range(len(batch)) if index not in results]
+
+        if len(pending) > 1:
+            with timed("prompt_build"):
+                prompt = self._generate_batch_prompt([(index, batch[index]) for index in pending],
+                                                     [excerpts[index] for index in pending])
+            try:
+                response = await self._call_llm(prompt, self._batch_system_prompt(context.system_context, tuple(metrics)))
+            except Exception as e:
+                # The rows are judged one by one below, where their errors are handled
+                logger.error(f"Error evaluating batch with {self.model_name}: {str(e)}")
+                self.stats.add(self.model_name, calls=1, errors=1)
+                parsed = {}
+            else:
+                with timed("parse"):
+                    parsed = self._parse_batch_response(response, pending, metrics)
+                self.stats.add(self.model_name, calls=1, rows=len(parsed),
+                               parse_failures=int(len(parsed) < len(pending)))
+
+            for index, result in parsed.items():
+                await self._cache_set(keys[index], result)
+            results.update(parsed)
+
+        missing = [index for index in pending if index not in results]
+
+        if missing:
+            if len(pending) > 1:
+                logger.warning(f"Re-queuing {len(missing)} of {len(pending)} conversations missing from batch reply")
+            retried = await asyncio.gather(*[
+                self._judge(batch[index], system, prompts[index], keys[index], metrics) for index in missing
+            ])
+            results.update(zip(missing, retried))
+
+        return [results[index] for index in range(len(batch))]
+
+    async def _score_batch(self, batch: List[Conversation], settings: EvaluationSettings,
+                           context: ContextIndex) -> List[EvaluationResult]:
+        """
+        Evaluates a batch according to the settings' `embedding_mode`. With "score", the
+        similarity metrics (see `utils.embeddings.SIMILARITY_METRICS`) are scored from embeddings
+        and only the remaining metrics go to the judge model; with "triage", embedding scores are
+        only kept for rows where they are clearly low or high, and the other rows are judged on
+        every metric. Rows left without any metric for the judge make no judge call at all.
+
+        :param batch: The conversations to evaluate together.
+        :type batch: List[Conversation]
+        :param settings: The settings of the evaluation.
+        :type settings: EvaluationSettings
+        :param context: The index of the evaluation's context.
+        :type context: ContextIndex
+        :return: The evaluation results, in the same order as `batch`.
+        :rtype: List[EvaluationResult]
+        """
+
+        similar = self.scorer.scorable(settings.metrics, settings.context) if self.scorer else []
+        if settings.embedding_mode == "off" or not similar:
+            return await self._evaluate_batch(batch, context, settings.metrics)
+
+        similarity = await self.scorer.score(batch, settings.context, similar)
+        remaining = [metric for metric in settings.metrics if metric not in similar]
+
+        # Rows needing the same metrics from the judge are still sent together
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        for index, scores in enumerate(similarity):
+            if settings.embedding_mode == "score" or self.scorer.is_confident(scores):
+                groups.setdefault(tuple(remaining), []).append(index)
+            else:
+                similarity[index] = {}
+                groups.setdefault(tuple(settings.metrics), []).append(index)
+
+        judged = {}
+        groups = {metrics: rows for metrics, rows in groups.items() if metrics}
+        evaluated = await asyncio.gather(*[
+            self._evaluate_batch([batch[index] for index in rows], context, list(metrics))
+            for metrics, rows in groups.items()
+        ])
+        for rows, results in zip(groups.values(), evaluated):
+            judged.update(zip(rows, results))
+
+        results = []
+        for index, scores in enumerate(similarity):
+            result = judged.get(index)
+            if result is None:
+                results.append(EvaluationResult(scores=scores, feedback="Scored by embedding similarity."))
+            else:
+                results.append(EvaluationResult(scores={**scores, **result.scores}, feedback=result.feedback))
+
+        return results
+
+    def _cache_key(self, system_digest: str, prompt: str) -> str:
+        # The system prompt is identified by its digest so the shared context is hashed only once
+        return EvaluationCache.make_key(self.model_fingerprint, f"{system_digest}\n{prompt}")
+
+    async def _cache_get(self, key: str) -> Optional[EvaluationResult]:
+        if not self.cache or self.cache_mode != "use":
+            return None
+
+        return await self.cache.get(key)
+
+    async def _cache_set(self, key: str, result: EvaluationResult) -> None:
+        # Failed parses come back without scores and are not worth remembering
+        if not self.cache or self.cache_mode == "bypass" or not result.scores:
+            return
+
+        await self.cache.set(key, result)
+
+    async def _call_llm(self, prompt: str, system: str = None) -> AIMessage:
+        """
+        Sends a prompt to the judge model. When the evaluator has a provider scheduler the call
+        goes through it with the evaluator's priority, so concurrency and request/token rates
+        stay within the provider's limits.
+
+        :param prompt: The rendered prompt to send.
+        :type prompt: str
+        :param system: The static system prompt sent ahead of `prompt`.
+        :type system: str, optional
+        :return: The AI-generated message from the judge model.
+        :rtype: AIMessage
+        """
+
+        # Includes the time spent queueing in the scheduler
+        with timed("llm_wait"):
+            if not self.scheduler:
+                return await llm_response(self.llm, prompt, system)
+
+            tokens = estimate_tokens(prompt) + estimate_tokens(system or "") + (getattr(self.llm, "max_tokens", None) or 0)
+            return await self.scheduler.run(lambda: llm_response(self.llm, prompt, system), tokens=tokens, priority=self.priority)
+
+    async def iter_results(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                           settings: EvaluationSettings,
+                           deduplicator: Deduplicator = None) -> AsyncIterator[Tuple[int, Conversation, EvaluationResult]]:
+        """
+        Evaluates conversations as they are pulled from `conversations` and yields every result
+        as soon as it is available, in completion order. At most `window` rows are in flight, so
+        conversations can be streamed in from an upload of any size while evaluation is running.
+        The scheduler (if any) additionally bounds how many judge calls hit the provider at once.
+        When the evaluator has a benchmark store, the results are also persisted as a run,
+        except for sampled evaluations: their rows are a sample, so neither the run's means nor
+        its dataset hash would describe the dataset, see `SampledEvaluation`.
+
+        Unless the settings' `dedup` is "off", duplicate rows are grouped ahead of the judge:
+        only the first row of a group is judged and every member gets its result, so each row
+        still yields its own result and averages stay weighted by row.
+
+        :param conversations: The conversations to evaluate, as a list or an async stream.
+        :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+        :param settings: The metrics, context and batch size of the evaluation.
+        :type settings: EvaluationSettings
+        :param deduplicator: Optional deduplicator to use, so the caller can read its grouping
+            afterwards; one is created from the settings otherwise.
+        :type deduplicator: Deduplicator, optional
+        :return: An async iterator over (row index, conversation, result) tuples.
+        :rtype: AsyncIterator[Tuple[int, Conversation, EvaluationResult]]
+        """
+
+        evaluated = self._iter_results(conversations, settings, deduplicator)
+        results = self.benchmarks.record(evaluated, settings) if self.benchmarks and not settings.sampled else evaluated
+
+        async with aclosing(evaluated), aclosing(results):
+            async for item in results:
+                ROWS_EVALUATED.inc(model=self.model_name)
+                ROWS_PER_SECOND.add()
+                yield item
+
+    async def _iter_results(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                            settings: EvaluationSettings,
+                            deduplicator: Deduplicator = None) -> AsyncIterator[Tuple[int, Conversation, EvaluationResult]]:
+        """
+        Runs the windowed evaluation pipeline behind `iter_results`.
+
+        :param conversations: The conversations to evaluate, as a list or an async stream.
+        :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+        :param settings: The metrics, context and batch size of the evaluation.
+        :type settings: EvaluationSettings
+        :param deduplicator: Optional deduplicator grouping the rows.
+        :type deduplicator: Deduplicator, optional
+        :return: An async iterator over (row index, conversation, result) tuples.
+        :rtype: AsyncIterator[Tuple[int, Conversation, EvaluationResult]]
+        """
+
+        results: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(max(1, self.window // settings.batch_size))
+        tasks = set()
+        finished = object()
+
+        if deduplicator is None and settings.dedup != "off":
+            deduplicator = Deduplicator(settings.dedup, settings.dedup_threshold)
+
+        # Chunking and indexing a long context is CPU-bound, keep it off the event loop
+        context = await asyncio.to_thread(
+            build_context_index, settings.context, settings.context_token_budget, settings.context_top_k
+        )
+
+        def judge(index: int, conversation: Conversation) -> bool:
+            # Duplicates of an already judged group are answered right away, the others wait for it
+            is_new, result = deduplicator.assign(index, conversation)
+            if result is not None:
+                results.put_nowait((index, conversation, result))
+            return is_new
+
+        async def run(batch: List[Tuple[int, Conversation]]) -> None:
+            try:
+                evaluated = await self._score_batch([conversation for _, conversation in batch], settings, context)
+                for (index, conversation), result in zip(batch, evaluated):
+                    results.put_nowait((index, conversation, result))
+                    if deduplicator:
+                        for member_index, member in deduplicator.resolve(index, result):
+                            results.put_nowait((member_index, member, result))
+            except Exception as e:
+                # Judge errors are handled per row; anything else fails this batch only
+                logger.error(f"Error evaluating {len(batch)} conversations: {str(e)}")
+                self.stats.add(self.model_name, rows=len(batch), errors=1, failed_rows=len(batch))
+                failed = EvaluationResult(scores={}, feedback=f"Evaluation failed: {str(e)}")
+                for index, conversation in batch:
+                    results.put_nowait((index, conversation, failed))
+                    if deduplicator:
+                        for member_index, member in deduplicator.resolve(index, failed):
+                            results.put_nowait((member_index, member, failed))
+            finally:
+                slots.release()
+
+        async def feed() -> None:
+            # Judge calls run in tasks created from here, so they inherit the capture setting
+            set_payload_capture(settings.capture_payloads)
+            try:
+                async for batch in _batched(conversations, settings.batch_size, judge if deduplicator else None):
+                    await slots.acquire()
+                    task = asyncio.create_task(run(batch))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                while tasks:
+                    await asyncio.wait(list(tasks))
+                results.put_nowait(finished)
+            except Exception as e:
+                results.put_nowait(e)
+
+        feeder = asyncio.create_task(feed())
+
+        try:
+            while (item := await results.get()) is not finished:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            feeder.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+    async def evaluate_stream(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                              settings: EvaluationSettings) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Evaluates a (possibly streamed) set of conversations and calculates average scores for
+        each evaluation metric across all conversations.
+
+        :param conversations: The conversations to evaluate, as a list or an async stream.
+        :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+        :param settings: The metrics, context and batch size of the evaluation.
+        :type settings: EvaluationSettings
+        :return: A dictionary containing the results of evaluation for each conversation,
+                 the average scores for each metric across all conversations with a valid score,
+                 their distribution statistics and, when duplicates are grouped, the group counts.
+                 With the settings' `timings`, the time spent per stage is added in milliseconds.
+                 When the settings ask for sampling, only a sample is judged, see `SampledEvaluation`.
+        :rtype: dict
+        """
+
+        if settings.sampled:
+            return await SampledEvaluation(self).evaluate_stream(conversations, settings)
+
+        started = time.perf_counter()
+        timings = start_timings() if settings.timings else None
+        aggregator = ScoreAggregator(settings.metrics)
+        deduplicator = Deduplicator(settings.dedup, settings.dedup_threshold) if settings.dedup != "off" else None
+        evaluated = [item async for item in self.iter_results(conversations, settings, deduplicator)]
+        evaluated.sort(key=lambda item: item[0])
+
+        formatted_conversations = []
+
+        for index, conversation, result in evaluated:
+            bot_message = {
+                "text": conversation.bot_response,
+                "sender": "bot",
+                "evaluation": result.model_dump()
+            }
+            if deduplicator and index in deduplicator.duplicate_of:
+                bot_message["duplicate_of"] = deduplicator.duplicate_of[index]
+
+            # Format conversation messages for chat-ui-kit-react
+            formatted_conversations.extend([
+                {"text": conversation.user_question, "sender": "user"},
+                bot_message,
+            ])
+
+            with timed("aggregate"):
+                aggregator.add(result)
 
-        return self._parse_response(response)
+        with timed("aggregate"):
+            evaluation = {
+                "average_scores": aggregator.average_scores(),
+                "statistics": await asyncio.to_thread(aggregator.statistics),
+                "conversations": formatted_conversations  # Structured conversation data for the chat UI
+            }
+        if deduplicator:
+            evaluation["deduplication"] = deduplicator.stats()
+        if timings is not None:
+            evaluation["timings"] = {**report_timings(timings), "total": round((time.perf_counter() - started) * 1000, 3)}
+
+        return evaluation
 
     async def evaluate_conversation(self, request: EvaluationRequest) -> Dict[str, List[Dict[str, Any]]]:
         """
         Evaluates a set of conversations asynchronously and calculates average scores for
-        each evaluation metric across all conversations. The function processes evaluation
-        for each conversation provided in the request, gathers all results, and aggregates
-        scores per defined metrics.
+        each evaluation metric across all conversations. See `evaluate_stream`.
 
         :param request: The evaluation request containing conversations, context,
                         and metrics to be used for evaluation.
@@ -203,92 +887,124 @@ class Evaluator:
         :rtype: dict
         """
 
-        total_scores = defaultdict(int)
-        num_entries = len(request.conversations)
+        return await self.evaluate_stream(request.conversations, request)
 
-        # Run evaluation for all conversations asynchronously
-        tasks = [
-            self._evaluate(conversation, request.context, request.metrics)
-            for conversation in request.conversations
-        ]
-        results = await asyncio.gather(*tasks)
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _system_prompt(context: str, metrics: Tuple[str, ...]) -> Tuple[str, str]:
+        """
+        Renders the system prompt of single-conversation evaluations: the instructions, format
+        instructions, context and metrics. It is identical for every row of an evaluation, so it
+        is rendered once per (context, metrics) pair and sent ahead of the conversation, where
+        providers with automatic prompt caching (OpenAI, Gemini) can reuse it across calls.
 
-        formatted_conversations = []
+        :param context: A string containing the context or preamble for the conversation,
+            used to provide relevant background information for evaluation.
+        :param metrics: Metric names that specify the criteria against which the bot's
+            response is evaluated.
+        :return: The system prompt and its SHA-256 digest, used in cache keys.
+        :rtype: Tuple[str, str]
+        """
 
-        for conversation, result in zip(request.conversations, results):
-            # Format conversation messages for chat-ui-kit-react
-            formatted_conversations.extend([
-                {"text": conversation.user_question, "sender": "user"},
-                {
-                    "text": conversation.bot_response,
-                    "sender": "bot",
-                    "evaluation": result.model_dump()
-                },
-            ])
+        system = SYSTEM_TEMPLATE.format(
+            format_instructions=_format_instructions(), context=context, metrics=json.dumps(list(metrics))
+        )
+        return system, hashlib.sha256(system.encode("utf-8")).hexdigest()
 
-            for metric, score in result.scores.items():
-                total_scores[metric] += score
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _batch_system_prompt(context: str, metrics: Tuple[str, ...]) -> str:
+        """
+        Renders the system prompt of batched evaluations, see `_system_prompt`. It asks for a
+        JSON array with one object per conversation, echoing the conversation's id.
 
-        avg_scores = {metric: total / num_entries for metric, total in total_scores.items()}
-        avg_scores = {key: value for key, value in avg_scores.items() if key in request.metrics}
+        :param context: A string containing the context or preamble for the conversations.
+        :param metrics: Metric names that specify the evaluation criteria.
+        :return: The batched system prompt.
+        :rtype: str
+        """
 
-        return {
-            "average_scores": avg_scores,
-            "conversations": formatted_conversations  # Structured conversation data for the chat UI
-        }
+        return BATCH_SYSTEM_TEMPLATE.format(
+            schema=json.dumps(BatchEvaluationResult.model_json_schema()), context=context, metrics=json.dumps(list(metrics))
+        )
 
     @classmethod
-    def _generate_prompt(cls, conversation: Conversation, context: str, metrics: List[str]) -> str:
+    def _generate_prompt(cls, conversation: Conversation, context: str = "") -> str:
         """
-        Generates a prompt string designed for evaluating a bot response. It utilizes a
-        template with input and partial variables, and dynamically formats the template
-        content to include specific conversational details for evaluation purposes.
+        Generates the per-conversation part of an evaluation prompt, sent after the system
+        prompt of `_system_prompt`.
 
         :param conversation: An instance of the `Conversation` class containing
             information about the ongoing interaction, such as user question and
             bot response.
-        :param context: A string containing the context or preamble for the conversation,
-            used to provide relevant background information for evaluation.
-        :param metrics: List of metric names as strings that specify the criteria
-            against which the bot's response is evaluated.
-        :return: A formatted string that combines the provided conversation details,
-            context, and evaluation metrics, following a predefined prompt template.
+        :param context: Excerpts of the context selected for this conversation, if the
+            context is not part of the system prompt.
+        :return: The user question and bot answer to evaluate.
         :rtype: str
         """
 
-        template = PromptTemplate(
-            template="""
-            Evaluate the following bot response:
-            {format_instructions}
-            Context: {context}
-            User Question: {user_question}
-            Bot Answer: {bot_answer}
-            Metrics: {metrics}
+        prompt = ROW_TEMPLATE.format(user_question=conversation.user_question, bot_answer=conversation.bot_response)
+        return ROW_CONTEXT_TEMPLATE.format(context=context) + prompt if context else prompt
 
-            ** You need to score the bot response out of 10. **
-            """,
-            input_variables=["context", "user_question", "bot_answer", "metrics"],
-            partial_variables={"format_instructions": cls.parser.get_format_instructions()},
-        )
+    @classmethod
+    def _generate_batch_prompt(cls, conversations: List[Tuple[int, Conversation]], contexts: List[str] = None) -> str:
+        """
+        Generates the per-conversation part of a batched evaluation prompt, sent after the
+        system prompt of `_batch_system_prompt`. Every conversation is tagged with an id the
+        judge has to echo back in its result.
+
+        :param conversations: Pairs of (id, conversation) to include in the prompt.
+        :param contexts: Optional context excerpts of every conversation, see `_generate_prompt`.
+        :return: The conversations of the batch.
+        :rtype: str
+        """
 
-        return template.format(
-            context=context,
-            user_question=conversation.user_question,
-            bot_answer=conversation.bot_response,
-            metrics=json.dumps(metrics)
+        contexts = contexts or [""] * len(conversations)
+        return "\n\n".join(
+            f"Conversation id: {conversation_id}\n" + cls._generate_prompt(conversation, context)
+            for (conversation_id, conversation), context in zip(conversations, contexts)
         )
 
     @classmethod
-    def _parse_response(cls, response: AIMessage) -> EvaluationResult:
+    def _parse_batch_response(cls, response: AIMessage, ids: List[int], metrics: List[str]) -> Dict[int, EvaluationResult]:
+        """
+        Splits a batched judge reply back into per-conversation results, see
+        `utils.judge_output.parse_batch_evaluation`. Entries with an unknown id or without a
+        valid score for every metric are dropped, so the caller can re-queue those conversations.
+
+        :param response: The AIMessage object containing the batched reply.
+        :type response: AIMessage
+        :param ids: The conversation ids that were sent in the batch.
+        :type ids: List[int]
+        :param metrics: The metrics every entry has to score.
+        :type metrics: List[str]
+        :return: The parsed results keyed by conversation id.
+        :rtype: Dict[int, EvaluationResult]
+        """
+
+        try:
+            results = parse_batch_evaluation(str(response.content), ids, metrics)
+        except JudgeOutputError as e:
+            logger.error(f"Error parsing Batch Evaluation response: {str(e)}")
+            return {}
+
+        logger.debug("Formatted Batch Evaluation Result ==> %s", results)
+        return results
+
+    @classmethod
+    def _parse_response(cls, response: AIMessage, metrics: List[str]) -> EvaluationResult:
         """
         Parses the AI message response to extract evaluation results, which include
-        evaluation scores and feedback. Handles potential response format inconsistencies
-        or parsing errors. On parsing failure, returns default evaluation results with
-        an error message as feedback.
+        evaluation scores and feedback. JSON is extracted from fenced, embedded or truncated
+        output and the scores are validated against the metrics and the 0-10 range, see
+        `utils.judge_output.parse_evaluation`. On parsing failure, returns an evaluation
+        result without scores and the reason as feedback.
 
         :param response: The AIMessage object containing the response content to be
             parsed.
         :type response: AIMessage
+        :param metrics: The metrics the reply has to score.
+        :type metrics: List[str]
         :return: An EvaluationResult object with extracted scores and feedback.
             If an error occurs during parsing, returns an EvaluationResult with
             default values.
@@ -296,18 +1012,12 @@ class Evaluator:
         """
 
         try:
-            data = cls.parser.parse(response.content)
-            if not isinstance(data, dict):
-                data = json.loads(data)
-
-            logger.info(f"Formatted Evaluation Result ==> {data}")
-            return EvaluationResult(
-                scores=data.get("scores", {}),
-                feedback=data.get("feedback", "No feedback provided.")
-            )
+            result = parse_evaluation(str(response.content), metrics)
+            logger.debug("Formatted Evaluation Result ==> %s", result)
+            return result
 
-        except (json.JSONDecodeError, TypeError) as e:
-            logger.error(f"Error parsing Evaluation response: {str(e)}")
+        except JudgeOutputError as e:
+            logger.error(f"Error parsing Evaluation response {format_payload(response.content, payload_mode())}: {str(e)}")
             return EvaluationResult(
                 scores={},
                 feedback=f"Invalid response format: {str(e)}"
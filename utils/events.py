@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Union
+from starlette.responses import StreamingResponse
+from starlette.types import Receive
+from data_models.evaluation import Conversation, EvaluationSettings
+from utils.aggregation import ScoreAggregator, judge_agreement
+from utils.dedup import Deduplicator
+from utils.evaluation import Evaluator
+from utils.judges import JudgePanel
+from utils.logs import setup_logger
+
+
+logger = setup_logger("evaluation")
+
+#   Marks the end of a stream pushed through an asyncio.Queue
+END = object()
+
+
+def format_event(event: str, data: Any) -> str:
+    """
+    Serializes one Server-Sent Event.
+
+    :param event: The event name.
+    :type event: str
+    :param data: The JSON-serializable event payload.
+    :type data: Any
+    :return: The event in text/event-stream format.
+    :rtype: str
+    """
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """
+    Streaming response that starts sending while the request body is still being read.
+    Before ASGI 2.4, `StreamingResponse` listens for client disconnects on the receive channel
+    the body arrives on, so listening is deferred until `upload_done` is set.
+    """
+
+    def __init__(self, content: AsyncIterable[str], upload_done: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.upload_done = upload_done
+
+    async def listen_for_disconnect(self, receive: Receive) -> None:
+        await self.upload_done.wait()
+        await super().listen_for_disconnect(receive)
+
+
+async def iter_queue(queue: asyncio.Queue) -> AsyncIterator[Any]:
+    """
+    Yields items put on `queue` until `END` is received. Exceptions put on the queue are raised.
+
+    :param queue: The queue to drain.
+    :type queue: asyncio.Queue
+    :return: An async iterator over the queued items.
+    :rtype: AsyncIterator[Any]
+    """
+
+    while (item := await queue.get()) is not END:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+async def evaluation_events(evaluator: Evaluator,
+                            conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                            settings: EvaluationSettings, average_interval: float = 0.5) -> AsyncIterator[str]:
+    """
+    Runs an evaluation and yields it as Server-Sent Events: a `result` event per conversation
+    as soon as it is scored, an `average` event with the running `average_scores` at most every
+    `average_interval` seconds, and a final `summary` event that also carries the distribution
+    statistics. Failures end the stream with an `error` event.
+
+    :param evaluator: The evaluator running the judge model.
+    :type evaluator: Evaluator
+    :param conversations: The conversations to evaluate, as a list or an async stream.
+    :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+    :param settings: The metrics, context and batch size of the evaluation.
+    :type settings: EvaluationSettings
+    :param average_interval: Minimum number of seconds between two `average` events.
+    :type average_interval: float
+    :return: An async iterator over the serialized events.
+    :rtype: AsyncIterator[str]
+    """
+
+    aggregator = ScoreAggregator(settings.metrics)
+    deduplicator = Deduplicator(settings.dedup, settings.dedup_threshold) if settings.dedup != "off" else None
+    last_average = time.monotonic()
+
+    try:
+        async for index, conversation, result in evaluator.iter_results(conversations, settings, deduplicator):
+            aggregator.add(result)
+            event = {
+                "index": index,
+                "user_question": conversation.user_question,
+                "bot_response": conversation.bot_response,
+                "evaluation": result.model_dump()
+            }
+            if deduplicator and index in deduplicator.duplicate_of:
+                event["duplicate_of"] = deduplicator.duplicate_of[index]
+            yield format_event("result", event)
+
+            if time.monotonic() - last_average >= average_interval:
+                last_average = time.monotonic()
+                yield format_event("average", {
+                    "completed": aggregator.count,
+                    "average_scores": aggregator.average_scores()
+                })
+
+        summary = {
+            "completed": aggregator.count,
+            "average_scores": aggregator.average_scores(),
+            "statistics": await asyncio.to_thread(aggregator.statistics)
+        }
+        if deduplicator:
+            summary["deduplication"] = deduplicator.stats()
+        yield format_event("summary", summary)
+
+    except Exception as e:
+        logger.error(f"Error streaming evaluation: {str(e)}")
+        yield format_event("error", {"error": str(e)})
+
+
+async def panel_events(panel: JudgePanel, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                       settings: EvaluationSettings, average_interval: float = 0.5) -> AsyncIterator[str]:
+    """
+    Multi-judge counterpart of `evaluation_events`. `result` and `average` events carry the
+    `judge` they belong to and are sent as soon as that judge produces them, so fast judges
+    are not held back by slow ones. As in `evaluation_events`, each judge deduplicates the rows
+    and a copy's `result` event has its `duplicate_of`. When a judge finishes, a `judge_summary`
+    event with its statistics and `deduplication` summary (or a `judge_error` event) is sent; the final `summary` event holds the averages
+    of every judge and their agreement statistics.
+
+    :param panel: The judges evaluating the conversations.
+    :type panel: JudgePanel
+    :param conversations: The conversations to evaluate, as a list or an async stream.
+    :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+    :param settings: The settings of the evaluation.
+    :type settings: EvaluationSettings
+    :param average_interval: Minimum number of seconds between two `average` events of a judge.
+    :type average_interval: float
+    :return: An async iterator over the serialized events.
+    :rtype: AsyncIterator[str]
+    """
+
+    aggregators = {judge: ScoreAggregator(settings.metrics) for judge in panel.evaluators}
+    deduplicators = {
+        judge: Deduplicator(settings.dedup, settings.dedup_threshold) for judge in panel.evaluators
+    } if settings.dedup != "off" else {}
+    last_average = {judge: time.monotonic() for judge in panel.evaluators}
+    # Rows are stored at their index to keep judges aligned, so the aggregator count is not the progress
+    completed = {judge: 0 for judge in panel.evaluators}
+    failed = set()
+
+    try:
+        async for judge, index, conversation, result in panel.iter_results(conversations, settings, deduplicators):
+            aggregator = aggregators[judge]
+            deduplicator = deduplicators.get(judge)
+
+            if index is None:
+                if result is not None:
+                    failed.add(judge)
+                    yield format_event("judge_error", {"judge": judge, "error": str(result)})
+                else:
+                    summary = {
+                        "judge": judge,
+                        "completed": completed[judge],
+                        "average_scores": aggregator.average_scores(),
+                        "statistics": await asyncio.to_thread(aggregator.statistics)
+                    }
+                    if deduplicator:
+                        summary["deduplication"] = deduplicator.stats()
+                    yield format_event("judge_summary", summary)
+                continue
+
+            aggregator.add(result, index)
+            completed[judge] += 1
+            event = {
+                "judge": judge,
+                "index": index,
+                "user_question": conversation.user_question,
+                "bot_response": conversation.bot_response,
+                "evaluation": result.model_dump()
+            }
+            if deduplicator and index in deduplicator.duplicate_of:
+                event["duplicate_of"] = deduplicator.duplicate_of[index]
+            yield format_event("result", event)
+
+            if time.monotonic() - last_average[judge] >= average_interval:
+                last_average[judge] = time.monotonic()
+                yield format_event("average", {
+                    "judge": judge,
+                    "completed": completed[judge],
+                    "average_scores": aggregator.average_scores()
+                })
+
+        succeeded = {judge: aggregator for judge, aggregator in aggregators.items() if judge not in failed}
+        yield format_event("summary", {
+            "judges": {
+                judge: {"completed": completed[judge], "average_scores": aggregator.average_scores()}
+                for judge, aggregator in succeeded.items()
+            },
+            "agreement": await asyncio.to_thread(judge_agreement, succeeded) if len(succeeded) > 1 else {}
+        })
+
+    except Exception as e:
+        logger.error(f"Error streaming multi-judge evaluation: {str(e)}")
+        yield format_event("error", {"error": str(e)})
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+from utils.scheduler import estimate_tokens
+
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "lognormal", "exponential")
+
+_METRICS = re.compile(r"Metrics:\s*(\[[^\n]*\])")
+_CONVERSATION_ID = re.compile(r"^\s*Conversation id:\s*(\d+)\s*$", re.MULTILINE)
+_CONVERSATION = re.compile(r"User Question:\s*(.*?)\s*Bot Answer:\s*(.*?)\s*(?:Metrics:|\*\*|$)", re.DOTALL)
+
+
+class FakeJudgeError(RuntimeError):
+    """
+    Provider failure injected by `FakeJudgeChatModel`. Carries an HTTP-like `status_code`, so
+    injected 429s are recognised by `utils.scheduler.is_rate_limit_error` like real ones.
+    """
+
+    def __init__(self, message: str, status_code: int = 500) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeJudgeChatModel(BaseChatModel):
+    """
+    Offline stand-in for a judge model, used to load-test the evaluation pipeline without
+    spending provider quota. It answers single and batched evaluation prompts with JSON scores
+    for the metrics named in the prompt after a simulated latency, and can inject provider
+    errors, 429 rate-limit errors and malformed replies at configurable rates.
+
+    Scores only depend on `seed` and the evaluated conversation, so repeated runs over the same
+    data score identically. Latencies and injected failures are drawn from a generator seeded
+    with `seed`, which makes a run reproducible for a given call order.
+    """
+
+    model: str = "fake-judge"
+    latency: str = "lognormal"
+    latency_ms: float = 200.0
+    latency_jitter: float = 0.5
+    per_row_ms: float = 20.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    malformed_rate: float = 0.0
+    seed: int = 0
+    max_tokens: int = 512
+
+    _rng: random.Random = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        if self.latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unsupported latency distribution {self.latency!r}, expected one of {LATENCY_DISTRIBUTIONS}")
+
+        self._rng = random.Random(self.seed)
+
+    @classmethod
+    def from_env(cls, model_name: str, model_params: Dict[str, Any] = None) -> "FakeJudgeChatModel":
+        """
+        Creates a fake judge configured from `FAKE_JUDGE_*` environment variables, e.g.
+        FAKE_JUDGE_LATENCY_MS or FAKE_JUDGE_RATE_LIMIT_RATE. Entries of `model_params` that name
+        a field of the model take precedence; provider parameters such as `temperature` are ignored.
+
+        :param model_name: The name of the model, starting with "fake".
+        :type model_name: str
+        :param model_params: Optional model configuration.
+        :type model_params: Dict[str, Any], optional
+        :return: The configured fake judge.
+        :rtype: FakeJudgeChatModel
+        """
+
+        fields = [name for name in cls.model_fields if name != "model"]
+        params = {
+            name: os.environ[f"FAKE_JUDGE_{name.upper()}"]
+            for name in fields
+            if f"FAKE_JUDGE_{name.upper()}" in os.environ
+        }
+        params.update({name: value for name, value in (model_params or {}).items() if name in fields})
+
+        return cls(model=model_name, **params)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-judge"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model, "seed": self.seed}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        prompt = self._prompt(messages)
+        delay, error = self._draw(prompt)
+        time.sleep(delay)
+
+        if error:
+            raise error
+        return self._reply(prompt)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        prompt = self._prompt(messages)
+        delay, error = self._draw(prompt)
+        await asyncio.sleep(delay)
+
+        if error:
+            raise error
+        return self._reply(prompt)
+
+    @staticmethod
+    def _prompt(messages: List[BaseMessage]) -> str:
+        return "\n".join(message.content for message in messages if isinstance(message.content, str))
+
+    def _draw(self, prompt: str) -> Tuple[float, Optional[FakeJudgeError]]:
+        """
+        Draws the simulated latency of one call, in seconds, and the failure to inject, if any.
+        Batched prompts take `per_row_ms` longer for every additional conversation. Failures are
+        raised after the latency has been spent, so failed calls are not free.
+        """
+
+        rows = max(1, len(_CONVERSATION_ID.findall(prompt)))
+        base = self.latency_ms + self.per_row_ms * (rows - 1)
+
+        if self.latency == "constant":
+            delay = base
+        elif self.latency == "uniform":
+            delay = base * self._rng.uniform(1 - self.latency_jitter, 1 + self.latency_jitter)
+        elif self.latency == "lognormal":
+            delay = base * math.exp(self._rng.gauss(0.0, self.latency_jitter))
+        else:
+            delay = self._rng.expovariate(1.0 / base) if base > 0 else 0.0
+
+        draw = self._rng.random()
+        if draw < self.rate_limit_rate:
+            error = FakeJudgeError("429 Too Many Requests: injected rate limit", status_code=429)
+        elif draw < self.rate_limit_rate + self.error_rate:
+            error = FakeJudgeError("500 Internal Server Error: injected judge failure")
+        else:
+            error = None
+
+        return max(0.0, delay) / 1000.0, error
+
+    def _scores(self, text: str, metrics: List[str]) -> Dict[str, float]:
+        # Only the question and answer are hashed, so a conversation gets the same scores
+        # whether it is evaluated alone or as part of a batch
+        match = _CONVERSATION.search(text)
+        if match:
+            text = f"{match.group(1)}\x1f{match.group(2)}"
+
+        scores = {}
+        for metric in metrics:
+            digest = hashlib.sha256(f"{self.seed}\x1f{metric}\x1f{text}".encode()).digest()
+            # Skewed towards good scores, like a real judge on mostly reasonable answers
+            scores[metric] = float(min(10, 3 + digest[0] % 6 + digest[1] % 3))
+        return scores
+
+    def _reply(self, prompt: str) -> ChatResult:
+        match = _METRICS.search(prompt)
+        try:
+            metrics = json.loads(match.group(1)) if match else []
+        except json.JSONDecodeError:
+            metrics = []
+
+        blocks = _CONVERSATION_ID.split(prompt)
+        if len(blocks) > 1:
+            # split() alternates text and captured ids: [prefix, id, block, id, block, ...]
+            data: Any = [
+                {"id": int(conversation_id), "scores": self._scores(block, metrics), "feedback": "Synthetic feedback."}
+                for conversation_id, block in zip(blocks[1::2], blocks[2::2])
+            ]
+        else:
+            data = {"scores": self._scores(prompt, metrics), "feedback": "Synthetic feedback."}
+
+        content = json.dumps(data)
+        if self._rng.random() < self.malformed_rate:
+            content = self._rng.choice((
+                content[:max(1, len(content) // 2)],
+                f"Here is my evaluation: {content}, hope this helps",
+                "I am unable to evaluate this response.",
+            ))
+
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(content)
+        message = AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+from data_models.evaluation import Conversation, EvaluationResult, EvaluationSettings, Question
+from utils.aggregation import ScoreAggregator
+from utils.context_index import ContextIndex, build_context_index
+from utils.evaluation import BotResponseGenerator, Evaluator, _aiter
+from utils.logs import setup_logger
+from utils.metrics import record_timing, report_timings, start_timings, timed
+from utils.scheduler import ProviderScheduler, is_rate_limit_error
+
+
+logger = setup_logger("evaluation")
+
+
+class GenerationPipeline:
+    """
+    Generate-then-evaluate runs: a candidate model answers uploaded questions and the judge
+    evaluates the answers, as a producer/consumer pipeline. Questions are answered in batches
+    of `generation_batch_size` with up to `concurrency` batches in flight, and every answered
+    row is handed to the evaluator right away, so the judge scores row N while the candidate
+    is still answering row N + k. The two sides have separate budgets: generation is bounded
+    by `concurrency` and the candidate provider's scheduler, judging by the evaluator's window
+    and the judge provider's scheduler. At most `queue_size` answered rows wait for the judge,
+    which keeps a fast candidate from running arbitrarily far ahead.
+    """
+
+    #   Generation batches in flight at once
+    concurrency = int(os.environ.get("GENERATION_CONCURRENCY", 4))
+
+    def __init__(self, generator: BotResponseGenerator, evaluator: Evaluator, scheduler: ProviderScheduler = None,
+                 priority: int = 0, queue_size: int = 256) -> None:
+        self.generator = generator
+        self.evaluator = evaluator
+        self.scheduler = scheduler
+        self.priority = priority
+        self.queue_size = queue_size
+
+    async def _generate(self, batch: List[Tuple[int, Question]], settings: EvaluationSettings,
+                        context: ContextIndex) -> List[Tuple[int, Conversation, Optional[str]]]:
+        """
+        Answers one batch of questions. The batch takes one scheduler slot per question, and
+        questions rejected with a rate limit error lower the provider's concurrency limit and
+        are retried one by one through the scheduler, which backs off; other failures are
+        returned as the error of the row. The time each row took to answer, the batch call it
+        was part of and its retry, is added to the `generation` timing stage.
+
+        :return: (row index, conversation, error) for every question of the batch.
+        :rtype: List[Tuple[int, Conversation, Optional[str]]]
+        """
+
+        questions = [question.user_question for _, question in batch]
+        started = time.perf_counter()
+
+        def call():
+            return self.generator.get_responses(questions, settings.context, context)
+
+        try:
+            if self.scheduler:
+                # Every question is sent with the system prompt, which carries the context
+                tokens = sum(self.generator.token_estimate(question, settings.context, context) for question in questions)
+                responses = await self.scheduler.run(
+                    call, tokens=tokens, priority=self.priority, requests=len(batch),
+                    throttled=lambda responses: any(
+                        isinstance(response, Exception) and is_rate_limit_error(response) for response in responses
+                    )
+                )
+            else:
+                responses = await call()
+        except Exception as e:
+            responses = [e] * len(batch)
+        batch_seconds = time.perf_counter() - started
+
+        generated = []
+        for (index, question), response in zip(batch, responses):
+            started = time.perf_counter()
+            if isinstance(response, Exception) and self.scheduler and is_rate_limit_error(response):
+                try:
+                    response = await self.scheduler.run(
+                        lambda: self.generator.get_response(question.user_question, settings.context, context),
+                        tokens=self.generator.token_estimate(question.user_question, settings.context, context),
+                        priority=self.priority
+                    )
+                except Exception as e:
+                    response = e
+            record_timing("generation", batch_seconds + time.perf_counter() - started)
+
+            if isinstance(response, Exception):
+                logger.error(f"Error generating a response for row {index}: {str(response)}")
+                generated.append((index, Conversation(user_question=question.user_question, bot_response=""), str(response)))
+            else:
+                conversation = Conversation(user_question=question.user_question, bot_response=str(response.content))
+                generated.append((index, conversation, None))
+
+        return generated
+
+    async def iter_results(self, questions: Union[Iterable[Question], AsyncIterable[Question]],
+                           settings: EvaluationSettings,
+                           failures: Dict[int, str] = None) -> AsyncIterator[Tuple[int, Conversation, EvaluationResult]]:
+        """
+        Answers and evaluates the questions, yielding (row index, conversation, result) tuples
+        in completion order. Rows the candidate failed to answer are not judged; they get a
+        result without scores and the error as feedback.
+
+        :param questions: The questions, as a list or an async stream.
+        :type questions: Union[Iterable[Question], AsyncIterable[Question]]
+        :param settings: The settings of the evaluation, including the generation batch size.
+        :type settings: EvaluationSettings
+        :param failures: Optional mapping filled with the generation error of every row the
+            candidate failed to answer.
+        :type failures: Dict[int, str], optional
+        :return: An async iterator over (row index, conversation, result) tuples.
+        :rtype: AsyncIterator[Tuple[int, Conversation, EvaluationResult]]
+        """
+
+        if not hasattr(questions, "__aiter__"):
+            questions = _aiter(questions)
+
+        context = await asyncio.to_thread(
+            build_context_index, settings.context, settings.context_token_budget, settings.context_top_k
+        )
+
+        answered: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        results: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(self.concurrency)
+        finished = object()
+        tasks = set()
+
+        # The evaluator numbers rows in the order it reads them; this maps them back to questions
+        order: List[int] = []
+
+        async def answer(batch: List[Tuple[int, Question]]) -> None:
+            try:
+                for index, conversation, error in await self._generate(batch, settings, context):
+                    if error is None:
+                        await answered.put((index, conversation))
+                    else:
+                        if failures is not None:
+                            failures[index] = error
+                        results.put_nowait((index, conversation, EvaluationResult(
+                            scores={}, feedback=f"Generation failed: {error}"
+                        )))
+            finally:
+                slots.release()
+
+        async def produce() -> None:
+            try:
+                batch, index = [], 0
+                async for question in questions:
+                    batch.append((index, question))
+                    index += 1
+                    if len(batch) == settings.generation_batch_size or index == 1:
+                        # The first question goes out alone so judging can start right away
+                        await slots.acquire()
+                        task = asyncio.create_task(answer(batch))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        batch = []
+
+                if batch:
+                    await slots.acquire()
+                    task = asyncio.create_task(answer(batch))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                while tasks:
+                    await asyncio.wait(list(tasks))
+            finally:
+                # Ends the judge's input, unless the whole pipeline is being cancelled
+                if not asyncio.current_task().cancelling():
+                    await answered.put(finished)
+
+        async def conversations() -> AsyncIterator[Conversation]:
+            while True:
+                item = await answered.get()
+                if item is finished:
+                    return
+                order.append(item[0])
+                yield item[1]
+
+        async def judge() -> None:
+            try:
+                async for index, conversation, result in self.evaluator.iter_results(conversations(), settings):
+                    results.put_nowait((order[index], conversation, result))
+                results.put_nowait(finished)
+            except Exception as e:
+                results.put_nowait(e)
+
+        producer = asyncio.create_task(produce())
+        consumer = asyncio.create_task(judge())
+
+        try:
+            while True:
+                item = await results.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+
+            # Errors reading the questions surface once the judge has drained what was read
+            await producer
+        finally:
+            for task in (producer, consumer, *tasks):
+                task.cancel()
+
+    async def evaluate_stream(self, questions: Union[Iterable[Question], AsyncIterable[Question]],
+                              settings: EvaluationSettings) -> Dict[str, Any]:
+        """
+        Answers and evaluates the questions, see `iter_results`, and returns the same structure
+        as `Evaluator.evaluate_stream` with a `generation` summary of the candidate model. With
+        the settings' `timings`, the breakdown has a `generation` stage, the time spent
+        answering summed over rows.
+
+        :param questions: The questions, as a list or an async stream.
+        :type questions: Union[Iterable[Question], AsyncIterable[Question]]
+        :param settings: The settings of the evaluation.
+        :type settings: EvaluationSettings
+        :return: The evaluation of the generated conversations.
+        :rtype: Dict[str, Any]
+        """
+
+        started = time.perf_counter()
+        timings = start_timings("generation") if settings.timings else None
+        aggregator = ScoreAggregator(settings.metrics)
+        failures: Dict[int, str] = {}
+        evaluated = [item async for item in self.iter_results(questions, settings, failures)]
+        evaluated.sort(key=lambda item: item[0])
+
+        formatted_conversations = []
+
+        for _, conversation, result in evaluated:
+            formatted_conversations.extend([
+                {"text": conversation.user_question, "sender": "user"},
+                {"text": conversation.bot_response, "sender": "bot", "evaluation": result.model_dump()},
+            ])
+            with timed("aggregate"):
+                aggregator.add(result)
+
+        with timed("aggregate"):
+            statistics = await asyncio.to_thread(aggregator.statistics)
+
+        evaluation = {
+            "average_scores": aggregator.average_scores(),
+            "statistics": statistics,
+            "generation": {"model": settings.candidate_model, "rows": len(evaluated), "failed_rows": len(failures)},
+            "conversations": formatted_conversations
+        }
+        if timings is not None:
+            evaluation["timings"] = {**report_timings(timings), "total": round((time.perf_counter() - started) * 1000, 3)}
+
+        return evaluation
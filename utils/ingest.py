@@ -0,0 +1,335 @@
+import codecs
+import json
+import re
+from collections import deque
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+from data_models.evaluation import Conversation, Question
+
+
+#   Upper bound for the value of a plain (non-file) form field, e.g. the context
+MAX_FIELD_SIZE = 16 * 1024 * 1024
+
+
+class IngestionError(ValueError):
+    """
+    Raised when an uploaded conversation file or form cannot be parsed or a row fails validation.
+    """
+
+
+class _JsonRowDecoder:
+    """
+    Incremental decoder for a JSON array of objects or for JSONL / concatenated JSON objects.
+    Text is fed in arbitrary chunks and every complete top-level row is returned as soon as its
+    closing brace has been seen; only the current partial row is kept in memory.
+
+    A row cut by a chunk boundary is kept as a list of chunks that are only scanned for the
+    brackets and quotes that end it, and joined and decoded once it is complete, so a long row
+    costs linear time. A decoding error anywhere but at the end of the data fails right away.
+    """
+
+    _WHITESPACE = " \t\r\n"
+
+    #   Characters a cut can leave undecidable at the end of the data, e.g. a \uXXXX escape
+    _LOOKAHEAD = 5
+
+    #   What ends or nests a value outside of strings, and what ends or escapes inside them
+    _STRUCTURE = re.compile(r'["{}\[\]]')
+    _IN_STRING = re.compile(r'[\\"]')
+
+    def __init__(self) -> None:
+        self.decoder = json.JSONDecoder()
+        self.pending: List[str] = []
+        self.mode = None  # "array" or "lines" once the first character has been seen
+        self.expect_value = True
+        self.closed = False
+        self.count = 0
+
+        # Scan state of the pending partial row
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+
+    def _truncated(self, error: json.JSONDecodeError, buffer: str) -> bool:
+        # A row cut short fails at the end of the data, or in a string running up to it; strings
+        # cannot hold raw newlines, so this never spans a complete JSONL line
+        return len(buffer) - error.pos <= self._LOOKAHEAD or error.msg.startswith("Unterminated string")
+
+    def _scan(self, text: str) -> bool:
+        """
+        Follows the nesting of the pending row through `text`.
+
+        :return: Whether the row may be complete and is worth decoding.
+        :rtype: bool
+        """
+
+        position = 1 if self.escaped else 0
+        self.escaped = False
+
+        while match := (self._IN_STRING if self.in_string else self._STRUCTURE).search(text, position):
+            position = match.end()
+            char = match.group()
+
+            if char == "\\":
+                # Skips the escaped character, which may be the first one of the next chunk
+                position += 1
+                self.escaped = position > len(text)
+            elif char == '"':
+                self.in_string = not self.in_string
+                self.started = True
+            elif char in "{[":
+                self.depth += 1
+                self.started = True
+            else:
+                self.depth -= 1
+
+            if self.started and self.depth <= 0 and not self.in_string:
+                return True
+
+        # A bare number or literal is only a few characters, just try again
+        return not self.started
+
+    def _wait(self, partial: str) -> None:
+        self.depth, self.in_string, self.escaped, self.started = 0, False, False, False
+        self.pending = [partial]
+        self._scan(partial)
+
+    def feed(self, text: str, final: bool = False) -> list:
+        if self.pending:
+            self.pending.append(text)
+            if not self._scan(text) and not final:
+                return []
+            text = "".join(self.pending)
+            self.pending = []
+
+        buffer, position = text, 0
+        rows = []
+
+        while True:
+            while position < len(buffer) and buffer[position] in self._WHITESPACE:
+                position += 1
+            if position >= len(buffer):
+                break
+
+            char = buffer[position]
+
+            if self.closed:
+                raise IngestionError("Unexpected data after the end of the JSON array")
+
+            if self.mode is None:
+                if char == "[":
+                    self.mode = "array"
+                    position += 1
+                    continue
+                self.mode = "lines"
+
+            if self.mode == "array":
+                if char == "]" and (not self.expect_value or self.count == 0):
+                    self.closed = True
+                    position += 1
+                    continue
+                if not self.expect_value:
+                    if char != ",":
+                        raise IngestionError(f"Expected ',' or ']' in the JSON array, got {char!r}")
+                    self.expect_value = True
+                    position += 1
+                    continue
+
+            try:
+                row, end = self.decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                # The row is cut in half by the chunk boundary, wait for the rest of it
+                if not final and self._truncated(e, buffer):
+                    self._wait(buffer[position:])
+                    break
+                raise IngestionError(f"Invalid JSON: {e.msg}")
+
+            rows.append(row)
+            self.count += 1
+            position = end
+            self.expect_value = self.mode != "array"
+
+        if final and self.mode == "array" and not self.closed:
+            raise IngestionError("Unterminated JSON array")
+
+        return rows
+
+
+async def iter_json_rows(chunks: AsyncIterable[bytes]) -> AsyncIterator[Any]:
+    """
+    Parses a stream of UTF-8 bytes holding either a JSON array or JSONL and yields the rows one
+    at a time as they become complete.
+
+    :param chunks: The raw bytes of the file, in arbitrary chunk sizes.
+    :type chunks: AsyncIterable[bytes]
+    :return: An async iterator over the decoded rows.
+    :rtype: AsyncIterator[Any]
+    """
+
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    row_decoder = _JsonRowDecoder()
+
+    try:
+        async for chunk in chunks:
+            for row in row_decoder.feed(text_decoder.decode(chunk)):
+                yield row
+
+        for row in row_decoder.feed(text_decoder.decode(b"", final=True), final=True):
+            yield row
+
+    except UnicodeDecodeError as e:
+        raise IngestionError(f"Conversation file is not valid UTF-8: {str(e)}")
+
+
+async def iter_conversations(chunks: AsyncIterable[bytes]) -> AsyncIterator[Conversation]:
+    """
+    Streams `Conversation`s out of an uploaded JSON or JSONL file, validating every row as it
+    arrives.
+
+    :param chunks: The raw bytes of the conversation file.
+    :type chunks: AsyncIterable[bytes]
+    :return: An async iterator over the validated conversations.
+    :rtype: AsyncIterator[Conversation]
+    """
+
+    index = 0
+    async for row in iter_json_rows(chunks):
+        try:
+            yield Conversation.model_validate(row)
+        except ValidationError as e:
+            raise IngestionError(f"Invalid conversation at row {index}: {e.errors()[0]['msg']}")
+        index += 1
+
+
+async def iter_questions(chunks: AsyncIterable[bytes]) -> AsyncIterator[Question]:
+    """
+    Streams `Question`s out of an uploaded JSON or JSONL file, see `iter_conversations`.
+
+    :param chunks: The raw bytes of the question file.
+    :type chunks: AsyncIterable[bytes]
+    :return: An async iterator over the validated questions.
+    :rtype: AsyncIterator[Question]
+    """
+
+    index = 0
+    async for row in iter_json_rows(chunks):
+        try:
+            yield Question.model_validate(row)
+        except ValidationError as e:
+            raise IngestionError(f"Invalid question at row {index}: {e.errors()[0]['msg']}")
+        index += 1
+
+
+class StreamingForm:
+    """
+    Incremental multipart/form-data reader. Plain fields are collected into `fields` until the
+    first file part starts; the file is then exposed as an async iterator over its bytes, read
+    straight from the request body without spooling it to disk. Fields must therefore be sent
+    before the file, which is the order the UI and `curl -F` use.
+    """
+
+    def __init__(self, request: Request) -> None:
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise IngestionError("Expected a multipart/form-data request")
+
+        self.stream = request.stream()
+        self.events: deque = deque()
+        self.fields: Dict[str, str] = {}
+        self.file_field: Optional[str] = None
+
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._finished = False
+        self._parser = MultipartParser(options[b"boundary"], callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": lambda data, start, end: self.events.append(("data", data[start:end])),
+            "on_part_end": lambda: self.events.append(("end", None)),
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": lambda: self.events.append(("part", self._disposition)),
+        })
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    async def _next_event(self) -> Optional[Tuple[str, Any]]:
+        while not self.events:
+            if self._finished:
+                return None
+
+            chunk = await anext(self.stream, b"")
+            if chunk:
+                self._parser.write(chunk)
+            else:
+                self._parser.finalize()
+                self._finished = True
+
+        return self.events.popleft()
+
+    async def read_fields(self) -> Dict[str, str]:
+        """
+        Reads the plain form fields up to the start of the first file part (or the end of the
+        body if there is no file).
+
+        :return: The form fields read so far.
+        :rtype: Dict[str, str]
+        """
+
+        name, value = None, bytearray()
+
+        while (event := await self._next_event()) is not None:
+            kind, payload = event
+
+            if kind == "part":
+                _, options = parse_options_header(payload)
+                if b"filename" in options:
+                    self.file_field = options.get(b"name", b"").decode("utf-8")
+                    break
+                name, value = options.get(b"name", b"").decode("utf-8"), bytearray()
+
+            elif kind == "data":
+                value.extend(payload)
+                if len(value) > MAX_FIELD_SIZE:
+                    raise IngestionError(f"Form field {name!r} is too large")
+
+            elif kind == "end" and name is not None:
+                self.fields[name] = value.decode("utf-8", errors="replace")
+                name = None
+
+        return self.fields
+
+    async def iter_file(self) -> AsyncIterator[bytes]:
+        """
+        Yields the bytes of the file part found by `read_fields`, as they arrive.
+
+        :return: An async iterator over the file content.
+        :rtype: AsyncIterator[bytes]
+        """
+
+        if self.file_field is None:
+            return
+
+        while (event := await self._next_event()) is not None:
+            kind, payload = event
+            if kind == "end":
+                return
+            if kind == "data":
+                yield payload
@@ -0,0 +1,563 @@
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from data_models.evaluation import Conversation, EvaluationResult, EvaluationSettings
+from utils.benchmarks import BenchmarkStore, get_benchmark_store
+from utils.evaluation import Evaluator
+from utils.logs import setup_logger
+
+
+logger = setup_logger("evaluation")
+
+#   Job states; "queued" and "running" jobs are picked up again after a restart, "uploading"
+#   jobs are not claimable until all their rows are stored and fail if their upload stalls
+UPLOADING, QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = (
+    "uploading", "queued", "running", "completed", "failed", "cancelled"
+)
+
+_job_manager: Optional["JobManager"] = None
+
+
+class JobStore:
+    """
+    SQLite storage for background evaluation jobs. Every job keeps its settings and its rows;
+    a row's result is written as soon as it is evaluated, which is the checkpoint a restarted
+    server resumes from.
+
+    Several worker processes can share one store: a job is run by the process that claims it,
+    and the claim is a lease renewed by heartbeats, so the job of a process that died is taken
+    over by another one once the lease runs out.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                settings TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                completed INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                owner TEXT,
+                heartbeat_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_rows (
+                job_id TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                user_question TEXT NOT NULL,
+                bot_response TEXT NOT NULL,
+                result TEXT,
+                PRIMARY KEY (job_id, row_index)
+            );
+        """)
+
+        # Stores created before jobs were claimed lack the lease columns
+        columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._connection.commit()
+
+    def _execute(self, query: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+            self._connection.commit()
+            return rows
+
+    def create(self, settings: EvaluationSettings, priority: int) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, priority, settings, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, UPLOADING, priority, settings.model_dump_json(), now, now)
+        )
+        return job_id
+
+    def add_rows(self, job_id: str, start: int, conversations: List[Conversation]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO job_rows (job_id, row_index, user_question, bot_response) VALUES (?, ?, ?, ?)",
+                [
+                    (job_id, start + offset, conversation.user_question, conversation.bot_response)
+                    for offset, conversation in enumerate(conversations)
+                ]
+            )
+            self._connection.execute(
+                "UPDATE jobs SET total = total + ?, updated_at = ? WHERE id = ?",
+                (len(conversations), time.time(), job_id)
+            )
+            self._connection.commit()
+
+    def save_results(self, job_id: str, results: List[Tuple[int, EvaluationResult]]) -> None:
+        with self._lock:
+            # Rows retried after a failed result are already counted as completed
+            completed = 0
+            for index, result in results:
+                payload = result.model_dump_json()
+                saved = self._connection.execute(
+                    "UPDATE job_rows SET result = ? WHERE job_id = ? AND row_index = ? AND result IS NULL",
+                    (payload, job_id, index)
+                ).rowcount
+                if not saved:
+                    self._connection.execute(
+                        "UPDATE job_rows SET result = ? WHERE job_id = ? AND row_index = ?", (payload, job_id, index)
+                    )
+                completed += saved
+
+            self._connection.execute(
+                "UPDATE jobs SET completed = completed + ?, updated_at = ? WHERE id = ?",
+                (completed, time.time(), job_id)
+            )
+            self._connection.commit()
+
+    def set_status(self, job_id: str, status: str, current: Tuple[str, ...], error: str = None) -> bool:
+        """
+        Sets the status of a job that is in one of the `current` states.
+
+        :return: False if the job does not exist or is in another state, e.g. because it finished meanwhile.
+        :rtype: bool
+        """
+
+        placeholders = ", ".join("?" * len(current))
+        with self._lock:
+            updated = self._connection.execute(
+                f"UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status IN ({placeholders})",
+                (status, error, time.time(), job_id, *current)
+            ).rowcount
+            self._connection.commit()
+        return bool(updated)
+
+    def touch(self, job_id: str) -> None:
+        # Keeps an upload that is still being received from being failed by `fail_stale_uploads`
+        self._execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, UPLOADING))
+
+    def fail_stale_uploads(self, lease_seconds: float) -> int:
+        """
+        Fails the jobs whose upload has not progressed within `lease_seconds`, left behind by a
+        process that died while receiving them.
+
+        :return: The number of jobs failed.
+        :rtype: int
+        """
+
+        now = time.time()
+        with self._lock:
+            failed = self._connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (FAILED, "Upload interrupted", now, UPLOADING, now - lease_seconds)
+            ).rowcount
+            self._connection.commit()
+        return failed
+
+    def finish(self, job_id: str, owner: str, status: str, error: str = None) -> bool:
+        """
+        Sets the final status of a job `owner` is running.
+
+        :return: False if the job was cancelled or taken over by another worker meanwhile.
+        :rtype: bool
+        """
+
+        with self._lock:
+            finished = self._connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                (status, error, time.time(), job_id, owner, RUNNING)
+            ).rowcount
+            self._connection.commit()
+        return bool(finished)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+
+        job = dict(rows[0])
+        job["settings"] = json.loads(job["settings"])
+        return job
+
+    def claimable(self, lease_seconds: float) -> List[Dict[str, Any]]:
+        """
+        Lists the jobs a worker may claim: queued jobs, and running jobs whose owner has not
+        sent a heartbeat within `lease_seconds`.
+        """
+
+        rows = self._execute(
+            "SELECT id, priority, created_at FROM jobs WHERE status = ? "
+            "OR (status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)) ORDER BY created_at",
+            (QUEUED, RUNNING, time.time() - lease_seconds)
+        )
+        return [dict(row) for row in rows]
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """
+        Marks a claimable job (see `claimable`) as running for `owner`.
+
+        :return: False if the job is not claimable, e.g. because another worker claimed it first.
+        :rtype: bool
+        """
+
+        now = time.time()
+        with self._lock:
+            claimed = self._connection.execute(
+                "UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, updated_at = ? WHERE id = ? "
+                "AND (status = ? OR (status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)))",
+                (RUNNING, owner, now, now, job_id, QUEUED, RUNNING, now - lease_seconds)
+            ).rowcount
+            self._connection.commit()
+        return bool(claimed)
+
+    def heartbeat(self, job_id: str, owner: str) -> bool:
+        """
+        Renews the lease of a running job.
+
+        :return: False if `owner` no longer runs the job, e.g. because it was cancelled.
+        :rtype: bool
+        """
+
+        with self._lock:
+            renewed = self._connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time(), job_id, owner, RUNNING)
+            ).rowcount
+            self._connection.commit()
+        return bool(renewed)
+
+    def release(self, job_id: str, owner: str) -> None:
+        # Puts a job back in the queue when its worker stops, so another one resumes it right away
+        self._execute(
+            "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE id = ? AND owner = ? AND status = ?",
+            (QUEUED, time.time(), job_id, owner, RUNNING)
+        )
+
+    def pending_rows(self, job_id: str, after: int, limit: int) -> List[Tuple[int, Conversation]]:
+        # Rows whose judge call failed were saved without scores and are evaluated again
+        rows = self._execute(
+            "SELECT row_index, user_question, bot_response FROM job_rows "
+            "WHERE job_id = ? AND row_index > ? AND (result IS NULL OR json_extract(result, '$.scores') = '{}') "
+            "ORDER BY row_index LIMIT ?",
+            (job_id, after, limit)
+        )
+        return [
+            (row["row_index"], Conversation(user_question=row["user_question"], bot_response=row["bot_response"]))
+            for row in rows
+        ]
+
+    def completed_rows(self, job_id: str, after: int, limit: int) -> List[Tuple[int, Conversation, EvaluationResult]]:
+        rows = self._execute(
+            "SELECT row_index, user_question, bot_response, result FROM job_rows "
+            "WHERE job_id = ? AND row_index > ? AND result IS NOT NULL ORDER BY row_index LIMIT ?",
+            (job_id, after, limit)
+        )
+        return [
+            (
+                row["row_index"],
+                Conversation(user_question=row["user_question"], bot_response=row["bot_response"]),
+                EvaluationResult.model_validate_json(row["result"])
+            )
+            for row in rows
+        ]
+
+    def average_scores(self, job_id: str, metrics: List[str]) -> Dict[str, float]:
+        """
+        Averages the checkpointed scores of a job inside SQLite, per metric over the rows that
+        have a score for it.
+        """
+
+        rows = self._execute(
+            "SELECT scores.key AS metric, AVG(scores.value) AS mean FROM job_rows, "
+            "json_each(json_extract(job_rows.result, '$.scores')) AS scores "
+            "WHERE job_rows.job_id = ? AND job_rows.result IS NOT NULL GROUP BY scores.key",
+            (job_id,)
+        )
+
+        return {row["metric"]: row["mean"] for row in rows if row["metric"] in metrics}
+
+
+class JobManager:
+    """
+    Runs evaluation jobs on a pool of background workers. Jobs are taken lowest priority value
+    first; their judge calls are scheduled behind interactive requests. Results are checkpointed
+    to the `JobStore` in small batches, so a restarted server only evaluates the rows that were
+    not finished yet.
+
+    When several server processes share the store, every manager polls it for claimable jobs
+    and only runs the jobs it claimed, renewing the claim every `lease_seconds / 3` seconds. A
+    job cancelled through another process is stopped at its next heartbeat.
+    """
+
+    _CHECKPOINT_ROWS = 50
+    _CHECKPOINT_SECONDS = 1.0
+    _INGEST_ROWS = 1000
+    _POLL_SECONDS = 5.0
+
+    #   A running job whose owner missed its heartbeats for this long is taken over
+    lease_seconds = float(os.environ.get("EVALUATION_JOB_LEASE_SECONDS", 30))
+
+    def __init__(self, store: JobStore, evaluator_factory: Callable[[EvaluationSettings, int], Evaluator],
+                 workers: int = 2, benchmarks: BenchmarkStore = None) -> None:
+        self.store = store
+        self.evaluator_factory = evaluator_factory
+        self.workers = workers
+        self.benchmarks = benchmarks
+
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.queued = set()
+        self.running: Dict[str, asyncio.Task] = {}
+        self._sequence = itertools.count()
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """
+        Starts the workers and the polling of the store, which also picks up the jobs left
+        unfinished by a previous process.
+        """
+
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._workers.append(asyncio.create_task(self._poll()))
+
+    async def stop(self) -> None:
+        """
+        Stops the workers. Running jobs are put back in the queue and resume on the next start
+        or in another process.
+        """
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _enqueue(self, job_id: str, priority: int) -> None:
+        if job_id in self.queued or job_id in self.running:
+            return
+        self.queued.add(job_id)
+        self.queue.put_nowait((priority, next(self._sequence), job_id))
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                if failed := await asyncio.to_thread(self.store.fail_stale_uploads, self.lease_seconds):
+                    logger.info(f"Failed {failed} evaluation job(s) whose upload was interrupted")
+                for job in await asyncio.to_thread(self.store.claimable, self.lease_seconds):
+                    self._enqueue(job["id"], job["priority"])
+            except Exception as e:
+                logger.error(f"Error polling evaluation jobs: {str(e)}")
+            await asyncio.sleep(self._POLL_SECONDS)
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.store.heartbeat, job_id, self.owner):
+                logger.info(f"Evaluation job {job_id} is no longer ours, stopping it")
+                task.cancel()
+                return
+
+    async def _keep_uploading(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(self.store.touch, job_id)
+
+    async def submit(self, settings: EvaluationSettings, conversations: AsyncIterable[Conversation],
+                     priority: int = 0) -> str:
+        """
+        Stores a new job and queues it. Conversations are written to the store in chunks as
+        they are read, so the upload is never held in memory as a whole.
+
+        :param settings: The settings of the evaluation.
+        :type settings: EvaluationSettings
+        :param conversations: The conversations to evaluate.
+        :type conversations: AsyncIterable[Conversation]
+        :param priority: Job priority, lower values run first.
+        :type priority: int
+        :return: The id of the new job.
+        :rtype: str
+        """
+
+        job_id = await asyncio.to_thread(self.store.create, settings, priority)
+        chunk, start = [], 0
+        keepalive = asyncio.create_task(self._keep_uploading(job_id))
+
+        try:
+            async for conversation in conversations:
+                chunk.append(conversation)
+                if len(chunk) == self._INGEST_ROWS:
+                    await asyncio.to_thread(self.store.add_rows, job_id, start, chunk)
+                    chunk, start = [], start + len(chunk)
+
+            if chunk:
+                await asyncio.to_thread(self.store.add_rows, job_id, start, chunk)
+
+        except BaseException as e:
+            await asyncio.to_thread(self.store.set_status, job_id, FAILED, (UPLOADING,), f"Upload failed: {str(e)}")
+            raise
+
+        finally:
+            keepalive.cancel()
+
+        if not await asyncio.to_thread(self.store.set_status, job_id, QUEUED, (UPLOADING,)):
+            raise RuntimeError(f"Evaluation job {job_id} was failed before its upload completed")
+        self._enqueue(job_id, priority)
+        return job_id
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a queued or running job. Rows already evaluated stay checkpointed.
+
+        :param job_id: The id of the job.
+        :type job_id: str
+        :return: False if the job does not exist or has already finished.
+        :rtype: bool
+        """
+
+        # Conditional, so a job that finishes meanwhile keeps its final status
+        if not await asyncio.to_thread(self.store.set_status, job_id, CANCELLED, (QUEUED, RUNNING)):
+            return False
+
+        if job_id in self.running:
+            self.running[job_id].cancel()
+
+        return True
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the state, progress and partial average scores of a job.
+
+        :param job_id: The id of the job.
+        :type job_id: str
+        :return: The job description, or None if the job does not exist.
+        :rtype: Optional[Dict[str, Any]]
+        """
+
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if not job:
+            return None
+
+        settings = job.pop("settings")
+        job["model"] = settings["model"]
+        job["metrics"] = settings["metrics"]
+        job["progress"] = job["completed"] / job["total"] if job["total"] else 0.0
+        job["average_scores"] = await asyncio.to_thread(self.store.average_scores, job_id, settings["metrics"])
+
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            _, _, job_id = await self.queue.get()
+            self.queued.discard(job_id)
+
+            # Another process may have claimed the job since it was queued here
+            if not await asyncio.to_thread(self.store.claim, job_id, self.owner, self.lease_seconds):
+                continue
+            job = await asyncio.to_thread(self.store.get, job_id)
+
+            task = asyncio.create_task(self._run(job))
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, task))
+            self.running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # Cancelling a job only cancels its task, re-raise when the worker itself is stopped
+                if asyncio.current_task().cancelling():
+                    await asyncio.shield(asyncio.to_thread(self.store.release, job_id, self.owner))
+                    raise
+            finally:
+                heartbeat.cancel()
+                self.running.pop(job_id, None)
+
+    async def _completed_rows(self, job_id: str) -> AsyncIterator[Tuple[int, Conversation, EvaluationResult]]:
+        after = -1
+        while rows := await asyncio.to_thread(self.store.completed_rows, job_id, after, self._INGEST_ROWS):
+            for row in rows:
+                yield row
+            after = rows[-1][0]
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        settings = EvaluationSettings(**job["settings"])
+        evaluator = self.evaluator_factory(settings, job["priority"])
+        index_map: Dict[int, int] = {}
+        positions = itertools.count()
+
+        logger.info(f"Running evaluation job {job_id}")
+
+        async def pending() -> AsyncIterator[Conversation]:
+            # Rows are renumbered by the evaluator, map them back to their stored index
+            after = -1
+            while rows := await asyncio.to_thread(self.store.pending_rows, job_id, after, self._INGEST_ROWS):
+                for row_index, conversation in rows:
+                    index_map[next(positions)] = row_index
+                    yield conversation
+                after = rows[-1][0]
+
+        checkpoint: List[Tuple[int, EvaluationResult]] = []
+        last_checkpoint = time.monotonic()
+
+        try:
+            async for index, _, result in evaluator.iter_results(pending(), settings):
+                checkpoint.append((index_map.pop(index), result))
+
+                if len(checkpoint) >= self._CHECKPOINT_ROWS or time.monotonic() - last_checkpoint >= self._CHECKPOINT_SECONDS:
+                    await asyncio.to_thread(self.store.save_results, job_id, checkpoint)
+                    checkpoint, last_checkpoint = [], time.monotonic()
+
+            await asyncio.to_thread(self.store.save_results, job_id, checkpoint)
+            if not await asyncio.to_thread(self.store.finish, job_id, self.owner, COMPLETED):
+                logger.info(f"Evaluation job {job_id} was cancelled or taken over before it completed")
+                return
+            logger.info(f"Evaluation job {job_id} completed")
+
+            # A job may have been evaluated across several processes, so its benchmark run is
+            # recorded from the checkpoints once every row is done
+            if self.benchmarks:
+                async for _ in self.benchmarks.record(self._completed_rows(job_id), settings):
+                    pass
+
+        except asyncio.CancelledError:
+            await asyncio.shield(asyncio.to_thread(self.store.save_results, job_id, checkpoint))
+            raise
+
+        except Exception as e:
+            await asyncio.to_thread(self.store.save_results, job_id, checkpoint)
+            await asyncio.to_thread(self.store.finish, job_id, self.owner, FAILED, str(e))
+            logger.error(f"Evaluation job {job_id} failed: {str(e)}")
+
+
+def get_job_manager(evaluator_factory: Callable[[EvaluationSettings, int], Evaluator] = None) -> JobManager:
+    """
+    Returns the process-wide job manager, creating it on first use with the store at
+    EVALUATION_JOBS_PATH and EVALUATION_JOB_WORKERS workers. Completed jobs are recorded in the
+    benchmark store.
+
+    :param evaluator_factory: Builds the evaluator of a job from its settings and priority.
+        Required on the first call.
+    :type evaluator_factory: Callable[[EvaluationSettings, int], Evaluator]
+    :return: The shared job manager.
+    :rtype: JobManager
+    """
+
+    global _job_manager
+
+    if _job_manager is None:
+        _job_manager = JobManager(
+            JobStore(os.environ.get("EVALUATION_JOBS_PATH", "storage/jobs.sqlite3")),
+            evaluator_factory=evaluator_factory,
+            workers=int(os.environ.get("EVALUATION_JOB_WORKERS", 2)),
+            benchmarks=get_benchmark_store(),
+        )
+
+    return _job_manager
@@ -0,0 +1,323 @@
+import json
+import re
+import threading
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+from data_models.evaluation import EvaluationResult
+
+
+#   Lowest and highest score a judge may give
+SCORE_RANGE = (0.0, 10.0)
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+_OUT_OF = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*(?:/|out of)\s*(\d+(?:\.\d+)?)")
+_KEY = re.compile(r"[^a-z0-9]+")
+_CLOSERS = {"{": "}", "[": "]"}
+#   A number or literal running up to the end of a truncated reply
+_BARE_TAIL = re.compile(r"[-+.\w]$")
+
+_decoder = json.JSONDecoder()
+
+_stats: Optional["JudgeStats"] = None
+
+
+class JudgeOutputError(ValueError):
+    """
+    Raised when a judge reply cannot be turned into valid scores. The message says what is
+    wrong and is sent back to the judge when the reply is repaired.
+    """
+
+
+def _complete_partial(text: str) -> Any:
+    """
+    Decodes JSON cut off mid-way, e.g. by the output token limit: an open string is closed and
+    the open objects and arrays are closed. A number or literal cut at the end is dropped rather
+    than kept, since "1" may have been the start of "10"; if the open member cannot be completed,
+    the text is cut back to one of the last few complete members instead of guessing its value,
+    and the missing scores send the reply to the repair loop.
+
+    >>> _complete_partial('{"feedback": "ok", "scores": {"accuracy": 8, "relevancy": 1')
+    {'feedback': 'ok', 'scores': {'accuracy': 8}}
+    >>> _complete_partial('{"scores": {"accuracy": 8}, "feedback": "Clear and cor')
+    {'scores': {'accuracy': 8}, 'feedback': 'Clear and cor'}
+    """
+
+    stack, in_string, escaped, cuts = [], False, False, []
+
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(_CLOSERS[char])
+        elif char in "}]" and stack:
+            stack.pop()
+        elif char == ",":
+            cuts.append((position, "".join(reversed(stack))))
+
+    candidates = []
+    if not _BARE_TAIL.search(text) or in_string:
+        candidates.append(text + ('"' if in_string else "") + "".join(reversed(stack)))
+    candidates += [text[:position] + closers for position, closers in reversed(cuts[-5:])]
+
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    raise JudgeOutputError("the reply contains incomplete JSON")
+
+
+def _top_level_spans(text: str) -> Iterator[Tuple[int, Optional[int]]]:
+    # (start, end) of every bracketed value outside other values, in one pass; the end of a
+    # value still open when the text ends is None
+    depth, start, in_string, escaped = 0, 0, False, False
+
+    for position, char in enumerate(text):
+        if depth == 0:
+            if char in _CLOSERS:
+                depth, start = 1, position
+        elif in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                yield start, position + 1
+
+    if depth:
+        yield start, None
+
+
+def extract_json(text: str) -> Any:
+    """
+    Extracts the JSON value of a judge reply. Tries the whole reply, then fenced code blocks,
+    then the first object or array embedded in prose, and finally completes a truncated
+    object or array. The reply is scanned once for its bracketed values, so long replies with
+    many stray braces stay cheap.
+
+    :param text: The judge reply.
+    :type text: str
+    :return: The decoded JSON value.
+    :rtype: Any
+    :raises JudgeOutputError: If the reply contains no usable JSON.
+    """
+
+    text = text.strip()
+    candidates = [text] + [block.strip() for block in _FENCE.findall(text)]
+
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+
+    for start, end in _top_level_spans(text):
+        if end is None:
+            return _complete_partial(text[start:])
+        try:
+            return json.loads(text[start:end])
+        except json.JSONDecodeError:
+            continue
+
+    raise JudgeOutputError("the reply does not contain a JSON object")
+
+
+def _score(value: Any) -> float:
+    # Accepts 8, "8", "8/10", "8.5 out of 10" and {"score": 8}
+    if isinstance(value, dict):
+        value = next((value[key] for key in ("score", "value", "rating") if key in value), None)
+    if isinstance(value, bool) or value is None:
+        raise ValueError
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = str(value)
+    out_of = _OUT_OF.match(text)
+    if out_of:
+        return float(out_of.group(1)) * 10 / float(out_of.group(2))
+
+    number = _NUMBER.search(text)
+    if number is None:
+        raise ValueError
+    return float(number.group())
+
+
+def validate_scores(scores: Any, metrics: Sequence[str]) -> Dict[str, float]:
+    """
+    Checks the scores of a judge reply against the requested metrics. Metric names are matched
+    regardless of case, spaces and punctuation, numeric strings are converted, and scores of
+    metrics that were not requested are dropped.
+
+    :param scores: The `scores` value of the reply.
+    :type scores: Any
+    :param metrics: The requested metrics.
+    :type metrics: Sequence[str]
+    :return: A valid score for every requested metric.
+    :rtype: Dict[str, float]
+    :raises JudgeOutputError: If a metric is missing, not a number or outside `SCORE_RANGE`.
+    """
+
+    if not isinstance(scores, dict):
+        raise JudgeOutputError('"scores" must be an object mapping every metric to its score')
+
+    names = {_KEY.sub("_", metric.lower()).strip("_"): metric for metric in metrics}
+    valid, invalid, problems = {}, set(), []
+
+    for key, value in scores.items():
+        metric = names.get(_KEY.sub("_", str(key).lower()).strip("_"))
+        if metric is None:
+            continue
+        try:
+            score = _score(value)
+        except (ValueError, TypeError, ZeroDivisionError):
+            invalid.add(metric)
+            problems.append(f"the score of {metric} is not a number")
+            continue
+        if not SCORE_RANGE[0] <= score <= SCORE_RANGE[1]:
+            invalid.add(metric)
+            problems.append(f"the score of {metric} is outside {SCORE_RANGE[0]:g}-{SCORE_RANGE[1]:g}")
+            continue
+        valid[metric] = score
+
+    missing = [metric for metric in metrics if metric not in valid and metric not in invalid]
+    if missing:
+        problems.append(f"scores are missing for {', '.join(missing)}")
+    if problems:
+        raise JudgeOutputError("; ".join(problems))
+
+    return valid
+
+
+def parse_evaluation(text: str, metrics: Sequence[str]) -> EvaluationResult:
+    """
+    Parses a single-conversation judge reply.
+
+    :param text: The judge reply.
+    :type text: str
+    :param metrics: The requested metrics.
+    :type metrics: Sequence[str]
+    :return: The validated evaluation result.
+    :rtype: EvaluationResult
+    :raises JudgeOutputError: If the reply has no valid score for every metric.
+    """
+
+    data = extract_json(text)
+
+    # Some models answer with a one-element array or wrap the object, e.g. {"evaluation": {...}}
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if isinstance(data, dict) and "scores" not in data:
+        data = next((value for value in data.values() if isinstance(value, dict) and "scores" in value), data)
+    if not isinstance(data, dict) or "scores" not in data:
+        raise JudgeOutputError('the reply must be a JSON object with "scores" and "feedback"')
+
+    return EvaluationResult(
+        scores=validate_scores(data["scores"], metrics),
+        feedback=str(data.get("feedback") or "No feedback provided.")
+    )
+
+
+def parse_batch_evaluation(text: str, ids: Sequence[int], metrics: Sequence[str]) -> Dict[int, EvaluationResult]:
+    """
+    Parses a batched judge reply. Entries with an unknown id or invalid scores are dropped,
+    so the caller can evaluate those conversations again on their own.
+
+    :param text: The judge reply.
+    :type text: str
+    :param ids: The conversation ids that were sent in the batch.
+    :type ids: Sequence[int]
+    :param metrics: The requested metrics.
+    :type metrics: Sequence[str]
+    :return: The valid results keyed by conversation id.
+    :rtype: Dict[int, EvaluationResult]
+    :raises JudgeOutputError: If the reply contains no JSON at all.
+    """
+
+    data = extract_json(text)
+
+    # Some models wrap the array in an object, e.g. {"results": [...]}
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [data])
+
+    results = {}
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            entry_id = int(item["id"])
+            scores = validate_scores(item.get("scores"), metrics)
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if entry_id in ids and entry_id not in results:
+            results[entry_id] = EvaluationResult(scores=scores, feedback=str(item.get("feedback") or "No feedback provided."))
+
+    return results
+
+
+class JudgeStats:
+    """
+    Per judge model counters of how its replies fared: judge calls, rows, replies that could
+    not be parsed, repair calls and how many of them worked, provider errors and rows left
+    without scores. Shared by all evaluators of the process.
+    """
+
+    FIELDS = ("calls", "rows", "parse_failures", "repairs", "repaired", "errors", "failed_rows")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def add(self, model: str, **counts: int) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(model, dict.fromkeys(self.FIELDS, 0))
+            for name, count in counts.items():
+                counters[name] += count
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the counters of every judge model with its parse failure rate (per call) and
+        row failure rate (per row).
+
+        :return: The counters keyed by model.
+        :rtype: Dict[str, Dict[str, float]]
+        """
+
+        with self._lock:
+            counters = {model: dict(values) for model, values in self._counters.items()}
+
+        for values in counters.values():
+            values["parse_failure_rate"] = values["parse_failures"] / values["calls"] if values["calls"] else 0.0
+            values["failure_rate"] = values["failed_rows"] / values["rows"] if values["rows"] else 0.0
+        return counters
+
+
+def get_judge_stats() -> JudgeStats:
+    """
+    Returns the process-wide judge reply statistics.
+
+    :return: The shared judge statistics.
+    :rtype: JudgeStats
+    """
+
+    global _stats
+
+    if _stats is None:
+        _stats = JudgeStats()
+
+    return _stats
@@ -0,0 +1,234 @@
+import asyncio
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+from data_models.evaluation import Conversation, EvaluationSettings
+from utils.aggregation import ScoreAggregator, judge_agreement
+from utils.dedup import Deduplicator
+from utils.evaluation import Evaluator
+from utils.logs import setup_logger
+from utils.metrics import report_timings, start_timings, timed
+
+
+logger = setup_logger("evaluation")
+
+
+def judge_settings(settings: EvaluationSettings, judge: str) -> EvaluationSettings:
+    """
+    Returns the settings of a multi-judge evaluation as seen by one of its judges.
+
+    :param settings: The settings of the whole evaluation.
+    :type settings: EvaluationSettings
+    :param judge: The judge model.
+    :type judge: str
+    :return: The same settings with `judge` as the only model.
+    :rtype: EvaluationSettings
+    """
+
+    return settings.model_copy(update={"model": judge, "models": []})
+
+
+class SharedRows:
+    """
+    Reads a conversation stream once and lets several consumers iterate over it, each at its own
+    pace, so a slow judge never holds back a fast one. Rows are kept for the lifetime of the
+    object since every consumer needs all of them.
+    """
+
+    def __init__(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]) -> None:
+        self.source = conversations if hasattr(conversations, "__aiter__") else None
+        self.rows: List[Conversation] = [] if self.source else list(conversations)
+        self.done = self.source is None
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        # Waiters hold the previous event, which is set; later waiters get a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def fill(self) -> None:
+        """
+        Pulls the whole source stream into `rows`, waking up the consumers as rows arrive.
+        """
+
+        try:
+            async for conversation in self.source:
+                self.rows.append(conversation)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def iterate(self) -> AsyncIterator[Conversation]:
+        """
+        Yields every row, waiting for new ones until the source is exhausted. Errors raised
+        while reading the source are raised to every consumer.
+
+        :return: An async iterator over the conversations.
+        :rtype: AsyncIterator[Conversation]
+        """
+
+        position = 0
+        while True:
+            while position < len(self.rows):
+                yield self.rows[position]
+                position += 1
+
+            if self.done:
+                if self.error:
+                    raise self.error
+                return
+
+            await self._changed.wait()
+
+
+class JudgePanel:
+    """
+    Evaluates the same conversations with several judge models concurrently. The upload is
+    parsed and validated once; every judge has its own evaluator, going through the scheduler
+    of its provider, so each provider keeps its own concurrency and rate budget. Results are
+    yielded per judge as they complete, and a failing judge does not stop the others.
+    """
+
+    def __init__(self, evaluators: Dict[str, Evaluator]) -> None:
+        self.evaluators = evaluators
+
+    async def iter_results(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                           settings: EvaluationSettings, deduplicators: Dict[str, Deduplicator] = None
+                           ) -> AsyncIterator[Tuple[str, Optional[int], Optional[Conversation], Any]]:
+        """
+        Runs every judge over the conversations and yields (judge, row index, conversation,
+        result) tuples in completion order across judges. When a judge is done, a final
+        (judge, None, None, error) tuple is yielded, where error is None if the judge succeeded
+        and the exception that stopped it otherwise. Errors reading the conversations are raised.
+
+        :param conversations: The conversations to evaluate, as a list or an async stream.
+        :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+        :param settings: The settings of the evaluation.
+        :type settings: EvaluationSettings
+        :param deduplicators: Optional deduplicator of each judge, see `Evaluator.iter_results`.
+        :type deduplicators: Dict[str, Deduplicator], optional
+        :return: An async iterator over the results of all judges.
+        :rtype: AsyncIterator[Tuple[str, Optional[int], Optional[Conversation], Any]]
+        """
+
+        rows = SharedRows(conversations)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def run(judge: str, evaluator: Evaluator) -> None:
+            try:
+                deduplicator = (deduplicators or {}).get(judge)
+                async for index, conversation, result in evaluator.iter_results(
+                        rows.iterate(), judge_settings(settings, judge), deduplicator):
+                    results.put_nowait((judge, index, conversation, result))
+                results.put_nowait((judge, None, None, None))
+            except Exception as e:
+                logger.error(f"Judge {judge} failed: {str(e)}")
+                results.put_nowait((judge, None, None, e))
+
+        tasks = [asyncio.create_task(run(judge, evaluator)) for judge, evaluator in self.evaluators.items()]
+        if not rows.done:
+            tasks.append(asyncio.create_task(rows.fill()))
+
+        try:
+            remaining = len(self.evaluators)
+            while remaining:
+                item = await results.get()
+                if item[1] is None:
+                    # A broken upload fails every judge the same way, report it once
+                    if rows.error is not None:
+                        raise rows.error
+                    remaining -= 1
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def evaluate_stream(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                              settings: EvaluationSettings) -> Dict[str, Any]:
+        """
+        Evaluates the conversations with every judge and returns per-judge averages and
+        statistics, the inter-judge agreement (see `utils.aggregation.judge_agreement`) and the
+        conversations with the evaluation of every judge. Each judge deduplicates the rows on
+        its own and reports its `deduplication` summary. The top-level `average_scores`,
+        `statistics`, `deduplication` and per-message `evaluation` and `duplicate_of` are those
+        of the primary judge (`settings.model`), so single-judge clients keep working.
+
+        :param conversations: The conversations to evaluate, as a list or an async stream.
+        :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+        :param settings: The settings of the evaluation.
+        :type settings: EvaluationSettings
+        :return: The results of all judges and their agreement.
+        :rtype: Dict[str, Any]
+        """
+
+        started = time.perf_counter()
+        timings = start_timings() if settings.timings else None
+        aggregators = {judge: ScoreAggregator(settings.metrics) for judge in self.evaluators}
+        deduplicators = {
+            judge: Deduplicator(settings.dedup, settings.dedup_threshold) for judge in self.evaluators
+        } if settings.dedup != "off" else {}
+        evaluated: Dict[int, Tuple[Conversation, Dict[str, Any]]] = {}
+        errors: Dict[str, str] = {}
+
+        async for judge, index, conversation, result in self.iter_results(conversations, settings, deduplicators):
+            if index is None:
+                if result is not None:
+                    errors[judge] = str(result)
+                continue
+
+            with timed("aggregate"):
+                aggregators[judge].add(result, index)
+            evaluated.setdefault(index, (conversation, {}))[1][judge] = result.model_dump()
+
+        succeeded = {judge: aggregator for judge, aggregator in aggregators.items() if judge not in errors}
+
+        def summarize() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+            statistics = {judge: aggregator.statistics() for judge, aggregator in succeeded.items()}
+            return statistics, judge_agreement(succeeded) if len(succeeded) > 1 else {}
+
+        with timed("aggregate"):
+            statistics, agreement = await asyncio.to_thread(summarize)
+
+        judges = {
+            judge: {"error": errors[judge]} if judge in errors else {
+                "average_scores": aggregators[judge].average_scores(),
+                "statistics": statistics[judge],
+            }
+            for judge in self.evaluators
+        }
+        for judge, deduplicator in deduplicators.items():
+            judges[judge]["deduplication"] = deduplicator.stats()
+
+        primary_deduplicator = deduplicators.get(settings.model)
+
+        formatted_conversations = []
+        for index in sorted(evaluated):
+            conversation, evaluations = evaluated[index]
+            bot_message = {
+                "text": conversation.bot_response,
+                "sender": "bot",
+                "evaluation": evaluations.get(settings.model),
+                "evaluations": evaluations
+            }
+            if primary_deduplicator and index in primary_deduplicator.duplicate_of:
+                bot_message["duplicate_of"] = primary_deduplicator.duplicate_of[index]
+            formatted_conversations.extend([{"text": conversation.user_question, "sender": "user"}, bot_message])
+
+        primary = judges.get(settings.model, {})
+
+        evaluation = {
+            "average_scores": primary.get("average_scores", {}),
+            "statistics": primary.get("statistics", {}),
+            "judges": judges,
+            "agreement": agreement,
+            "conversations": formatted_conversations
+        }
+        if primary_deduplicator:
+            evaluation["deduplication"] = primary_deduplicator.stats()
+        if timings is not None:
+            evaluation["timings"] = {**report_timings(timings), "total": round((time.perf_counter() - started) * 1000, 3)}
+
+        return evaluation
@@ -1,11 +1,31 @@
+import atexit
+import copy
+import hashlib
 import logging
 import logging.config
+import logging.handlers
 import os
-import time
+import queue
+import random
+from contextvars import ContextVar
 from typing import Dict, Any
 from pythonjsonlogger import jsonlogger
 
 
+#   Prompt / response bodies longer than this are truncated in the logs
+PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 512))
+
+#   Fraction of LLM calls whose (truncated) bodies are logged, the others only log length and hash
+PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+
+#   Set for the duration of a request that opted into full prompt / response capture
+_payload_capture: ContextVar[bool] = ContextVar("payload_capture", default=False)
+
+_listeners = []
+
+#   Set in pre-forked worker processes, see `use_worker_log_files`
+_log_file_suffix = None
+
 
 class CustomJsonFormatter(jsonlogger.JsonFormatter):
     """
@@ -27,14 +47,136 @@ class CustomJsonFormatter(jsonlogger.JsonFormatter):
         """
         super().add_fields(log_record, record, message_dict)
         log_record.update({
-            "timestamp": int(time.time() * 1000),
+            # Records are formatted on the listener thread, so the time has to come from the record
+            "timestamp": int(record.created * 1000),
             "service.name": "llm_evaluation",
             "log.level": record.levelname,
-            "message": record.getMessage(),
+            "message": record.message,
             "function": record.funcName
         })
 
 
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the caller: records are dropped and counted when the queue
+    is full, e.g. when the disk cannot keep up with a burst of log lines.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the message arguments here; JSON formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def set_payload_capture(enabled: bool) -> None:
+    """
+    Turns full prompt / response capture on or off for the current context, i.e. the current
+    asyncio task and the tasks it creates afterwards.
+
+    :param enabled: Whether LLM payloads are logged in full.
+    :type enabled: bool
+    """
+
+    _payload_capture.set(enabled)
+
+
+def payload_mode() -> str:
+    """
+    Decides how the bodies of one LLM call are logged: "full" when the request opted into
+    capture, "sample" for a `PAYLOAD_SAMPLE_RATE` fraction of calls, "digest" otherwise. The
+    decision is taken once per call so a prompt and its response are logged the same way.
+
+    :return: The payload logging mode.
+    :rtype: str
+    """
+
+    if _payload_capture.get():
+        return "full"
+
+    return "sample" if random.random() < PAYLOAD_SAMPLE_RATE else "digest"
+
+
+def format_payload(text: Any, mode: str) -> str:
+    """
+    Renders a prompt or response body for the logs according to `payload_mode`. Bodies that are
+    not logged in full carry their length and a short SHA-256 digest, so identical payloads can
+    still be correlated across log lines.
+
+    :param text: The payload to render.
+    :type text: Any
+    :param mode: The payload logging mode, "full", "sample" or "digest".
+    :type mode: str
+    :return: The rendered payload.
+    :rtype: str
+    """
+
+    text = text if isinstance(text, str) else str(text)
+    if mode == "full":
+        return text
+
+    summary = f"<{len(text)} chars, sha256:{hashlib.sha256(text.encode()).hexdigest()[:16]}>"
+    if mode == "sample":
+        return text if len(text) <= PAYLOAD_MAX_CHARS else f"{text[:PAYLOAD_MAX_CHARS]}... {summary}"
+
+    return summary
+
+
+def _stop_listeners() -> None:
+    for listener in _listeners:
+        listener.stop()
+
+
+def _start_listeners() -> None:
+    for listener in _listeners:
+        listener.start()
+
+
+def _worker_log_file(log_file: str) -> str:
+    root, extension = os.path.splitext(log_file)
+    return f"{root}.{_log_file_suffix}{extension}" if _log_file_suffix else log_file
+
+
+def use_worker_log_files(suffix: str) -> None:
+    """
+    Moves the log files of this process to `{name}.{suffix}.log`. Pre-forked workers inherit
+    the file handlers of the parent, and processes rotating one file independently would
+    rename it under each other, so every worker writes and rotates its own file.
+
+    :param suffix: The name of the worker, e.g. "worker-1".
+    :type suffix: str
+    """
+
+    global _log_file_suffix
+
+    _log_file_suffix = suffix
+    for listener in _listeners:
+        for handler in listener.handlers:
+            if isinstance(handler, logging.FileHandler):
+                # The listener thread writes under the handler lock and reopens a closed stream
+                with handler.lock:
+                    if handler.stream:
+                        handler.stream.close()
+                        handler.stream = None
+                    handler.baseFilename = os.path.abspath(_worker_log_file(handler.baseFilename))
+
+
+# Listener threads do not survive a fork, and one holding its queue's lock at that moment would
+# leave the queue locked in the child: stop them around the fork and start them on both sides
+os.register_at_fork(before=_stop_listeners, after_in_parent=_start_listeners, after_in_child=_start_listeners)
+
+
 def setup_logger(name: str = None, log_level: str = "INFO", log_file: str = None):
     """
     Configures and sets up a logger for the application with specified logging level and
@@ -42,6 +184,12 @@ def setup_logger(name: str = None, log_level: str = "INFO", log_file: str = None
     simultaneously to the console (limited to error level and above) and a file in JSON
     format. The file handler will have a logging level based on the input provided.
 
+    Logging calls only put the record on a bounded in-memory queue; a background listener
+    thread formats the records and writes them, so file I/O never runs on the event loop. The
+    log file is rotated once it reaches `LOG_FILE_MAX_BYTES` (default 20 MB), keeping
+    `LOG_FILE_BACKUP_COUNT` (default 5) old files. Pre-forked workers each write their own
+    file, see `use_worker_log_files`.
+
     If no name is provided, it defaults to the name of the script being executed. If no
     log_file is specified, a default directory 'logs/' will be used and the file will be
     named according to the logger name with a `.log` extension.
@@ -66,6 +214,7 @@ def setup_logger(name: str = None, log_level: str = "INFO", log_file: str = None
 
     if not log_file:
         log_file = f"logs/{name}.log"
+    log_file = _worker_log_file(log_file)
 
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
@@ -85,13 +234,24 @@ def setup_logger(name: str = None, log_level: str = "INFO", log_file: str = None
     console_handler.setLevel("ERROR")
     console_handler.setFormatter(formatter)
 
-    # File handler
-    file_handler = logging.FileHandler(log_file)
+    # Rotating file handler
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=int(os.environ.get("LOG_FILE_MAX_BYTES", 20 * 1024 * 1024)),
+        backupCount=int(os.environ.get("LOG_FILE_BACKUP_COUNT", 5))
+    )
     file_handler.setLevel(log_level)
     file_handler.setFormatter(formatter)
 
-    # Add handlers to logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    # Both handlers run on the listener thread, the logger itself only enqueues
+    log_queue = queue.Queue(maxsize=int(os.environ.get("LOG_QUEUE_SIZE", 10_000)))
+    listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+
+    if not _listeners:
+        atexit.register(_stop_listeners)
+    _listeners.append(listener)
+
+    logger.addHandler(BoundedQueueHandler(log_queue))
 
     return logger
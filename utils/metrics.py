@@ -0,0 +1,317 @@
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+#   Default latency buckets in seconds, from fast cache-like replies to slow judge calls
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+#   Stages of the per-request timing breakdown, see `start_timings`
+TIMING_STAGES = ("ingest", "prompt_build", "llm_wait", "parse", "aggregate")
+
+#   Set for the duration of a request that asked for its timing breakdown
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("timings", default=None)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = (
+        name + '="' + str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    @abstractmethod
+    def samples(self) -> List[Sample]:
+        """
+        Returns the current (name, labels, value) samples of the metric.
+        """
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value per label set.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """
+    Value per label set that can go up and down.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values per label set, as cumulative bucket counts, a sum and a count.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # Per label set: one count per bucket plus +Inf, then the sum
+            values = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            values[bisect.bisect_left(self.buckets, value)] += 1
+            values[-1] += value
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(key, list(values)) for key, values in self._values.items()]
+
+        samples = []
+        for key, values in items:
+            labels = self._labels(key)
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), values[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, values[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class RateWindow:
+    """
+    Events per second over the last `seconds` seconds, kept in one slot per second.
+    """
+
+    def __init__(self, seconds: int = 60) -> None:
+        self.seconds = seconds
+        self._counts = [0] * seconds
+        self._stamps = [0] * seconds
+        self._lock = threading.Lock()
+
+    def add(self, count: int = 1) -> None:
+        now = int(time.time())
+        slot = now % self.seconds
+        with self._lock:
+            if self._stamps[slot] != now:
+                self._stamps[slot], self._counts[slot] = now, 0
+            self._counts[slot] += count
+
+    def rate(self) -> float:
+        now = int(time.time())
+        with self._lock:
+            total = sum(count for count, stamp in zip(self._counts, self._stamps) if now - stamp < self.seconds)
+        return total / self.seconds
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the process and renders them in the Prometheus text exposition
+    format. Besides the metrics updated as events happen, collectors registered with
+    `register_collector` are called at scrape time to report state owned by other components,
+    e.g. cache or scheduler statistics.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, _Metric] = {}
+        self.collectors: List[Callable[[], List[_Metric]]] = []
+
+    def _add(self, metric: _Metric) -> _Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def register_collector(self, collector: Callable[[], List[_Metric]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text format (version 0.0.4). A failing collector
+        is skipped so one broken component does not hide the other metrics.
+
+        :return: The exposition text.
+        :rtype: str
+        """
+
+        metrics = list(self.metrics.values())
+        for collector in self.collectors:
+            try:
+                metrics.extend(collector())
+            except Exception:
+                continue
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "llm_request_duration_seconds", "Duration of chat model calls, without scheduler queueing.", ["model"]
+)
+LLM_REQUESTS = REGISTRY.counter("llm_requests_total", "Chat model calls by outcome (ok or error).", ["model", "outcome"])
+LLM_IN_FLIGHT = REGISTRY.gauge("llm_requests_in_flight", "Chat model calls currently waiting for a reply.", ["model"])
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens reported in the usage metadata of chat model replies.", ["model", "direction"]
+)
+ROWS_EVALUATED = REGISTRY.counter("evaluation_rows_total", "Conversations evaluated.", ["model"])
+ROWS_PER_SECOND = RateWindow()
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests being handled.")
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to the response headers of HTTP requests.", ["method", "route", "status"]
+)
+
+
+def get_metrics() -> MetricsRegistry:
+    """
+    Returns the process-wide metrics registry.
+
+    :return: The shared metrics registry.
+    :rtype: MetricsRegistry
+    """
+
+    return REGISTRY
+
+
+def start_timings(*stages: str) -> Dict[str, float]:
+    """
+    Starts collecting the timing breakdown of the current request, i.e. the current asyncio
+    task and the tasks it creates afterwards. Stage times are summed over all rows, so stages
+    that overlap across concurrent rows (such as `llm_wait`) can exceed the wall-clock time.
+
+    :param stages: Stages of the request's pipeline collected in addition to `TIMING_STAGES`.
+    :type stages: str
+    :return: The seconds spent per stage, filled in as the request runs.
+    :rtype: Dict[str, float]
+    """
+
+    timings = dict.fromkeys(TIMING_STAGES + stages, 0.0)
+    _timings.set(timings)
+    return timings
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Adds the time spent in the block to `stage` of the current request's timing breakdown,
+    if the request asked for one.
+
+    :param stage: One of `TIMING_STAGES`.
+    :type stage: str
+    """
+
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] += time.perf_counter() - started
+
+
+def record_timing(stage: str, seconds: float) -> None:
+    # For time measured outside a `timed` block, e.g. a call shared by a batch of rows
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] += seconds
+
+
+def report_timings(timings: Dict[str, float]) -> Dict[str, float]:
+    # Milliseconds read better than seconds in a response body
+    return {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Tuple
+from utils.evaluation import build_chat_model, build_embeddings
+from utils.logs import setup_logger
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models.chat_models import BaseChatModel
+
+
+logger = setup_logger("evaluation")
+
+#   Attributes under which the LangChain chat models keep their SDK / HTTP clients
+_CLIENT_ATTRIBUTES = ("async_client", "client", "root_async_client", "root_client", "http_async_client", "http_client")
+
+_registry: Optional["ModelRegistry"] = None
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of long-lived model clients. Chat models are built once per
+    (model name, params) pair and reused across requests so their connection pools and TLS
+    sessions stay warm; the embedding model is only created the first time it is asked for.
+    """
+
+    def __init__(self) -> None:
+        self._chat_models: Dict[Tuple[str, str], BaseChatModel] = {}
+        self._embeddings: Optional[Embeddings] = None
+
+    @staticmethod
+    def _key(model_name: str, model_params: Dict[str, Any] = None) -> Tuple[str, str]:
+        return model_name, json.dumps(model_params or {}, sort_keys=True, default=str)
+
+    def chat(self, model_name: str, model_params: Dict[str, Any] = None) -> BaseChatModel:
+        """
+        Returns the shared chat model for `model_name` and `model_params`, building it on first use.
+
+        :param model_name: The name of the model, see `build_chat_model`.
+        :type model_name: str
+        :param model_params: Optional model configuration; `DEFAULT_MODEL_PARAMS` when omitted.
+        :type model_params: Dict[str, Any], optional
+        :return: The cached chat model.
+        :rtype: BaseChatModel
+        """
+
+        key = self._key(model_name, model_params)
+
+        if key not in self._chat_models:
+            self._chat_models[key] = build_chat_model(model_name, model_params)
+            logger.info(f"Registered chat model {model_name}")
+
+        return self._chat_models[key]
+
+    def embeddings(self) -> Embeddings:
+        """
+        Returns the shared embedding model, building it on first use.
+
+        :return: The cached embedding model.
+        :rtype: Embeddings
+        """
+
+        if self._embeddings is None:
+            self._embeddings = build_embeddings()
+
+        return self._embeddings
+
+    async def warmup(self, model_names: Iterable[str], ping: bool = False) -> None:
+        """
+        Builds the chat models for `model_names` ahead of the first request. With `ping`, a
+        one-word prompt is sent to each of them so DNS resolution and the TLS handshake also
+        happen at startup; this costs one request per model against the provider quota.
+
+        :param model_names: The models to build.
+        :type model_names: Iterable[str]
+        :param ping: Whether to send a request through each model.
+        :type ping: bool
+        """
+
+        models = [self.chat(model_name) for model_name in model_names if model_name]
+        if not ping:
+            return
+
+        from langchain_core.messages import HumanMessage
+
+        results = await asyncio.gather(
+            *[model.ainvoke([HumanMessage(content="ping")]) for model in models],
+            return_exceptions=True
+        )
+        for model, result in zip(models, results):
+            if isinstance(result, Exception):
+                logger.error(f"Warm-up request for {type(model).__name__} failed: {str(result)}")
+
+    async def aclose(self) -> None:
+        """
+        Closes the SDK clients held by every registered model and empties the registry.
+        """
+
+        for model in [*self._chat_models.values(), self._embeddings]:
+            for attribute in _CLIENT_ATTRIBUTES:
+                await _close_client(getattr(model, attribute, None))
+
+        self._chat_models.clear()
+        self._embeddings = None
+
+
+async def _close_client(client: Any) -> None:
+    if client is None:
+        return
+
+    # OpenAI/Groq resources such as `chat.completions` keep the HTTP client on `_client`
+    client = getattr(client, "_client", client)
+    close = getattr(client, "aclose", None) or getattr(client, "close", None)
+    if not callable(close):
+        return
+
+    try:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.error(f"Error closing model client {type(client).__name__}: {str(e)}")
+
+
+def get_registry() -> ModelRegistry:
+    """
+    Returns the process-wide model registry.
+
+    :return: The shared model registry.
+    :rtype: ModelRegistry
+    """
+
+    global _registry
+
+    if _registry is None:
+        _registry = ModelRegistry()
+
+    return _registry
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Tuple, Union
+from data_models.evaluation import Conversation, EvaluationResult, EvaluationSettings
+from utils.aggregation import RunningAggregator
+from utils.dedup import Deduplicator
+from utils.logs import setup_logger
+from utils.metrics import report_timings, start_timings, timed
+
+
+logger = setup_logger("evaluation")
+
+#   Result set states
+RUNNING, COMPLETED, FAILED = "running", "completed", "failed"
+
+_result_store: Optional["ResultStore"] = None
+
+
+class ResultRow:
+    """
+    Compact evaluated row, kept only until it is written to the `ResultStore`. Scores are a
+    float array aligned with the metrics of the evaluation, NaN where the judge gave none,
+    instead of a dict per row.
+    """
+
+    __slots__ = ("index", "user_question", "bot_response", "scores", "feedback", "duplicate_of")
+
+    def __init__(self, index: int, user_question: str, bot_response: str, scores: array, feedback: str,
+                 duplicate_of: Optional[int] = None) -> None:
+        self.index = index
+        self.user_question = user_question
+        self.bot_response = bot_response
+        self.scores = scores
+        self.feedback = feedback
+        self.duplicate_of = duplicate_of
+
+    @classmethod
+    def from_result(cls, index: int, conversation: Conversation, result: EvaluationResult, metrics: List[str],
+                    duplicate_of: Optional[int] = None) -> "ResultRow":
+        scores = array("d", (float(result.scores.get(metric, math.nan)) for metric in metrics))
+        return cls(index, conversation.user_question, conversation.bot_response, scores, result.feedback, duplicate_of)
+
+    def messages(self, metrics: List[str]) -> List[Dict[str, Any]]:
+        """
+        Formats the row as the user and bot messages of `Evaluator.evaluate_stream`.
+
+        :param metrics: The metrics of the evaluation, in the order of `scores`.
+        :type metrics: List[str]
+        :return: The two messages of the row.
+        :rtype: List[Dict[str, Any]]
+        """
+
+        bot_message = {
+            "text": self.bot_response,
+            "sender": "bot",
+            "evaluation": {
+                "scores": {metric: score for metric, score in zip(metrics, self.scores) if not math.isnan(score)},
+                "feedback": self.feedback,
+            },
+            "row": self.index,
+        }
+        if self.duplicate_of is not None:
+            bot_message["duplicate_of"] = self.duplicate_of
+
+        return [{"text": self.user_question, "sender": "user"}, bot_message]
+
+
+class ResultStore:
+    """
+    SQLite storage for the per-row results of evaluations too large to return in one response.
+    Rows are written in chunks while the evaluation runs and read back a page at a time; result
+    sets older than `ttl_seconds` are deleted when a new one is created.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 7 * 24 * 3600) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS result_sets (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                metrics TEXT NOT NULL,
+                rows INTEGER NOT NULL DEFAULT 0,
+                summary TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS result_rows (
+                set_id TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                user_question TEXT NOT NULL,
+                bot_response TEXT NOT NULL,
+                scores BLOB NOT NULL,
+                feedback TEXT NOT NULL,
+                duplicate_of INTEGER,
+                PRIMARY KEY (set_id, row_index)
+            );
+        """)
+        self._connection.commit()
+
+    def _execute(self, query: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+            self._connection.commit()
+            return rows
+
+    def create(self, settings: EvaluationSettings) -> str:
+        self.prune()
+        set_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO result_sets (id, status, metrics, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (set_id, RUNNING, json.dumps(settings.metrics), now, now)
+        )
+        return set_id
+
+    def add_rows(self, set_id: str, rows: List[ResultRow]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO result_rows "
+                "(set_id, row_index, user_question, bot_response, scores, feedback, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (set_id, row.index, row.user_question, row.bot_response, row.scores.tobytes(), row.feedback, row.duplicate_of)
+                    for row in rows
+                ]
+            )
+            self._connection.execute(
+                "UPDATE result_sets SET rows = rows + ?, updated_at = ? WHERE id = ?", (len(rows), time.time(), set_id)
+            )
+            self._connection.commit()
+
+    def finish(self, set_id: str, status: str, summary: Dict[str, Any] = None, error: str = None) -> None:
+        self._execute(
+            "UPDATE result_sets SET status = ?, summary = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(summary) if summary is not None else None, error, time.time(), set_id)
+        )
+
+    def get(self, set_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM result_sets WHERE id = ?", (set_id,))
+        if not rows:
+            return None
+
+        result_set = dict(rows[0])
+        result_set["metrics"] = json.loads(result_set["metrics"])
+        result_set["summary"] = json.loads(result_set["summary"]) if result_set["summary"] else None
+        return result_set
+
+    def page(self, set_id: str, offset: int, limit: int) -> List[ResultRow]:
+        """
+        Reads the rows with index `offset` and up, in row order. Rows are keyed by their index,
+        so every page is an index range scan however deep it is.
+
+        :param set_id: The id of the result set.
+        :type set_id: str
+        :param offset: The first row index of the page.
+        :type offset: int
+        :param limit: The maximum number of rows.
+        :type limit: int
+        :return: The rows of the page.
+        :rtype: List[ResultRow]
+        """
+
+        rows = self._execute(
+            "SELECT row_index, user_question, bot_response, scores, feedback, duplicate_of FROM result_rows "
+            "WHERE set_id = ? AND row_index >= ? ORDER BY row_index LIMIT ?",
+            (set_id, offset, limit)
+        )
+        return [
+            ResultRow(
+                row["row_index"], row["user_question"], row["bot_response"], array("d", row["scores"]),
+                row["feedback"], row["duplicate_of"]
+            )
+            for row in rows
+        ]
+
+    def delete(self, set_id: str) -> bool:
+        with self._lock:
+            deleted = self._connection.execute("DELETE FROM result_sets WHERE id = ?", (set_id,)).rowcount
+            self._connection.execute("DELETE FROM result_rows WHERE set_id = ?", (set_id,))
+            self._connection.commit()
+        return bool(deleted)
+
+    def prune(self) -> None:
+        with self._lock:
+            expired = [
+                row["id"] for row in self._connection.execute(
+                    "SELECT id FROM result_sets WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+                )
+            ]
+            for set_id in expired:
+                self._connection.execute("DELETE FROM result_sets WHERE id = ?", (set_id,))
+                self._connection.execute("DELETE FROM result_rows WHERE set_id = ?", (set_id,))
+            self._connection.commit()
+
+        if expired:
+            logger.info(f"Deleted {len(expired)} expired result sets")
+
+
+class ChunkedEvaluation:
+    """
+    Evaluation whose memory use does not depend on the number of rows. Conversations stream
+    through the evaluator's fixed window, every result is turned into a compact `ResultRow`
+    and written to the `ResultStore` in chunks of `chunk_rows`, and only running aggregates
+    (see `RunningAggregator`) are kept. The response holds the summary and the id of the
+    result set; the rows are read back page by page.
+
+    Duplicate grouping keeps the result of every group it remembers, so it is limited to the
+    `dedup_groups` most recently seen groups here; older duplicates are judged again.
+    """
+
+    #   Duplicate groups remembered, see `Deduplicator`
+    dedup_groups = int(os.environ.get("CHUNKED_DEDUP_GROUPS", 10_000))
+
+    def __init__(self, evaluator: Any, store: "ResultStore", chunk_rows: int = 500) -> None:
+        self.evaluator = evaluator
+        self.store = store
+        self.chunk_rows = chunk_rows
+
+    async def evaluate_stream(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                              settings: EvaluationSettings) -> Dict[str, Any]:
+        """
+        Evaluates the conversations and stores their results.
+
+        :param conversations: The conversations to evaluate, as a list or an async stream.
+        :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+        :param settings: The settings of the evaluation.
+        :type settings: EvaluationSettings
+        :return: The `result_id` and row count of the stored results, the average scores, their
+                 statistics and, when duplicates are grouped, the group counts.
+        :rtype: Dict[str, Any]
+        """
+
+        started = time.perf_counter()
+        timings = start_timings() if settings.timings else None
+        set_id = await asyncio.to_thread(self.store.create, settings)
+        aggregator = RunningAggregator(settings.metrics)
+        deduplicator = None
+        if settings.dedup != "off":
+            deduplicator = Deduplicator(settings.dedup, settings.dedup_threshold, max_groups=self.dedup_groups)
+        chunk: List[ResultRow] = []
+
+        try:
+            async for index, conversation, result in self.evaluator.iter_results(conversations, settings, deduplicator):
+                duplicate_of = deduplicator.duplicate_of.pop(index, None) if deduplicator else None
+                with timed("aggregate"):
+                    row = ResultRow.from_result(index, conversation, result, settings.metrics, duplicate_of)
+                    aggregator.add_scores(row.scores)
+                chunk.append(row)
+
+                if len(chunk) >= self.chunk_rows:
+                    await asyncio.to_thread(self.store.add_rows, set_id, chunk)
+                    chunk = []
+
+            await asyncio.to_thread(self.store.add_rows, set_id, chunk)
+
+            with timed("aggregate"):
+                evaluation = {
+                    "result_id": set_id,
+                    "rows": aggregator.count,
+                    "average_scores": aggregator.average_scores(),
+                    "statistics": aggregator.statistics(),
+                }
+            if deduplicator:
+                evaluation["deduplication"] = deduplicator.stats()
+
+            await asyncio.to_thread(self.store.finish, set_id, COMPLETED, evaluation)
+
+        except BaseException as e:
+            await asyncio.shield(asyncio.to_thread(self.store.finish, set_id, FAILED, None, str(e) or type(e).__name__))
+            raise
+
+        if timings is not None:
+            evaluation["timings"] = {**report_timings(timings), "total": round((time.perf_counter() - started) * 1000, 3)}
+
+        logger.info(f"Stored {aggregator.count} evaluated conversations as result set {set_id}")
+        return evaluation
+
+
+def get_result_store() -> ResultStore:
+    """
+    Returns the process-wide result store, opening it at EVALUATION_RESULTS_PATH on first use.
+    Result sets are kept for EVALUATION_RESULTS_TTL_SECONDS (default one week).
+
+    :return: The shared result store.
+    :rtype: ResultStore
+    """
+
+    global _result_store
+
+    if _result_store is None:
+        _result_store = ResultStore(
+            os.environ.get("EVALUATION_RESULTS_PATH", "storage/results.sqlite3"),
+            ttl_seconds=float(os.environ.get("EVALUATION_RESULTS_TTL_SECONDS", 7 * 24 * 3600))
+        )
+
+    return _result_store
@@ -0,0 +1,349 @@
+import asyncio
+import math
+import os
+import tempfile
+import time
+from array import array
+from statistics import NormalDist
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from data_models.evaluation import Conversation, EvaluationResult, EvaluationSettings
+from utils.aggregation import ScoreAggregator
+from utils.logs import setup_logger
+from utils.metrics import report_timings, start_timings, timed
+
+
+logger = setup_logger("evaluation")
+
+
+class StratifiedSampler:
+    """
+    Draws the rows of a sampled evaluation and keeps a running stratified estimate of the mean
+    of every metric with its confidence interval.
+
+    Rows are stratified by the length of the bot response (`strata` quantile buckets), which
+    tends to track answer quality, so the strata are more homogeneous than the whole dataset.
+    Within a stratum rows are drawn at random without replacement. Every stratum first gets
+    `pilot` rows; after that the next row goes to the stratum furthest below its Neyman
+    allocation (stratum size × observed score spread), so strata with noisy scores get more rows.
+    """
+
+    def __init__(self, lengths: Sequence[int], metrics: List[str], strata: int = 4, confidence: float = 0.95,
+                 seed: Optional[int] = None, pilot: int = 2) -> None:
+        self.metrics = list(metrics)
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.pilot = pilot
+        self.population = len(lengths)
+        self.stopped: Optional[str] = None
+
+        lengths = np.asarray(lengths, dtype=np.float64)
+        labels = np.zeros(len(lengths), dtype=np.int64)
+        if len(lengths) and strata > 1:
+            edges = np.unique(np.quantile(lengths, np.linspace(0, 1, strata + 1)[1:-1]))
+            labels = np.searchsorted(edges, lengths, side="right")
+
+        # Lengths with many ties can leave buckets empty, only the used ones become strata
+        _, self.labels = np.unique(labels, return_inverse=True)
+        rng = np.random.default_rng(seed)
+        self.rows = [rng.permutation(np.flatnonzero(self.labels == stratum)) for stratum in range(self.labels.max(initial=-1) + 1)]
+        self.sizes = np.array([len(rows) for rows in self.rows], dtype=np.float64)
+        self.drawn = np.zeros(len(self.rows), dtype=np.int64)
+
+        # Per stratum × metric: number, sum and sum of squares of the valid scores
+        self.counts = np.zeros((len(self.rows), len(self.metrics)))
+        self.sums = np.zeros_like(self.counts)
+        self.squares = np.zeros_like(self.counts)
+
+    @property
+    def sample_size(self) -> int:
+        return int(self.drawn.sum())
+
+    def _variances(self) -> np.ndarray:
+        # Sample variance per stratum × metric, NaN below two scores
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self.sums / self.counts
+            return np.maximum(self.squares - self.counts * means ** 2, 0.0) / (self.counts - 1)
+
+    def draw(self) -> Optional[int]:
+        """
+        Draws the next row to judge.
+
+        :return: The row index, or None when every row has been drawn.
+        :rtype: int, optional
+        """
+
+        available = self.drawn < self.sizes
+        if not available.any():
+            return None
+
+        pilot = available & (self.drawn < self.pilot)
+        if pilot.any():
+            candidates = np.flatnonzero(pilot)
+            stratum = int(candidates[np.argmin(self.drawn[candidates])])
+        else:
+            with np.errstate(invalid="ignore"):
+                spread = np.sqrt(self._variances())
+            spread = np.nanmean(np.where(np.isnan(spread).all(axis=1, keepdims=True), 1.0, spread), axis=1)
+            # A stratum whose few scores happen to agree keeps a share of the draws
+            spread = np.maximum(spread, 0.1 * spread.max()) if spread.max() > 0 else np.ones_like(spread)
+
+            target = np.where(available, self.sizes * spread, 0.0)
+            deficit = target / target.sum() * (self.sample_size + 1) - self.drawn
+            stratum = int(np.argmax(np.where(available, deficit, -np.inf)))
+
+        row = int(self.rows[stratum][self.drawn[stratum]])
+        self.drawn[stratum] += 1
+        return row
+
+    def add(self, row: int, scores: Dict[str, float]) -> None:
+        """
+        Adds the scores of a judged row; missing or non-finite scores are left out.
+
+        :param row: The row index returned by `draw`.
+        :type row: int
+        :param scores: The scores of the row keyed by metric.
+        :type scores: Dict[str, float]
+        """
+
+        stratum = self.labels[row]
+        for column, metric in enumerate(self.metrics):
+            score = scores.get(metric)
+            if isinstance(score, (int, float)) and math.isfinite(score):
+                self.counts[stratum, column] += 1
+                self.sums[stratum, column] += score
+                self.squares[stratum, column] += score * score
+
+    def estimates(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the stratified estimate of the mean of every metric with a score so far, and
+        its confidence interval. The interval uses the finite population correction, so fully
+        judged strata contribute no sampling error. It is None while some stratum that still
+        has rows to draw has fewer than two scores.
+
+        :return: The estimate, ci_low, ci_high, ci_width and count keyed by metric.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+
+        weights = self.sizes / max(self.population, 1)
+        variances = self._variances()
+        estimates = {}
+
+        for column, metric in enumerate(self.metrics):
+            counts = self.counts[:, column]
+            scored = counts > 0
+            if not scored.any():
+                continue
+
+            # Strata without any score are left out and the weights of the others rescaled
+            shares = weights[scored] / weights[scored].sum()
+            estimate = float(shares @ (self.sums[scored, column] / counts[scored]))
+
+            unsampled = (counts < 2) & (self.drawn < self.sizes)
+            margin = None
+            if not unsampled.any():
+                correction = 1 - counts[scored] / self.sizes[scored]
+                variance = np.nan_to_num(variances[scored, column])
+                margin = self.z * math.sqrt(float(np.sum(shares ** 2 * correction * variance / counts[scored])))
+
+            estimates[metric] = {
+                "estimate": estimate,
+                "ci_low": estimate - margin if margin is not None else None,
+                "ci_high": estimate + margin if margin is not None else None,
+                "ci_width": 2 * margin if margin is not None else None,
+                "count": int(counts.sum()),
+            }
+
+        return estimates
+
+    def converged(self, tolerance: float, min_rows: int) -> bool:
+        """
+        Whether the confidence interval of every metric is at most `tolerance` wide, once every
+        metric has at least `min_rows` scores.
+        """
+
+        estimates = self.estimates()
+        return len(estimates) == len(self.metrics) and all(
+            estimate["count"] >= min_rows and estimate["ci_width"] is not None and estimate["ci_width"] <= tolerance
+            for estimate in estimates.values()
+        )
+
+
+class SpooledConversations:
+    """
+    Conversations written to a temporary file as they are read. Only the file offset and the
+    response length of every row stay in memory, and a row is read back when it is drawn, so a
+    dump of millions of rows can be sampled without holding it.
+    """
+
+    def __init__(self) -> None:
+        self.file = tempfile.TemporaryFile()
+        self.offsets = array("q")
+        self.lengths = array("q")
+
+    def add(self, conversation: Conversation) -> None:
+        self.offsets.append(self.file.tell())
+        self.lengths.append(len(conversation.bot_response))
+        self.file.write(conversation.model_dump_json().encode() + b"\n")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, row: int) -> Conversation:
+        self.file.seek(self.offsets[row])
+        return Conversation.model_validate_json(self.file.readline())
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SampledEvaluation:
+    """
+    Sampled evaluation of a large set of conversations, see `StratifiedSampler`. Instead of
+    judging every row, rows are drawn one at a time as the evaluator's window frees up, and
+    drawing stops as soon as the confidence interval of every metric is at most
+    `sample_tolerance` wide, `sample_budget` rows have been judged, or no rows are left. Rows
+    already in flight when drawing stops are still judged and counted; at most `min_rows`, one
+    batch or half the judged rows, whichever is most, are in flight at once. Sampled runs are
+    not recorded in the benchmark store.
+    """
+
+    #   Fewest scores per metric before the tolerance can stop the sampling
+    min_rows = int(os.environ.get("SAMPLING_MIN_ROWS", 30))
+
+    def __init__(self, evaluator: Any) -> None:
+        self.evaluator = evaluator
+
+    async def iter_results(self, conversations: Sequence[Conversation], settings: EvaluationSettings,
+                           sampler: StratifiedSampler) -> AsyncIterator[Tuple[int, Conversation, EvaluationResult]]:
+        """
+        Judges sampled conversations until the sampling stops, yielding (row index, conversation,
+        result) tuples in completion order and adding every result to the sampler.
+
+        :param conversations: All conversations of the evaluation, e.g. `SpooledConversations`.
+        :type conversations: Sequence[Conversation]
+        :param settings: The settings of the evaluation, including the sampling settings.
+        :type settings: EvaluationSettings
+        :param sampler: The sampler drawing the rows; its `stopped` is set to why drawing stopped
+            ("tolerance", "budget" or "exhausted").
+        :type sampler: StratifiedSampler
+        :return: An async iterator over (row index, conversation, result) tuples.
+        :rtype: AsyncIterator[Tuple[int, Conversation, EvaluationResult]]
+        """
+
+        # utils.evaluation imports this module
+        from utils.evaluation import FLUSH_BATCH
+
+        # The evaluator numbers rows in the order it reads them; this maps them back to the dataset
+        order: List[int] = []
+        judged = 0
+        progress = asyncio.Event()
+
+        def in_flight_limit() -> int:
+            # In-flight rows are judged even when the tolerance is met meanwhile; keeping them
+            # to half the judged rows bounds the overshoot while the sample still ramps up fast.
+            # A full batch is always allowed, the evaluator only sends full batches on its own
+            return max(self.min_rows, settings.batch_size, judged // 2)
+
+        async def draw() -> AsyncIterator[Conversation]:
+            while True:
+                if len(order) - judged >= in_flight_limit():
+                    # Rows held back for a batch (or waiting on a duplicate) would never be judged
+                    yield FLUSH_BATCH
+                    while len(order) - judged >= in_flight_limit():
+                        progress.clear()
+                        await progress.wait()
+
+                if settings.sample_budget is not None and sampler.sample_size >= settings.sample_budget:
+                    sampler.stopped = "budget"
+                    return
+                if settings.sample_tolerance is not None and sampler.converged(settings.sample_tolerance, self.min_rows):
+                    sampler.stopped = "tolerance"
+                    return
+                row = sampler.draw()
+                if row is None:
+                    sampler.stopped = "exhausted"
+                    return
+                order.append(row)
+                yield conversations[row]
+
+        async for index, conversation, result in self.evaluator.iter_results(draw(), settings):
+            sampler.add(order[index], result.scores)
+            judged += 1
+            progress.set()
+            yield order[index], conversation, result
+
+    async def evaluate_stream(self, conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]],
+                              settings: EvaluationSettings) -> Dict[str, Any]:
+        """
+        Reads all conversations, judges a stratified sample of them and returns the same
+        structure as `Evaluator.evaluate_stream` for the judged rows, where `average_scores` are
+        the stratified estimates for the whole dataset, plus a `sampling` summary with the
+        dataset and sample sizes, why sampling stopped, and the confidence interval of every metric.
+
+        :param conversations: The conversations to sample from, as a list or an async stream.
+        :type conversations: Union[Iterable[Conversation], AsyncIterable[Conversation]]
+        :param settings: The settings of the evaluation, including the sampling settings.
+        :type settings: EvaluationSettings
+        :return: The sampled evaluation.
+        :rtype: Dict[str, Any]
+        """
+
+        started = time.perf_counter()
+        timings = start_timings() if settings.timings else None
+
+        # Rows are drawn at random, so the whole dataset has to be read first; it is spooled to
+        # disk and only the response lengths the strata are built from stay in memory
+        spool = SpooledConversations()
+        try:
+            with timed("ingest"):
+                if hasattr(conversations, "__aiter__"):
+                    async for conversation in conversations:
+                        spool.add(conversation)
+                else:
+                    for conversation in conversations:
+                        spool.add(conversation)
+
+            sampler = StratifiedSampler(
+                spool.lengths, settings.metrics,
+                strata=settings.sample_strata, confidence=settings.sample_confidence, seed=settings.sample_seed
+            )
+
+            evaluated = [item async for item in self.iter_results(spool, settings, sampler)]
+        finally:
+            spool.close()
+
+        aggregator = ScoreAggregator(settings.metrics)
+        evaluated.sort(key=lambda item: item[0])
+
+        formatted_conversations = []
+        for row, conversation, result in evaluated:
+            formatted_conversations.extend([
+                {"text": conversation.user_question, "sender": "user"},
+                {"text": conversation.bot_response, "sender": "bot", "evaluation": result.model_dump(), "row": row},
+            ])
+            with timed("aggregate"):
+                aggregator.add(result)
+
+        with timed("aggregate"):
+            estimates = sampler.estimates()
+            evaluation = {
+                "average_scores": {metric: estimate["estimate"] for metric, estimate in estimates.items()},
+                "statistics": await asyncio.to_thread(aggregator.statistics),
+                "sampling": {
+                    "population": sampler.population,
+                    "sample_size": len(evaluated),
+                    "strata": len(sampler.rows),
+                    "stopped": sampler.stopped,
+                    "confidence": settings.sample_confidence,
+                    "tolerance": settings.sample_tolerance,
+                    "budget": settings.sample_budget,
+                    "metrics": estimates,
+                },
+                "conversations": formatted_conversations
+            }
+        if timings is not None:
+            evaluation["timings"] = {**report_timings(timings), "total": round((time.perf_counter() - started) * 1000, 3)}
+
+        logger.info(f"Sampled {len(evaluated)} of {sampler.population} conversations, stopped on {sampler.stopped}")
+        return evaluation
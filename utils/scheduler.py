@@ -0,0 +1,376 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple, TypeVar
+from utils.logs import setup_logger
+from utils.workers import shared_state_path, worker_count
+
+
+logger = setup_logger("evaluation")
+
+T = TypeVar("T")
+
+#   Default limits per provider prefix. Each value can be overridden through the
+#   environment, e.g. GROQ_MAX_CONCURRENCY, GROQ_RPM or GROQ_TPM.
+PROVIDER_LIMITS: Dict[str, Dict[str, float]] = {
+    "gpt": {"max_concurrency": 32, "rpm": 500, "tpm": 200_000},
+    "gemini": {"max_concurrency": 16, "rpm": 300, "tpm": 1_000_000},
+    "groq": {"max_concurrency": 8, "rpm": 30, "tpm": 20_000},
+    #   Offline judge used for load tests, see `utils.fake_model`
+    "fake": {"max_concurrency": 256, "rpm": 1_000_000, "tpm": 1_000_000_000},
+}
+
+_schedulers: Dict[str, "ProviderScheduler"] = {}
+
+
+def get_provider(model_name: str) -> str:
+    """
+    Resolves the provider prefix of a model name. This is the same prefix `get_model` dispatches
+    on, so every model served by one provider shares a single scheduler and quota.
+
+    :param model_name: The name of the model, e.g. "gemini-2.0-flash" or "groq-llama-3.1-8b-instant".
+    :type model_name: str
+    :return: The provider prefix ("gpt", "gemini", "groq" or "fake").
+    :rtype: str
+    """
+
+    for provider in PROVIDER_LIMITS:
+        if model_name.startswith(provider):
+            return provider
+
+    raise ValueError("Unsupported model")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate used for tokens-per-minute accounting. Roughly four characters per
+    token holds well enough for English prompts and avoids running a tokenizer on the hot path.
+
+    :param text: The text to estimate.
+    :type text: str
+    :return: The estimated number of tokens.
+    :rtype: int
+    """
+
+    return len(text) // 4 + 1
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Checks whether an exception raised by a provider client signals throttling (HTTP 429,
+    exhausted quota). The exception chain is walked since LangChain often wraps the client error.
+
+    :param error: The exception raised by the model call.
+    :type error: BaseException
+    :return: True if the error is a rate-limit error.
+    :rtype: bool
+    """
+
+    while error is not None:
+        if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+            return True
+
+        name = type(error).__name__
+        if name in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+            return True
+
+        message = str(error).lower()
+        if "429" in message or "rate limit" in message or "resource exhausted" in message:
+            return True
+
+        error = error.__cause__ or error.__context__
+
+    return False
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `rate_per_minute`. Callers wait until enough
+    tokens are available; waiters are served in arrival order.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """
+        Waits until `amount` tokens are available and takes them from the bucket. Requests larger
+        than the bucket capacity are clamped so they can still go through on a full bucket.
+
+        :param amount: The number of tokens to take.
+        :type amount: float
+        """
+
+        amount = min(amount, self.capacity)
+
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+
+            self.tokens -= amount
+
+
+class SharedTokenBucket:
+    """
+    Token bucket with the same interface as `TokenBucket`, kept in an SQLite file so that all
+    worker processes of a host draw from one budget. The bucket is refilled and taken from in a
+    single write transaction; waiting happens outside of it, and waiters of one process are
+    served in arrival order.
+    """
+
+    def __init__(self, path: str, name: str, rate_per_minute: float, capacity: float = None) -> None:
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._lock = asyncio.Lock()
+        self._connection_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # Bucket state is worthless after a crash anyway, no need to sync every update to disk
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _take(self, amount: float) -> float:
+        # Takes `amount` tokens and returns 0, or returns how long to wait before they are available
+        with self._connection_lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._connection.execute(
+                    "SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+
+                wait = 0.0 if tokens >= amount else (amount - tokens) / self.rate
+                if not wait:
+                    tokens -= amount
+
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (self.name, tokens, now)
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+        return wait
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """
+        Waits until `amount` tokens are available and takes them from the shared bucket, see
+        `TokenBucket.acquire`.
+
+        :param amount: The number of tokens to take.
+        :type amount: float
+        """
+
+        amount = min(amount, self.capacity)
+
+        async with self._lock:
+            while (wait := await asyncio.to_thread(self._take, amount)) > 0:
+                await asyncio.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency gate with an AIMD limit: it grows by roughly one slot per window of successful
+    calls and halves when the provider throttles us, never going above `max_concurrency`.
+    Waiting callers are admitted lowest `priority` first, then in arrival order. A caller that
+    sends several requests at once takes one slot per request; when that is more than the
+    limit, it runs once nothing else is in flight.
+    """
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1) -> None:
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._cooldown_until = 0.0
+        self._waiters: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _fits(self, slots: int) -> bool:
+        return self.in_flight == 0 or self.in_flight + slots <= int(self.limit)
+
+    async def acquire(self, priority: int = 0, slots: int = 1) -> None:
+        if self._fits(slots) and not self._waiters:
+            self.in_flight += slots
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), slots, waiter))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slots may have been handed over right before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self.release(slots)
+            raise
+
+    def release(self, slots: int = 1) -> None:
+        self.in_flight -= slots
+        self._wake()
+
+    def _wake(self) -> None:
+        # Strictly in order, so a large batch is not overtaken by single calls forever
+        while self._waiters and (self._waiters[0][3].done() or self._fits(self._waiters[0][2])):
+            _, _, slots, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                self.in_flight += slots
+                waiter.set_result(None)
+
+    def on_success(self) -> None:
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def on_rate_limited(self) -> None:
+        # Calls that were already in flight when the provider started throttling fail together,
+        # so only the first failure in a cooldown window shrinks the limit.
+        now = time.monotonic()
+        if now < self._cooldown_until:
+            return
+
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        self._cooldown_until = now + 1.0
+        logger.warning(f"Rate limited, concurrency limit lowered to {int(self.limit)}")
+
+
+class ProviderScheduler:
+    """
+    Schedules LLM calls for one provider: a requests-per-minute bucket, a tokens-per-minute
+    bucket and an adaptive concurrency cap. Rate-limited calls are retried with exponential
+    backoff after the concurrency limit has been lowered. With a `shared_path`, the buckets
+    are shared with the other worker processes through that SQLite file.
+    """
+
+    def __init__(self, provider: str, max_concurrency: int, rpm: float, tpm: float,
+                 max_rate_limit_retries: int = 5, shared_path: str = None) -> None:
+        self.provider = provider
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        if shared_path:
+            self.requests = SharedTokenBucket(shared_path, f"{provider}:requests", rpm)
+            self.tokens = SharedTokenBucket(shared_path, f"{provider}:tokens", tpm)
+        else:
+            self.requests = TokenBucket(rpm)
+            self.tokens = TokenBucket(tpm)
+        self.max_rate_limit_retries = max_rate_limit_retries
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.limiter.in_flight,
+            "concurrency_limit": int(self.limiter.limit),
+            "waiting": len(self.limiter._waiters),
+        }
+
+    async def run(self, call: Callable[[], Awaitable[T]], tokens: int = 0, priority: int = 0, requests: int = 1,
+                  throttled: Callable[[T], bool] = None) -> T:
+        """
+        Runs `call` once a concurrency slot, a request slot and enough token budget are
+        available. Concurrency slots go to the lowest `priority` first, so interactive requests
+        are not starved by background jobs. The callable is invoked again for every retry, so it
+        must create a new awaitable each time.
+
+        :param call: Zero-argument callable returning the awaitable to schedule.
+        :type call: Callable[[], Awaitable[T]]
+        :param tokens: Estimated number of tokens the call consumes.
+        :type tokens: int
+        :param priority: Admission priority, lower values are served first.
+        :type priority: int
+        :param requests: Number of provider requests the call makes at once, e.g. the size of a
+            batch; each takes a concurrency slot and a request from the bucket.
+        :type requests: int
+        :param throttled: Optional check for rate limiting reported in the result rather than
+            raised, e.g. by `abatch` with `return_exceptions`. A throttled result lowers the
+            concurrency limit and is returned for the caller to retry what failed.
+        :type throttled: Callable[[T], bool], optional
+        :return: The result of the awaited call.
+        :rtype: T
+        """
+
+        for attempt in range(self.max_rate_limit_retries + 1):
+            await self.limiter.acquire(priority, slots=requests)
+            try:
+                await self.requests.acquire(requests)
+                if tokens:
+                    await self.tokens.acquire(tokens)
+
+                result = await call()
+            except Exception as e:
+                if attempt == self.max_rate_limit_retries or not is_rate_limit_error(e):
+                    raise
+                self.limiter.on_rate_limited()
+            else:
+                if throttled is not None and throttled(result):
+                    self.limiter.on_rate_limited()
+                else:
+                    self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release(requests)
+
+            backoff = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+            logger.warning(f"{self.provider} rate limited, retrying in {backoff:.1f}s (attempt {attempt + 1})")
+            await asyncio.sleep(backoff)
+
+
+def get_scheduler(model_name: str) -> ProviderScheduler:
+    """
+    Returns the process-wide scheduler for the provider serving `model_name`, creating it on
+    first use with the limits from `PROVIDER_LIMITS` and any environment overrides. When several
+    worker processes serve the app, the rate limits are enforced across all of them (see
+    `utils.workers.shared_state_path`) and each worker gets its share of the concurrency limit.
+
+    :param model_name: The name of the model being called.
+    :type model_name: str
+    :return: The scheduler shared by all models of that provider.
+    :rtype: ProviderScheduler
+    """
+
+    provider = get_provider(model_name)
+
+    if provider not in _schedulers:
+        limits = PROVIDER_LIMITS[provider]
+        prefix = provider.upper()
+        max_concurrency = int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", limits["max_concurrency"]))
+        _schedulers[provider] = ProviderScheduler(
+            provider=provider,
+            max_concurrency=max(1, -(-max_concurrency // worker_count())),
+            rpm=float(os.environ.get(f"{prefix}_RPM", limits["rpm"])),
+            tpm=float(os.environ.get(f"{prefix}_TPM", limits["tpm"])),
+            shared_path=shared_state_path(),
+        )
+
+    return _schedulers[provider]
+
+
+def scheduler_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Returns the concurrency statistics of every provider scheduler created so far.
+
+    :return: The statistics keyed by provider.
+    :rtype: Dict[str, Dict[str, float]]
+    """
+
+    return {provider: scheduler.stats() for provider, scheduler in _schedulers.items()}
@@ -0,0 +1,123 @@
+import os
+import signal
+import time
+from typing import Any, Dict, Optional, Tuple
+from utils.logs import setup_logger, use_worker_log_files
+
+
+logger = setup_logger("evaluation")
+
+#   Where worker processes share state when EVALUATION_SHARED_STATE_PATH is not set
+DEFAULT_SHARED_STATE_PATH = "storage/shared.sqlite3"
+
+
+def worker_count() -> int:
+    """
+    Number of server processes, from EVALUATION_WORKERS (default 1).
+
+    :return: The number of worker processes.
+    :rtype: int
+    """
+
+    return max(1, int(os.environ.get("EVALUATION_WORKERS", 1)))
+
+
+def shared_state_path() -> Optional[str]:
+    """
+    Path of the SQLite file through which the worker processes of one host share their provider
+    rate-limit buckets: EVALUATION_SHARED_STATE_PATH, or `DEFAULT_SHARED_STATE_PATH` when
+    several workers run. None for a single process, which keeps its buckets in memory.
+
+    :return: The path of the shared state file, if any.
+    :rtype: str, optional
+    """
+
+    path = os.environ.get("EVALUATION_SHARED_STATE_PATH")
+    if path or worker_count() > 1:
+        return path or DEFAULT_SHARED_STATE_PATH
+    return None
+
+
+def serve(app: Any, host: str, port: int, workers: int = 1) -> None:
+    """
+    Serves `app` with uvicorn from `workers` processes forked from this one once the app has
+    been imported. The workers share the imported modules copy-on-write, so the import cost is
+    paid once per host instead of once per worker as with `uvicorn --workers`, which spawns
+    fresh interpreters. All workers accept connections from one listening socket and log to
+    their own file, e.g. `logs/evaluation.worker-1.log`. A worker that exits is replaced, and
+    SIGINT/SIGTERM stop all of them. Where `os.fork` is not available a
+    single process serves the app.
+
+    :param app: The ASGI application.
+    :type app: Any
+    :param host: The interface to listen on.
+    :type host: str
+    :param port: The port to listen on.
+    :type port: int
+    :param workers: The number of worker processes.
+    :type workers: int
+    """
+
+    import uvicorn
+
+    config = uvicorn.Config(app, host=host, port=port)
+    if workers <= 1 or not hasattr(os, "fork"):
+        uvicorn.Server(config).run()
+        return
+
+    sock = config.bind_socket()
+    # Worker index and start time of every child, a replaced worker keeps the index
+    children: Dict[int, Tuple[int, float]] = {}
+    stopping = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # uvicorn installs its own SIGINT/SIGTERM handlers for a graceful shutdown
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            use_worker_log_files(f"worker-{index}")
+            code = 0
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(1, workers + 1):
+        spawn(index)
+    logger.info(f"Serving on {host}:{port} with {workers} worker processes")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        child = children.pop(pid, None)
+        if stopping or child is None:
+            continue
+
+        index, started = child
+        logger.warning(f"Worker {pid} exited with status {status}, starting a new one")
+        # A worker failing right at startup would otherwise be restarted in a tight loop
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+        spawn(index)
+
+    sock.close()